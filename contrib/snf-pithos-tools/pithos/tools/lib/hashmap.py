@@ -55,8 +55,12 @@ class HashMap(list):
         while s < len(h):
             s = s * 2
         h += [('\x00' * len(h[0]))] * (s - len(h))
-        while len(h) > 1:
-            h = [self._hash_raw(h[x] + h[x + 1]) for x in range(0, len(h), 2)]
+        # Reduce the tree in place, one level at a time.
+        n = len(h)
+        while n > 1:
+            for x in xrange(0, n, 2):
+                h[x / 2] = self._hash_raw(h[x] + h[x + 1])
+            n = n / 2
         return h[0]
 
     def load(self, fp):
@@ -199,7 +199,10 @@ def update_response_headers(request, response):
     if settings.DEBUG or getattr(settings, "TEST", False):
         response["Date"] = format_date_time(time())
 
-    if not response.has_header("Content-Length"):
+    # Streamed responses are sent without a Content-Length, as computing it
+    # would consume the whole response.
+    if not (response.has_header("Content-Length") or
+            getattr(response, "streaming", False)):
         _base_content_is_iter = getattr(response, '_base_content_is_iter',
                                         None)
         if (_base_content_is_iter is not None and not _base_content_is_iter):
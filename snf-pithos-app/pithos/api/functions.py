@@ -28,14 +28,15 @@ from pithos.api.util import (
     json_encode_decimal, rename_meta_key, format_header_key,
     printable_header_dict, get_account_headers, put_account_headers,
     get_container_headers, put_container_headers, get_object_headers,
-    put_object_headers, update_manifest_meta, update_sharing_meta,
-    update_public_meta, validate_modification_preconditions,
+    put_object_headers, update_sharing_meta, update_public_meta,
+    get_object_headers_meta, validate_modification_preconditions,
     validate_matching_preconditions, split_container_object_string,
     copy_or_move_object, get_int_parameter, get_content_length,
     get_content_range, socket_read_iterator, SaveToBackendHandler,
-    object_data_response, put_object_block, hashmap_md5, simple_list_response,
-    api_method, is_uuid, retrieve_uuid, retrieve_uuids,
-    retrieve_displaynames, Checksum, NoChecksum
+    object_data_response, put_object_block, hashmap_md5, cache_md5_states,
+    simple_list_response, api_method, is_uuid, retrieve_uuid, retrieve_uuids,
+    retrieve_displaynames, Checksum, NoChecksum, checksum_iterator,
+    stream_list_response, stream_response, MD5_CACHE
 )
 
 from pithos.api.settings import (UPDATE_MD5, TRANSLATE_UUIDS,
@@ -47,9 +48,14 @@ from pithos.backends.exceptions import ItemNotExists, ContainerExists
 
 from pithos.backends.filter import parse_filters
 
+from itertools import chain, islice
+
 import logging
 logger = logging.getLogger(__name__)
 
+# Objects fetched and serialized at a time by object_list.
+OBJECT_LIST_BATCH_SIZE = 1000
+
 
 def get_uuids(names):
     try:
@@ -590,38 +596,54 @@ def object_list(request, v_account, v_container):
             'PUblic object listing is not allowed to non path owners')
 
     if request.serialization == 'text':
-        objects = request.backend.list_objects(
+        objects = request.backend.iter_objects(
             request.user_uniq, v_account,
             v_container, prefix, delimiter, marker,
             limit, virtual, 'pithos', keys, shared,
             until, None, public_granted)
-
-        if len(objects) == 0:
-            # The cloudfiles python bindings expect 200 if json/xml.
-            response.status_code = 204
-            return response
-        response.status_code = 200
-        response.content = '\n'.join([x[0] for x in objects]) + '\n'
+        batches = _batches(x[0] for x in objects)
+    else:
+        objects = request.backend.iter_object_meta(
+            request.user_uniq, v_account, v_container, prefix, delimiter,
+            marker, limit, virtual, 'pithos', keys, shared, until, None,
+            public_granted)
+        batches = (_object_list_meta(request, v_account, v_container, until,
+                                     batch)
+                   for batch in _batches(objects))
+
+    # Handle the first batch here, so that errors are still reported.
+    first = list(islice(batches, 1))
+    if not first and request.serialization == 'text':
+        # The cloudfiles python bindings expect 200 if json/xml.
+        response.status_code = 204
         return response
+    response.status_code = 200
+    stream_response(request, response, stream_list_response(
+        request, v_container, chain(first, batches)))
+    return response
+
+
+def _batches(iterable):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, OBJECT_LIST_BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def _object_list_meta(request, v_account, v_container, until, objects):
+    """Format a batch of object meta dicts for object_list.
+
+    Permissions and public URLs are looked up for the batch.
+    """
 
-    objects = request.backend.list_object_meta(
-        request.user_uniq, v_account, v_container, prefix, delimiter,
-        marker, limit, virtual, 'pithos', keys, shared, until, None,
-        public_granted)
     object_permissions = {}
     object_public = {}
     if until is None:
-        name = '/'.join((v_account, v_container, ''))
-        name_idx = len(name)
-        objects_bulk = []
-        for x in request.backend.list_object_permissions(
-                request.user_uniq, v_account, v_container, prefix):
-
-            # filter out objects which are not under the container
-            if name != x[:name_idx]:
-                continue
-            objects_bulk.append(x[name_idx:])
-
+        names = [x['name'] for x in objects if 'name' in x]
+        objects_bulk = request.backend.list_object_permissions_bulk(
+            request.user_uniq, v_account, v_container, names)
         if len(objects_bulk) > 0:
             object_permissions = \
                 request.backend.get_object_permissions_bulk(
@@ -631,20 +653,26 @@ def object_list(request, v_account, v_container):
         if request.user_uniq == v_account:
             # Bring public information only if the request user
             # is the object owner
-            for k, v in request.backend.list_object_public(
+            name_idx = len('/'.join((v_account, v_container, '')))
+            for k, v in request.backend.list_object_public_bulk(
                     request.user_uniq, v_account,
-                    v_container, prefix).iteritems():
+                    v_container, names).iteritems():
                     object_public[k[name_idx:]] = v
 
+    displaynames = None
+    if TRANSLATE_UUIDS:
+        uuids = list(set(x['modified_by'] for x in objects
+                         if x.get('modified_by')))
+        displaynames = {}
+        if uuids:
+            displaynames = retrieve_displaynames(
+                getattr(request, 'token', None), uuids, return_dict=True)
+
     object_meta = []
     for meta in objects:
-        if TRANSLATE_UUIDS:
-            modified_by = meta.get('modified_by')
-            if modified_by:
-                l = retrieve_displaynames(
-                    getattr(request, 'token', None), [meta['modified_by']])
-                if l is not None and len(l) == 1:
-                    meta['modified_by'] = l[0]
+        modified_by = meta.get('modified_by')
+        if displaynames is not None and modified_by:
+            meta['modified_by'] = displaynames.get(modified_by)
 
         if len(meta) == 1:
             # Virtual objects/directories.
@@ -673,15 +701,7 @@ def object_list(request, v_account, v_container):
                 # is the object owner
                 update_public_meta(public_url, meta)
             object_meta.append(printable_header_dict(meta))
-
-    if request.serialization == 'xml':
-        data = render_to_string(
-            'objects.xml', {'container': v_container, 'objects': object_meta})
-    elif request.serialization == 'json':
-        data = json.dumps(object_meta, default=json_encode_decimal)
-    response.status_code = 200
-    response.content = data
-    return response
+    return object_meta
 
 
 @api_method('HEAD', user_required=True, logger=logger)
@@ -693,25 +713,8 @@ def object_meta(request, v_account, v_container, v_object):
     #                       badRequest (400)
 
     version = request.GET.get('version')
-    meta = request.backend.get_object_meta(request.user_uniq, v_account,
-                                           v_container, v_object,
-                                           'pithos', version)
-    if version is None:
-        permissions = request.backend.get_object_permissions(
-            request.user_uniq,
-            v_account, v_container, v_object)
-        public = request.backend.get_object_public(
-            request.user_uniq, v_account,
-            v_container, v_object)
-    else:
-        permissions = None
-        public = None
-
-    update_manifest_meta(request, v_account, meta)
-    update_sharing_meta(
-        request, permissions, v_account, v_container, v_object, meta)
-    if request.user_uniq == v_account:
-        update_public_meta(public, meta)
+    meta = get_object_headers_meta(request, v_account, v_container, v_object,
+                                   version)
 
     # Evaluate conditions.
     validate_modification_preconditions(request, meta)
@@ -762,25 +765,8 @@ def _object_read(request, v_account, v_container, v_object):
         response['Content-Length'] = len(data)
         return response
 
-    meta = request.backend.get_object_meta(request.user_uniq, v_account,
-                                           v_container, v_object,
-                                           'pithos', version)
-    if version is None:
-        permissions = request.backend.get_object_permissions(
-            request.user_uniq,
-            v_account, v_container, v_object)
-        public = request.backend.get_object_public(
-            request.user_uniq, v_account,
-            v_container, v_object)
-    else:
-        permissions = None
-        public = None
-
-    update_manifest_meta(request, v_account, meta)
-    update_sharing_meta(
-        request, permissions, v_account, v_container, v_object, meta)
-    if request.user_uniq == v_account:
-        update_public_meta(public, meta)
+    meta = get_object_headers_meta(request, v_account, v_container, v_object,
+                                   version)
 
     # Evaluate conditions.
     validate_modification_preconditions(request, meta)
@@ -801,19 +787,12 @@ def _object_read(request, v_account, v_container, v_object):
         try:
             src_container, src_name = split_container_object_string(
                 '/' + meta['X-Object-Manifest'])
-            objects = request.backend.list_objects(
-                request.user_uniq, v_account,
-                src_container, prefix=src_name, virtual=False)
         except ValueError:
             raise faults.BadRequest('Invalid X-Object-Manifest header')
 
-        for x in objects:
-            snap, s, h = \
-                request.backend.get_object_hashmap(
-                    request.user_uniq, v_account, src_container, x[0],
-                    x[1])
-            sizes.append(s)
-            hashmaps.append(h)
+        # The first segment hashmap is read here, the rest as data are sent.
+        sizes, hashmaps = request.backend.get_manifest_hashmaps(
+            request.user_uniq, v_account, src_container, src_name)
     else:
         snap, s, h = request.backend.get_object_hashmap(
             request.user_uniq, v_account,
@@ -923,13 +902,13 @@ def object_write(request, v_account, v_container, v_object):
         raise faults.LengthRequired('Missing Content-Type header')
 
     if 'hashmap' in request.GET:
-        data = ''
+        data = bytearray()
         for block in socket_read_iterator(request, content_length,
                                           request.backend.block_size):
-            data = ''.join([data, block])
+            data.extend(block)
 
         try:
-            d = json.loads(data)
+            d = json.loads(str(data))
             hashmap = d['hashes']
             size = int(d['bytes'])
         except:
@@ -937,21 +916,23 @@ def object_write(request, v_account, v_container, v_object):
         checksum = ''  # Do not set to None (will copy previous value).
     else:
         etag = request.META.get('HTTP_ETAG')
-        checksum_compute = Checksum() if etag or UPDATE_MD5 else NoChecksum()
-        size = 0
-        hashmap = []
-        for data in socket_read_iterator(request, content_length,
-                                         request.backend.block_size):
-            # TODO: Raise 408 (Request Timeout) if this takes too long.
-            # TODO: Raise 499 (Client Disconnect) if a length is defined
-            #       and we stop before getting this much data.
-            size += len(data)
-            hashmap.append(request.backend.put_block(data))
-            checksum_compute.update(data)
+        if UPDATE_MD5:
+            checksum_compute = Checksum(keep_states=MD5_CACHE is not None)
+        else:
+            checksum_compute = Checksum() if etag else NoChecksum()
+        # TODO: Raise 408 (Request Timeout) if this takes too long.
+        # TODO: Raise 499 (Client Disconnect) if a length is defined
+        #       and we stop before getting this much data.
+        data_iter = socket_read_iterator(request, content_length,
+                                         request.backend.block_size)
+        size, hashmap = request.backend.put_blocks(
+            checksum_iterator(data_iter, checksum_compute))
 
         checksum = checksum_compute.hexdigest()
         if etag and parse_etags(etag)[0].lower() != checksum:
             raise faults.UnprocessableEntity('Object ETag does not match')
+        cache_md5_states(hashmap, request.backend.block_size,
+                         checksum_compute)
 
     try:
         version_id, merkle = request.backend.update_object_hashmap(
@@ -1227,31 +1208,34 @@ def object_update(request, v_account, v_container, v_object):
                 length -= bl
                 sbi += 1
         else:
-            data = ''
+            data = bytearray()
             sbi = 0
             while length > 0:
                 if sbi < len(src_hashmap):
-                    data += request.backend.get_block(src_hashmap[sbi])
+                    data.extend(request.backend.get_block(src_hashmap[sbi]))
                 if length < request.backend.block_size:
-                    data = data[:length]
+                    del data[length:]
                 bytes = put_object_block(request, hashmap, data, offset,
                                          is_snapshot=src_is_snapshot)
                 offset += bytes
-                data = data[bytes:]
+                del data[:bytes]
                 length -= bytes
                 sbi += 1
     else:
-        data = ''
-        for d in socket_read_iterator(request, length,
-                                      request.backend.block_size):
+        block_size = request.backend.block_size
+        data = bytearray()
+        for d in socket_read_iterator(request, length, block_size):
             # TODO: Raise 408 (Request Timeout) if this takes too long.
             # TODO: Raise 499 (Client Disconnect) if a length is defined
             #       and we stop before getting this much data.
-            data += d
-            bytes = put_object_block(request, hashmap, data, offset,
-                                     is_snapshot=is_snapshot)
-            offset += bytes
-            data = data[bytes:]
+            data.extend(d)
+            # Put data once they reach the next block boundary, so that
+            # each block is updated once.
+            while len(data) >= block_size - offset % block_size:
+                bytes = put_object_block(request, hashmap, data, offset,
+                                         is_snapshot=is_snapshot)
+                offset += bytes
+                del data[:bytes]
         if len(data) > 0:
             bytes = put_object_block(request, hashmap, data, offset,
                                      is_snapshot=is_snapshot)
@@ -0,0 +1,108 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from django.core.management.base import CommandError
+
+from optparse import make_option
+from time import sleep
+
+from pithos.api.util import get_backend
+from pithos.backends.collector import (
+    GarbageCollector, DEFAULT_MIN_AGE, DEFAULT_CHUNK_SIZE, DEFAULT_BATCH_SIZE,
+    DEFAULT_ERROR_RATE)
+
+from snf_django.management.commands import SynnefoCommand
+
+backend = get_backend()
+
+
+class Command(SynnefoCommand):
+    help = """Remove the maps and blocks that no object version refers to.
+
+    Versions purged or dropped from history leave their maps and blocks
+    behind in the storage. This command marks the maps and blocks still
+    referenced, in Bloom filters of bounded size, and removes the rest
+    in throttled batches. Only maps and blocks older than --min-age are
+    removed, so that uploads in progress are not affected.
+
+    Collecting garbage is supported by the file block store
+    (pithos.backends.lib.filestore). With --interval the command keeps
+    running, collecting garbage periodically.
+
+    """
+    option_list = SynnefoCommand.option_list + (
+        make_option("--min-age", dest="min_age", type="int",
+                    default=DEFAULT_MIN_AGE,
+                    help="Only remove maps and blocks not modified for "
+                         "that many seconds"),
+        make_option("--chunk-size", dest="chunk_size", type="int",
+                    default=DEFAULT_CHUNK_SIZE,
+                    help="Number of versions marked per transaction"),
+        make_option("--batch-size", dest="batch_size", type="int",
+                    default=DEFAULT_BATCH_SIZE,
+                    help="Number of files removed per batch"),
+        make_option("--delay", dest="delay", type="float", default=0,
+                    help="Seconds to pause between batches of removals"),
+        make_option("--error-rate", dest="error_rate", type="float",
+                    default=DEFAULT_ERROR_RATE,
+                    help="False positive rate of the Bloom filters; higher "
+                         "rates use less memory but leave more garbage"),
+        make_option("--interval", dest="interval", type="int", default=0,
+                    help="Collect garbage every that many seconds, "
+                         "instead of once"),
+        make_option("--dry-run", dest="dry_run", action="store_true",
+                    default=False,
+                    help="Only count the unreferenced maps and blocks"),
+    )
+
+    def handle(self, **options):
+        for option in ('chunk_size', 'batch_size'):
+            if options[option] <= 0:
+                raise CommandError("--%s must be a positive integer" %
+                                   option.replace('_', '-'))
+        if options['min_age'] < 0 or options['delay'] < 0 or \
+                options['interval'] < 0:
+            raise CommandError("--min-age, --delay and --interval must not "
+                               "be negative")
+        if not 0 < options['error_rate'] < 1:
+            raise CommandError("--error-rate must be between 0 and 1")
+
+        try:
+            collector = GarbageCollector(
+                backend, min_age=options['min_age'],
+                chunk_size=options['chunk_size'],
+                batch_size=options['batch_size'], delay=options['delay'],
+                error_rate=options['error_rate'],
+                dry_run=options['dry_run'])
+        except NotImplementedError as e:
+            backend.close()
+            raise CommandError(e)
+
+        try:
+            while True:
+                maps, blocks = collector.collect()
+                self.stdout.write("Found %d unreferenced maps and %d "
+                                  "unreferenced blocks, removed %d and %d.\n"
+                                  % (maps[0], blocks[0], maps[1], blocks[1]))
+                if not options['interval']:
+                    break
+                sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        except BaseException as e:
+            raise CommandError(e)
+        finally:
+            backend.close()
@@ -0,0 +1,61 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import CommandError
+
+from optparse import make_option
+
+from pithos.api.util import get_backend
+
+from snf_django.management.commands import SynnefoCommand
+
+backend = get_backend()
+
+
+class Command(SynnefoCommand):
+    help = """Fold pending statistics deltas into the Pithos statistics.
+
+    Deltas are recorded instead of updating the statistics of the ancestors
+    of each modified node when PITHOS_BACKEND_DEFERRED_STATISTICS is set.
+    This command should run periodically to keep the deltas table small.
+
+    """
+    option_list = SynnefoCommand.option_list + (
+        make_option("--batch-size", dest="batch_size", type="int",
+                    default=10000,
+                    help="Number of deltas folded per transaction"),
+    )
+
+    def handle(self, **options):
+        batch_size = options['batch_size']
+        if batch_size <= 0:
+            raise CommandError("--batch-size must be a positive integer")
+
+        total = 0
+        while True:
+            try:
+                backend.pre_exec()
+                folded = backend.node.statistics_fold(limit=batch_size)
+            except BaseException as e:
+                backend.post_exec(False)
+                backend.close()
+                raise CommandError(e)
+            else:
+                backend.post_exec(True)
+            total += folded
+            if folded < batch_size:
+                break
+        backend.close()
+        self.stdout.write("Folded %d statistics deltas.\n" % total)
@@ -116,20 +116,8 @@ def public_read(request, v_public):
         try:
             src_container, src_name = split_container_object_string(
                 '/' + meta['X-Object-Manifest'])
-            objects = request.backend.list_objects(
-                request.user_uniq, v_account,
-                src_container, prefix=src_name, virtual=False)
-        except:
-            raise faults.ItemNotFound('Object does not exist')
-
-        try:
-            for x in objects:
-                _, s, h = request.backend.get_object_hashmap(request.user_uniq,
-                                                             v_account,
-                                                             src_container,
-                                                             x[0], x[1])
-                sizes.append(s)
-                hashmaps.append(h)
+            sizes, hashmaps = request.backend.get_manifest_hashmaps(
+                request.user_uniq, v_account, src_container, src_name)
         except:
             raise faults.ItemNotFound('Object does not exist')
     else:
@@ -112,12 +112,25 @@ BACKEND_DB_MODULE = getattr(
 BACKEND_DB_CONNECTION = getattr(settings, 'PITHOS_BACKEND_DB_CONNECTION',
                                 'sqlite:////tmp/pithos-backend.db')
 
+# The number of idle database connections kept open per worker, to be reused
+# by new backend instances instead of reconnecting. Pooled connections are
+# checked before use. Set to 0 to open a new connection for every backend
+# instance. It has no effect for SQLite.
+BACKEND_DB_POOL_SIZE = getattr(settings, 'PITHOS_BACKEND_DB_POOL_SIZE', 0)
+
 # Block storage.
 BACKEND_BLOCK_MODULE = getattr(
     settings, 'PITHOS_BACKEND_BLOCK_MODULE', 'pithos.backends.lib.hashfiler')
 BACKEND_BLOCK_PATH = getattr(
     settings, 'PITHOS_BACKEND_BLOCK_PATH', '/tmp/pithos-data/')
 BACKEND_BLOCK_UMASK = getattr(settings, 'PITHOS_BACKEND_BLOCK_UMASK', 0o022)
+# Flush blocks and maps to disk before acknowledging a write
+# (used by the 'pithos.backends.lib.filestore' block module).
+BACKEND_BLOCK_FSYNC = getattr(settings, 'PITHOS_BACKEND_BLOCK_FSYNC', True)
+# Read blocks bypassing the page cache (O_DIRECT), where supported
+# (used by the 'pithos.backends.lib.filestore' block module).
+BACKEND_BLOCK_DIRECT_IO = getattr(settings, 'PITHOS_BACKEND_BLOCK_DIRECT_IO',
+                                  False)
 
 
 # Default setting for new accounts.
@@ -138,6 +151,12 @@ BACKEND_POOL_SIZE = getattr(settings, 'PITHOS_BACKEND_POOL_SIZE', 5)
 # Update object checksums.
 UPDATE_MD5 = getattr(settings, 'PITHOS_UPDATE_MD5', False)
 
+# The maximum number of intermediate MD5 states each worker caches, by the
+# block hashes they cover, when updating object checksums. Updates then only
+# read the blocks after the first changed one. Set to 0 to disable the cache.
+UPDATE_MD5_CACHE_SIZE = getattr(settings, 'PITHOS_UPDATE_MD5_CACHE_SIZE',
+                                10000)
+
 RADOS_STORAGE = getattr(settings, 'PITHOS_RADOS_STORAGE', False)
 RADOS_POOL_BLOCKS = getattr(settings, 'PITHOS_RADOS_POOL_BLOCKS', 'blocks')
 RADOS_POOL_MAPS = getattr(settings, 'PITHOS_RADOS_POOL_MAPS', 'maps')
@@ -162,6 +181,91 @@ API_LIST_LIMIT = getattr(settings, 'PITHOS_API_LIST_LIMIT', 10000)
 BACKEND_BLOCK_SIZE = getattr(
     settings, 'PITHOS_BACKEND_BLOCK_SIZE', 4 * 1024 * 1024)
 
+# The size in bytes of the per worker cache of recently read blocks.
+# Set to 0 to disable the cache.
+BACKEND_BLOCK_CACHE_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_CACHE_SIZE', 0)
+
+# The size in bytes of the per worker cache of object hashmaps, stored as
+# packed digests. Set to 0 to disable the cache.
+BACKEND_MAP_CACHE_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_MAP_CACHE_SIZE', 16 * 1024 * 1024)
+
+# The size in bytes of the per worker cache of object Merkle trees, used to
+# rehash only the changed blocks of updated objects. Set to 0 to disable it.
+BACKEND_MERKLE_CACHE_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_MERKLE_CACHE_SIZE', 16 * 1024 * 1024)
+
+# The number of threads per worker that hash and store uploaded blocks while
+# the next ones are being received. Set to 0 to handle blocks in the request
+# thread. Threads are of no use with green (gevent/eventlet) workers.
+BACKEND_UPLOAD_WORKERS = getattr(settings, 'PITHOS_BACKEND_UPLOAD_WORKERS', 0)
+
+# Record container and account statistics changes as deltas instead of
+# updating the ancestor rows on every write. The deltas are folded into the
+# statistics by the 'snf-manage statistics-fold' command, which should run
+# periodically (e.g. from cron) when this is enabled.
+BACKEND_DEFERRED_STATISTICS = getattr(
+    settings, 'PITHOS_BACKEND_DEFERRED_STATISTICS', False)
+
+# The number of seconds the groups of a user are cached in each worker, to
+# check permissions without querying them on every request. Group changes
+# made through other workers may take this long to apply. Set to 0 to
+# disable the cache.
+BACKEND_PRINCIPALS_CACHE_TTL = getattr(
+    settings, 'PITHOS_BACKEND_PRINCIPALS_CACHE_TTL', 0)
+
+# The maximum number of users whose groups are cached in each worker.
+BACKEND_PRINCIPALS_CACHE_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_PRINCIPALS_CACHE_SIZE', 10000)
+
+# The number of bytes of 'pithos.diskspace' each worker reserves in advance
+# per user and project, to account for uploads without a commission to the
+# quotaholder each. Reserved space counts as used until it is spent or given
+# back, so the usage reported by the quotaholder (and compared by
+# 'snf-manage reconcile-resources-pithos') may exceed the actual one by this
+# much per worker. Set to 0 to issue a commission for every change.
+BACKEND_QUOTA_LEASE_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_QUOTA_LEASE_SIZE', 0)
+
+# The number of seconds after which unspent reserved space is given back
+# with the next commission of the same user and project. Reserved space is
+# journaled in the database and given back when a worker exits; the space
+# left by a worker that died is given back when another one starts on the
+# same host, or by any worker this many seconds after it expired.
+BACKEND_QUOTA_LEASE_TTL = getattr(
+    settings, 'PITHOS_BACKEND_QUOTA_LEASE_TTL', 300)
+
+# The number of seconds a background thread in each worker collects the
+# commissions of requests before resolving them with a single call to the
+# quotaholder. Commissions are registered before the response is sent and
+# are resolved shortly after; 'snf-manage reconcile-commissions-pithos'
+# resolves those left over by a worker that died. Set to 0 to resolve the
+# commissions of each request before responding.
+BACKEND_COMMISSION_RESOLVE_INTERVAL = getattr(
+    settings, 'PITHOS_BACKEND_COMMISSION_RESOLVE_INTERVAL', 0)
+
+# The number of seconds each worker serves the prepared metadata of an object
+# for HEAD and GET requests, as long as its latest version is unchanged.
+# Permission and public URL changes made through other workers may take this
+# long to apply. Set to 0 to disable the cache.
+BACKEND_META_CACHE_TTL = getattr(
+    settings, 'PITHOS_BACKEND_META_CACHE_TTL', 0)
+
+# The maximum number of objects whose metadata are cached in each worker.
+BACKEND_META_CACHE_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_META_CACHE_SIZE', 10000)
+
+# The maximum number of segments of manifest objects whose versions are
+# cached in each worker, for as long as no object under the manifest's
+# prefix changes. Set to 0 to disable the cache.
+BACKEND_MANIFEST_CACHE_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_MANIFEST_CACHE_SIZE', 0)
+
+# The number of blocks fetched ahead of the client when serving object data
+BACKEND_BLOCK_READ_AHEAD = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_READ_AHEAD', 8)
+
 # The backend block hash algorithm
 BACKEND_HASH_ALGORITHM = getattr(
     settings, 'PITHOS_BACKEND_HASH_ALGORITHM', 'sha256')
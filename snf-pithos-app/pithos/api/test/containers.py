@@ -25,6 +25,7 @@ from synnefo.lib import join_urls
 import django.utils.simplejson as json
 from django.http import urlencode
 
+from mock import MagicMock, patch
 from xml.dom import minidom
 from urllib import quote
 import time as _time
@@ -550,6 +551,95 @@ class ContainerGet(PithosAPITest):
             [n.firstChild.data for n in objects.getElementsByTagName('name')],
             ['/objectname'])
 
+    @patch('pithos.api.functions.OBJECT_LIST_BATCH_SIZE', 3)
+    def test_list_objects_in_batches(self):
+        cname = self.cnames[0]
+        names = sorted(self.objects[cname].keys())
+        url = join_urls(self.pithos_path, self.user, cname)
+
+        r = self.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content.split('\n'), names + [''])
+
+        r = self.get('%s?format=json' % url)
+        self.assertEqual(r.status_code, 200)
+        try:
+            objects = json.loads(r.content)
+        except:
+            self.fail('json format expected')
+        self.assertEqual([o['name'] for o in objects], names)
+
+        r = self.get('%s?format=xml' % url)
+        self.assertEqual(r.status_code, 200)
+        try:
+            objects = minidom.parseString(r.content)
+        except:
+            self.fail('xml format expected')
+        self.assertEqual(
+            [n.firstChild.data for n in objects.getElementsByTagName('name')],
+            names)
+
+    def test_list_objects_empty(self):
+        self.create_container('empty')
+        url = join_urls(self.pithos_path, self.user, 'empty')
+
+        r = self.get(url)
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(r.content, '')
+
+        r = self.get('%s?format=json' % url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(json.loads(r.content), [])
+
+        r = self.get('%s?format=xml' % url)
+        self.assertEqual(r.status_code, 200)
+        xml = minidom.parseString(r.content)
+        self.assertEqual(
+            xml.documentElement.attributes['name'].value, 'empty')
+        self.assertEqual(xml.getElementsByTagName('object'), [])
+
+    @patch('pithos.api.functions.OBJECT_LIST_BATCH_SIZE', 3)
+    def test_list_objects_closed_early(self):
+        url = join_urls(self.pithos_path, self.user, self.cnames[0])
+        r = self.get('%s?format=json' % url)
+        self.assertEqual(r.status_code, 200)
+        stream = r._container
+        self.assertEqual(iter(r).next(), '[')
+        self.assertNotEqual(stream.backend, None)
+        r.close()
+        self.assertEqual(stream.backend, None)
+
+    def test_backend_stream(self):
+        from pithos.api.util import BackendStream
+
+        # Closing ends the transaction once, as failed.
+        backend = MagicMock()
+        stream = BackendStream(backend, ['a', 'b'])
+        self.assertEqual(stream.next(), 'a')
+        self.assertFalse(backend.post_exec.called)
+        stream.close()
+        stream.close()
+        backend.post_exec.assert_called_once_with(False)
+        backend.close.assert_called_once_with()
+
+        backend = MagicMock()
+        self.assertEqual(list(BackendStream(backend, ['a', 'b'])),
+                         ['a', 'b'])
+        backend.post_exec.assert_called_once_with(True)
+        backend.close.assert_called_once_with()
+
+        # A backend error after the first batch truncates the body.
+        def body():
+            yield 'a'
+            raise IOError
+
+        backend = MagicMock()
+        stream = BackendStream(backend, body())
+        self.assertEqual(stream.next(), 'a')
+        self.assertRaises(IOError, stream.next)
+        backend.post_exec.assert_called_once_with(False)
+        backend.close.assert_called_once_with()
+
     def test_list_objects_with_limit_marker(self):
         cname = self.cnames[0]
         url = join_urls(self.pithos_path, self.user, cname)
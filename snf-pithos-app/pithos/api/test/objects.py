@@ -21,6 +21,7 @@ from collections import defaultdict
 from urllib import quote, unquote
 from functools import partial
 from unittest import skipIf
+from mock import ANY, MagicMock, patch
 
 from pithos.api.test import (PithosAPITest, pithos_settings,
                              AssertMappingInvariant, AssertUUidInvariant,
@@ -29,10 +30,13 @@ from pithos.api.test import (PithosAPITest, pithos_settings,
 from pithos.api.test.util import (md5_hash, merkle, strnextling,
                                   get_random_data, get_random_name, HashMap)
 
+from pithos.backends.cache import LRUCache
+
 from synnefo.lib import join_urls
 
 import django.utils.simplejson as json
 
+import hashlib
 import random
 import re
 import datetime
@@ -1964,6 +1968,80 @@ class ObjectPost(PithosAPITest):
         self.assertEqual(len(content), len(self.object_data) + length)
         self.assertEqual(content, self.object_data + data)
 
+    def test_append_etag(self):
+        url = join_urls(self.pithos_path, self.user, self.container,
+                        self.object)
+        updated_data = self.object_data
+        for i in range(2):
+            data = get_random_data()
+            r = self.post(url, data=data,
+                          content_type='application/octet-stream',
+                          HTTP_CONTENT_LENGTH=str(len(data)),
+                          HTTP_CONTENT_RANGE='bytes */*')
+            self.assertEqual(r.status_code, 204)
+            updated_data += data
+            if pithos_settings.UPDATE_MD5:
+                etag = md5_hash(updated_data)
+            else:
+                etag = merkle(updated_data)
+            self.assertEqual(r['ETag'], etag)
+
+    def test_append_etag_md5_block_boundary(self):
+        cache = LRUCache(100, sizeof=lambda x: 1)
+        with patch('pithos.api.functions.UPDATE_MD5', True), \
+                patch('pithos.api.functions.MD5_CACHE', cache), \
+                patch('pithos.api.util.MD5_CACHE', cache):
+            oname, data, r = self.upload_object(
+                self.container, length=2 * TEST_BLOCK_SIZE)
+            self.assertEqual(r['ETag'], md5_hash(data))
+            self.assertEqual(len(cache), 2)
+
+            # The object ends exactly on a block boundary before each append.
+            url = join_urls(self.pithos_path, self.user, self.container,
+                            oname)
+            for length in (TEST_BLOCK_SIZE, TEST_BLOCK_SIZE / 2):
+                appended = get_random_data(length)
+                r = self.post(url, data=appended,
+                              content_type='application/octet-stream',
+                              HTTP_CONTENT_LENGTH=str(length),
+                              HTTP_CONTENT_RANGE='bytes */*')
+                self.assertEqual(r.status_code, 204)
+                data += appended
+                self.assertEqual(r['ETag'], md5_hash(data))
+            r = self.head(url)
+            self.assertEqual(r['ETag'], md5_hash(data))
+
+    def test_hashmap_md5_cached_prefix(self):
+        # Imported here, as the backend pool is set up along with util.
+        from pithos.api.util import Checksum, cache_md5_states, hashmap_md5
+
+        blocks = [get_random_data(TEST_BLOCK_SIZE) for i in range(3)]
+        blocks.append(get_random_data(TEST_BLOCK_SIZE / 2))
+        hashmap = [hashlib.sha256(b).hexdigest() for b in blocks]
+        size = len(''.join(blocks))
+        stored = dict(zip(hashmap, blocks))
+        backend = MagicMock(block_size=TEST_BLOCK_SIZE)
+        backend.get_blocks.side_effect = \
+            lambda hashes, window=None: (stored[h] for h in hashes)
+
+        checksum = Checksum(keep_states=True)
+        for block in blocks[:2]:
+            checksum.update(block)
+        with patch('pithos.api.util.MD5_CACHE',
+                   LRUCache(100, sizeof=lambda x: 1)):
+            cache_md5_states(hashmap, TEST_BLOCK_SIZE, checksum)
+            self.assertEqual(hashmap_md5(backend, hashmap, size),
+                             md5_hash(''.join(blocks)))
+            backend.get_blocks.assert_called_once_with(hashmap[2:],
+                                                       window=ANY)
+
+            # The state after the last full block is now cached too.
+            backend.get_blocks.reset_mock()
+            self.assertEqual(hashmap_md5(backend, hashmap, size),
+                             md5_hash(''.join(blocks)))
+            backend.get_blocks.assert_called_once_with(hashmap[3:],
+                                                       window=ANY)
+
     # TODO Fix the test
     def _test_update_with_chunked_transfer(self):
         data = get_random_data()
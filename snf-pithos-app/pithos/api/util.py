@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from functools import wraps, partial
+from itertools import islice, izip
 from datetime import datetime
 from urllib import quote, unquote, urlencode
 from urlparse import urlunsplit, urlsplit, parse_qsl
@@ -24,8 +25,7 @@ from django.template.loader import render_to_string
 from django.utils import simplejson as json
 from django.utils.http import http_date, parse_etags
 from django.utils.encoding import smart_unicode, smart_str
-smart_unicode_ = partial(smart_unicode, strings_only=True)
-smart_str_ = partial(smart_str, strings_only=True)
+from django.utils.html import escape
 
 from django.core.files.uploadhandler import FileUploadHandler
 from django.core.files.uploadedfile import UploadedFile
@@ -37,7 +37,24 @@ from snf_django.lib import api
 from snf_django.lib.api import faults, utils
 
 from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
-                                 BACKEND_BLOCK_MODULE,
+                                 BACKEND_BLOCK_MODULE, BACKEND_BLOCK_PATH,
+                                 BACKEND_BLOCK_UMASK, BACKEND_BLOCK_FSYNC,
+                                 BACKEND_BLOCK_DIRECT_IO,
+                                 BACKEND_BLOCK_READ_AHEAD,
+                                 BACKEND_BLOCK_CACHE_SIZE,
+                                 BACKEND_MAP_CACHE_SIZE,
+                                 BACKEND_MERKLE_CACHE_SIZE,
+                                 BACKEND_UPLOAD_WORKERS,
+                                 BACKEND_DEFERRED_STATISTICS,
+                                 BACKEND_PRINCIPALS_CACHE_TTL,
+                                 BACKEND_PRINCIPALS_CACHE_SIZE,
+                                 BACKEND_QUOTA_LEASE_SIZE,
+                                 BACKEND_QUOTA_LEASE_TTL,
+                                 BACKEND_COMMISSION_RESOLVE_INTERVAL,
+                                 BACKEND_META_CACHE_TTL,
+                                 BACKEND_META_CACHE_SIZE,
+                                 BACKEND_MANIFEST_CACHE_SIZE,
+                                 BACKEND_DB_POOL_SIZE,
                                  ASTAKOSCLIENT_POOLSIZE,
                                  SERVICE_TOKEN,
                                  ASTAKOS_AUTH_URL,
@@ -54,11 +71,16 @@ from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
                                  RADOS_POOL_MAPS, TRANSLATE_UUIDS,
                                  PUBLIC_URL_SECURITY, PUBLIC_URL_ALPHABET,
                                  BASE_HOST, UPDATE_MD5, VIEW_PREFIX,
+                                 UPDATE_MD5_CACHE_SIZE,
                                  OAUTH2_CLIENT_CREDENTIALS, UNSAFE_DOMAIN,
                                  RESOURCE_MAX_METADATA, ACC_MAX_GROUPS,
                                  ACC_MAX_GROUP_MEMBERS)
 
 from pithos.backends import connect_backend
+from pithos.backends.util import PithosBackendPool
+from pithos.backends.cache import LRUCache
+from pithos.backends.leases import QuotaLeases
+from pithos.backends.commissions import CommissionResolver
 from pithos.backends.exceptions import (NotAllowedError, QuotaError,
                                         ItemNotExists, VersionNotExists,
                                         IllegalOperationError, LimitExceeded,
@@ -77,6 +99,9 @@ import hashlib
 import uuid
 import decimal
 
+smart_unicode_ = partial(smart_unicode, strings_only=True)
+smart_str_ = partial(smart_str, strings_only=True)
+
 logger = logging.getLogger(__name__)
 
 
@@ -271,13 +296,10 @@ def update_manifest_meta(request, v_account, meta):
         try:
             src_container, src_name = split_container_object_string(
                 '/' + meta['X-Object-Manifest'])
-            objects = request.backend.list_objects(
-                request.user_uniq, v_account,
-                src_container, prefix=src_name, virtual=False)
-            for x in objects:
-                src_meta = request.backend.get_object_meta(
-                    request.user_uniq, v_account, src_container, x[0],
-                    'pithos', x[1])
+            objects = request.backend.iter_object_meta(
+                request.user_uniq, v_account, src_container,
+                prefix=src_name, virtual=False, limit=None)
+            for src_meta in objects:
                 etag += (src_meta['hash'] if not UPDATE_MD5 else
                          src_meta['checksum'])
                 bytes += src_meta['bytes']
@@ -421,6 +443,49 @@ def update_public_meta(public, meta):
         BASE_HOST, reverse('pithos.api.public.public_demux', args=(public,)))
 
 
+def get_object_headers_meta(request, v_account, v_container, v_object,
+                            version=None):
+    """Return the object metadata to put in the response headers.
+
+    The metadata of the latest version are cached per user in the backend's
+    meta_cache, if enabled, and served again while the version tag
+    of the object is unchanged.
+    """
+
+    backend = request.backend
+    cache = backend.meta_cache if version is None else None
+    if cache is not None:
+        tag = backend.get_object_version_tag(request.user_uniq, v_account,
+                                             v_container, v_object)
+        key = (request.user_uniq, v_account, v_container, v_object)
+        cached = cache.get(key)
+        if cached is not None and tag is not None and cached[0] == tag:
+            return dict(cached[1])
+
+    meta = backend.get_object_meta(request.user_uniq, v_account,
+                                   v_container, v_object, 'pithos', version)
+    if version is None:
+        permissions = backend.get_object_permissions(
+            request.user_uniq, v_account, v_container, v_object)
+        public = backend.get_object_public(
+            request.user_uniq, v_account, v_container, v_object)
+    else:
+        permissions = None
+        public = None
+
+    update_manifest_meta(request, v_account, meta)
+    update_sharing_meta(
+        request, permissions, v_account, v_container, v_object, meta)
+    if request.user_uniq == v_account:
+        update_public_meta(public, meta)
+
+    # Manifest metadata depend on the parts, so they are never cached.
+    if (cache is not None and tag is not None and
+            'X-Object-Manifest' not in meta):
+        cache.put(key, (tag, dict(meta)))
+    return meta
+
+
 def validate_modification_preconditions(request, meta):
     """Check the modified timestamp conforms with the preconditions set."""
 
@@ -702,9 +767,101 @@ def raw_input_socket(request):
 MAX_UPLOAD_SIZE = 5 * (1024 * 1024 * 1024)  # 5GB
 
 
+def sock_readinto(sock):
+    """Return a function reading data from sock into a writable buffer."""
+
+    readinto = getattr(sock, 'readinto', None)
+    if readinto is not None:
+        return readinto
+
+    def readinto(b):
+        data = sock.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+    return readinto
+
+
+class ChunkedReader(object):
+    """Read the data of a chunked transfer encoded request body.
+
+    Input is read in large pieces into a fixed size buffer and the chunk
+    framing is stripped while copying data out with readinto.
+    """
+
+    def __init__(self, sock, bufsize=64 * 1024):
+        self.sock_readinto = sock_readinto(sock)
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.start = 0  # Unread data are in buf[start:end].
+        self.end = 0
+        self.chunk_left = 0
+        self.done = False
+
+    def _fill(self):
+        """Read more input into the buffer. Return False at end of input."""
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            n = self.end - self.start
+            self.view[:n] = self.view[self.start:self.end]
+            self.start, self.end = 0, n
+        n = self.sock_readinto(self.view[self.end:])
+        if not n:
+            return False
+        self.end += n
+        return True
+
+    def _readline(self):
+        while True:
+            pos = self.buf.find('\n', self.start, self.end)
+            if pos >= 0:
+                line = str(self.buf[self.start:pos + 1])
+                self.start = pos + 1
+                return line
+            if self.end - self.start == len(self.buf) or not self._fill():
+                raise faults.BadRequest('Bad chunk size')
+
+    def _next_chunk(self):
+        chunk_length = self._readline()
+        pos = chunk_length.find(';')
+        if pos >= 0:
+            chunk_length = chunk_length[:pos]
+        try:
+            self.chunk_left = int(chunk_length, 16)
+        except ValueError:
+            # TODO: Change to something more appropriate.
+            raise faults.BadRequest('Bad chunk size')
+        if self.chunk_left == 0:
+            self.done = True
+
+    def readinto(self, b):
+        """Read data into b. Return the number of bytes read, 0 when all
+        the chunks have been read."""
+
+        n = 0
+        size = len(b)
+        while n < size and not self.done:
+            if self.chunk_left == 0:
+                self._next_chunk()
+                continue
+            if self.start == self.end and not self._fill():
+                raise faults.BadRequest('Incomplete chunk')
+            l = min(size - n, self.chunk_left, self.end - self.start)
+            b[n:n + l] = self.view[self.start:self.start + l]
+            n += l
+            self.start += l
+            self.chunk_left -= l
+            if self.chunk_left == 0:
+                self._readline()  # CRLF
+        return n
+
+
 def socket_read_iterator(request, length=0, blocksize=4096):
-    """Return maximum of blocksize data read from the socket in each iteration
+    """Return blocksize data read from the socket in each iteration
 
+    Every block but the last is exactly blocksize long. Blocks are fresh
+    bytearrays, so they can be kept by the caller.
     Read up to 'length'. If 'length' is negative, will attempt a chunked read.
     The maximum ammount of data read is controlled by MAX_UPLOAD_SIZE.
     """
@@ -714,59 +871,38 @@ def socket_read_iterator(request, length=0, blocksize=4096):
         # Small version (server does the dechunking).
         if (request.environ.get('mod_wsgi.input_chunked', None)
                 or request.META['SERVER_SOFTWARE'].startswith('gunicorn')):
-            while length < MAX_UPLOAD_SIZE:
-                data = sock.read(blocksize)
-                if data == '':
-                    return
-                yield data
-            raise faults.BadRequest('Maximum size is reached')
-
+            readinto = sock_readinto(sock)
         # Long version (do the dechunking).
-        data = ''
-        while length < MAX_UPLOAD_SIZE:
-            # Get chunk size.
-            if hasattr(sock, 'readline'):
-                chunk_length = sock.readline()
-            else:
-                chunk_length = ''
-                while chunk_length[-1:] != '\n':
-                    chunk_length += sock.read(1)
-                chunk_length.strip()
-            pos = chunk_length.find(';')
-            if pos >= 0:
-                chunk_length = chunk_length[:pos]
-            try:
-                chunk_length = int(chunk_length, 16)
-            except Exception:
-                # TODO: Change to something more appropriate.
-                raise faults.BadRequest('Bad chunk size')
-            # Check if done.
-            if chunk_length == 0:
-                if len(data) > 0:
-                    yield data
-                return
-            # Get the actual data.
-            while chunk_length > 0:
-                chunk = sock.read(min(chunk_length, blocksize))
-                chunk_length -= len(chunk)
-                if length > 0:
-                    length += len(chunk)
-                data += chunk
-                if len(data) >= blocksize:
-                    ret = data[:blocksize]
-                    data = data[blocksize:]
-                    yield ret
-            sock.read(2)  # CRLF
-        raise faults.BadRequest('Maximum size is reached')
+        else:
+            readinto = ChunkedReader(sock).readinto
     else:
         if length > MAX_UPLOAD_SIZE:
             raise faults.BadRequest('Maximum size is reached')
-        while length > 0:
-            data = sock.read(min(length, blocksize))
-            if not data:
+        readinto = sock_readinto(sock)
+
+    total = 0
+    while length < 0 or total < length:
+        size = blocksize if length < 0 else min(blocksize, length - total)
+        block = bytearray(size)
+        view = memoryview(block)
+        n = 0
+        while n < size:
+            r = readinto(view[n:])
+            if not r:
+                break
+            n += r
+        del view
+        if n < size:
+            if length >= 0:
                 raise faults.BadRequest()
-            length -= len(data)
-            yield data
+            del block[n:]
+        total += n
+        if total > MAX_UPLOAD_SIZE:
+            raise faults.BadRequest('Maximum size is reached')
+        if n > 0:
+            yield block
+        if n < size:
+            return
 
 
 class SaveToBackendHandler(FileUploadHandler):
@@ -785,7 +921,8 @@ class SaveToBackendHandler(FileUploadHandler):
 
     def new_file(self, field_name, file_name, content_type,
                  content_length, charset=None):
-        self.checksum_compute = NoChecksum() if not UPDATE_MD5 else Checksum()
+        self.checksum_compute = (NoChecksum() if not UPDATE_MD5 else
+                                 Checksum(keep_states=MD5_CACHE is not None))
         self.data = ''
         self.file = UploadedFile(
             name=file_name, content_type=content_type, charset=charset)
@@ -803,6 +940,8 @@ class SaveToBackendHandler(FileUploadHandler):
         if l > 0:
             self.put_data(l)
         self.file.etag = self.checksum_compute.hexdigest()
+        cache_md5_states(self.file.hashmap, self.backend.block_size,
+                         self.checksum_compute)
         return self.file
 
 
@@ -824,15 +963,33 @@ class ObjectWrapper(object):
 
         self.file_index = 0
         self.block_index = 0
-        self.block_hash = -1
+        self.block_pos = None
         self.block = ''
 
+        # Blocks are read ahead from the backend, in order, for as long as
+        # the requested positions are consecutive.
+        self.blocks = None
+        self.blocks_pos = None
+
         self.range_index = -1
         self.offset, self.length = self.ranges[0]
 
     def __iter__(self):
         return self
 
+    def _read_ahead(self):
+        """Start reading the blocks of the current file up to the end
+        of the current range."""
+
+        bs = self.backend.block_size
+        hashmap = self.hashmaps[self.file_index]
+        end = min(self.sizes[self.file_index], self.offset + self.length)
+        last_index = int((end - 1) / bs)
+        self.blocks = self.backend.get_blocks(
+            hashmap[self.block_index:last_index + 1],
+            window=BACKEND_BLOCK_READ_AHEAD)
+        self.blocks_pos = (self.file_index, self.block_index)
+
     def part_iterator(self):
         if self.length > 0:
             # Get the file for the current offset.
@@ -844,14 +1001,16 @@ class ObjectWrapper(object):
 
             # Get the block for the current position.
             self.block_index = int(self.offset / self.backend.block_size)
-            if self.block_hash != \
-                    self.hashmaps[self.file_index][self.block_index]:
-                self.block_hash = self.hashmaps[
-                    self.file_index][self.block_index]
+            pos = (self.file_index, self.block_index)
+            if self.block_pos != pos:
+                if self.blocks_pos != pos:
+                    self._read_ahead()
                 try:
-                    self.block = self.backend.get_block(self.block_hash)
-                except ItemNotExists:
+                    self.block = self.blocks.next()
+                except (ItemNotExists, StopIteration):
                     raise faults.ItemNotFound('Block does not exist')
+                self.block_pos = pos
+                self.blocks_pos = (self.file_index, self.block_index + 1)
 
             # Get the data from the block.
             bo = self.offset % self.backend.block_size
@@ -958,33 +1117,83 @@ def object_data_response(request, sizes, hashmaps, meta, public=False):
 
 
 def put_object_block(request, hashmap, data, offset, is_snapshot):
-    """Put one block of data at the given offset."""
+    """Put one block of data at the given offset.
+
+    Data may be a string or a bytearray. If it extends beyond the block,
+    a memoryview of the part in the block is passed on, without copying.
+    """
 
     bi = int(offset / request.backend.block_size)
     bo = offset % request.backend.block_size
     bl = min(len(data), request.backend.block_size - bo)
+    if len(data) > bl:
+        data = memoryview(data)[:bl]
     if bi < len(hashmap):
         hashmap[bi] = request.backend.update_block(hashmap[bi],
-                                                   data[:bl],
+                                                   data,
                                                    offset=bo,
                                                    is_snapshot=is_snapshot)
     else:
-        hashmap.append(request.backend.put_block(('\x00' * bo) + data[:bl]))
+        if bo > 0:
+            block = bytearray(bo + bl)
+            block[bo:] = data
+            data = block
+        hashmap.append(request.backend.put_block(data))
     return bl  # Return ammount of data written.
 
 
+def _md5_keys(hashmap):
+    """Generate a key for each prefix of the hashmap, identifying its data.
+    """
+
+    key = ''
+    for h in hashmap:
+        key = hashlib.sha1(key + h).digest()
+        yield key
+
+
+def cache_md5_states(hashmap, block_size, checksum_compute):
+    """Cache the MD5 states kept by a checksum after each full block."""
+
+    states = getattr(checksum_compute, 'states', None)
+    if MD5_CACHE is None or not states:
+        return
+    for i, (key, (length, md5)) in enumerate(izip(_md5_keys(hashmap),
+                                                  states)):
+        if length != (i + 1) * block_size:
+            break
+        MD5_CACHE.put(key, md5)
+
+
 def hashmap_md5(backend, hashmap, size):
-    """Produce the MD5 sum from the data in the hashmap."""
+    """Produce the MD5 sum from the data in the hashmap.
+
+    The MD5 state after each full block is cached by the hashes up to it,
+    so only the blocks after the longest cached prefix are read.
+    """
 
-    # TODO: Search backend for the MD5 of another object
-    #       with the same hashmap and size...
-    md5 = hashlib.md5()
     bs = backend.block_size
-    for bi, hash in enumerate(hashmap):
-        data = backend.get_block(hash)  # Blocks come in padded.
-        if bi == len(hashmap) - 1:
-            data = data[:size % bs]
+    full = min(len(hashmap), size // bs)
+    md5 = None
+    start = 0
+    if MD5_CACHE is not None:
+        keys = list(islice(_md5_keys(hashmap), full))
+        for bi in xrange(full - 1, -1, -1):
+            state = MD5_CACHE.get(keys[bi])
+            if state is not None:
+                md5 = state.copy()
+                start = bi + 1
+                break
+    if md5 is None:
+        md5 = hashlib.md5()
+    blocks = backend.get_blocks(hashmap[start:],
+                                window=BACKEND_BLOCK_READ_AHEAD)
+    for bi, data in enumerate(blocks, start):
+        if bi >= full:
+            data = data[:size - bi * bs]  # Blocks may come in padded.
         md5.update(data)
+        if bi < full and MD5_CACHE is not None:
+            MD5_CACHE.put(keys[bi], md5.copy())
     return md5.hexdigest().lower()
 
 
@@ -997,7 +1206,78 @@ def simple_list_response(request, l):
         return json.dumps(l)
 
 
-from pithos.backends.util import PithosBackendPool
+def stream_list_response(request, container, batches):
+    """Generate an object listing, serialized batch by batch.
+
+    Each batch is a list of object meta dicts, or of names for text.
+    """
+
+    if request.serialization == 'text':
+        for batch in batches:
+            yield ''.join(x + '\n' for x in batch)
+    elif request.serialization == 'xml':
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<container name="%s">' % escape(container))
+        for batch in batches:
+            yield render_to_string('object_items.xml', {'objects': batch})
+        yield '</container>\n'
+    elif request.serialization == 'json':
+        yield '['
+        separator = ''
+        for batch in batches:
+            if not batch:
+                continue
+            yield separator + ', '.join(
+                json.dumps(x, default=json_encode_decimal) for x in batch)
+            separator = ', '
+        yield ']'
+
+
+class BackendStream(object):
+    """Iterate over a response body that reads from the backend.
+
+    The body is generated after the view returns, so the stream takes
+    over the backend of the request and ends its transaction when the
+    iteration is over or the response is closed.
+
+    The status and headers have been sent by then, so a backend error
+    can only cut the body short: the client gets a truncated 200
+    response. The error is logged and the transaction rolled back.
+    """
+
+    def __init__(self, backend, iterator):
+        self.backend = backend
+        self.iterator = iter(iterator)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self.iterator.next()
+        except StopIteration:
+            self.close(True)
+            raise
+        except:
+            logger.exception("Response body truncated by a backend error")
+            self.close(False)
+            raise
+
+    def close(self, success_status=False):
+        backend, self.backend = self.backend, None
+        if backend is not None:
+            backend.post_exec(success_status)
+            backend.close()
+
+
+def stream_response(request, response, iterator):
+    """Set iterator as the content of response, streamed after the view
+    returns and reading from the backend of the request.
+    """
+
+    response.content = BackendStream(request.backend, iterator)
+    response.streaming = True
+
 
 if RADOS_STORAGE:
     BLOCK_PARAMS = {'mappool': RADOS_POOL_MAPS,
@@ -1005,6 +1285,62 @@ if RADOS_STORAGE:
 else:
     BLOCK_PARAMS = {'mappool': None,
                     'blockpool': None, }
+BLOCK_PARAMS.update({'path': BACKEND_BLOCK_PATH,
+                     'umask': BACKEND_BLOCK_UMASK,
+                     'fsync': BACKEND_BLOCK_FSYNC,
+                     'direct_io': BACKEND_BLOCK_DIRECT_IO, })
+
+if BACKEND_BLOCK_CACHE_SIZE:
+    BLOCK_CACHE = LRUCache(BACKEND_BLOCK_CACHE_SIZE)
+else:
+    BLOCK_CACHE = None
+
+if BACKEND_MAP_CACHE_SIZE:
+    MAP_CACHE = LRUCache(BACKEND_MAP_CACHE_SIZE)
+else:
+    MAP_CACHE = None
+
+if BACKEND_MERKLE_CACHE_SIZE:
+    MERKLE_CACHE = LRUCache(BACKEND_MERKLE_CACHE_SIZE)
+else:
+    MERKLE_CACHE = None
+
+if BACKEND_PRINCIPALS_CACHE_TTL:
+    PRINCIPALS_CACHE = LRUCache(BACKEND_PRINCIPALS_CACHE_SIZE,
+                                sizeof=lambda x: 1,
+                                ttl=BACKEND_PRINCIPALS_CACHE_TTL)
+else:
+    PRINCIPALS_CACHE = None
+
+if BACKEND_QUOTA_LEASE_SIZE:
+    QUOTA_LEASES = QuotaLeases(BACKEND_QUOTA_LEASE_SIZE,
+                               ttl=BACKEND_QUOTA_LEASE_TTL)
+else:
+    QUOTA_LEASES = None
+
+if BACKEND_COMMISSION_RESOLVE_INTERVAL:
+    COMMISSION_RESOLVER = CommissionResolver(
+        BACKEND_COMMISSION_RESOLVE_INTERVAL)
+else:
+    COMMISSION_RESOLVER = None
+
+if BACKEND_META_CACHE_TTL:
+    META_CACHE = LRUCache(BACKEND_META_CACHE_SIZE,
+                          sizeof=lambda x: 1,
+                          ttl=BACKEND_META_CACHE_TTL)
+else:
+    META_CACHE = None
+
+if BACKEND_MANIFEST_CACHE_SIZE:
+    MANIFEST_CACHE = LRUCache(BACKEND_MANIFEST_CACHE_SIZE,
+                              sizeof=lambda x: len(x[1]))
+else:
+    MANIFEST_CACHE = None
+
+if UPDATE_MD5 and UPDATE_MD5_CACHE_SIZE:
+    MD5_CACHE = LRUCache(UPDATE_MD5_CACHE_SIZE, sizeof=lambda x: 1)
+else:
+    MD5_CACHE = None
 
 BACKEND_KWARGS = dict(
     db_module=BACKEND_DB_MODULE,
@@ -1028,7 +1364,18 @@ BACKEND_KWARGS = dict(
     mapfile_prefix=BACKEND_MAPFILE_PREFIX,
     resource_max_metadata=RESOURCE_MAX_METADATA,
     acc_max_groups=ACC_MAX_GROUPS,
-    acc_max_group_members=ACC_MAX_GROUP_MEMBERS)
+    acc_max_group_members=ACC_MAX_GROUP_MEMBERS,
+    block_cache=BLOCK_CACHE,
+    map_cache=MAP_CACHE,
+    merkle_cache=MERKLE_CACHE,
+    upload_workers=BACKEND_UPLOAD_WORKERS,
+    deferred_statistics=BACKEND_DEFERRED_STATISTICS,
+    principals_cache=PRINCIPALS_CACHE,
+    db_pool_size=BACKEND_DB_POOL_SIZE,
+    quota_leases=QUOTA_LEASES,
+    commission_resolver=COMMISSION_RESOLVER,
+    meta_cache=META_CACHE,
+    manifest_cache=MANIFEST_CACHE)
 
 _pithos_backend_pool = PithosBackendPool(size=BACKEND_POOL_SIZE,
                                          **BACKEND_KWARGS)
@@ -1091,6 +1438,7 @@ def api_method(http_method=None, token_required=True, user_required=True,
                 raise faults.BadRequest('Object name too large.')
 
             success_status = False
+            streaming = False
             try:
                 # Add a PithosBackend as attribute of the request object
                 request.backend = get_backend()
@@ -1103,6 +1451,8 @@ def api_method(http_method=None, token_required=True, user_required=True,
                 update_response_headers(request, response)
 
                 success_status = True
+                # Streamed responses end the transaction themselves
+                streaming = getattr(response, 'streaming', False)
                 return response
             except LimitExceeded as le:
                 raise faults.BadRequest(le.args[0])
@@ -1121,7 +1471,8 @@ def api_method(http_method=None, token_required=True, user_required=True,
                 raise faults.RequestEntityTooLarge('Quota error: %s' % e)
             finally:
                 # Always close PithosBackend connection
-                if getattr(request, "backend", None) is not None:
+                if (getattr(request, "backend", None) is not None and
+                        not streaming):
                     request.backend.post_exec(success_status)
                     request.backend.close()
         return wrapper
@@ -1247,11 +1598,17 @@ def view_method():
 
 
 class Checksum:
-    def __init__(self):
+    def __init__(self, keep_states=False):
         self.md5 = hashlib.md5()
+        self.length = 0
+        # (length, MD5 state) after each update, for cache_md5_states().
+        self.states = [] if keep_states else None
 
     def update(self, data):
         self.md5.update(data)
+        if self.states is not None:
+            self.length += len(data)
+            self.states.append((self.length, self.md5.copy()))
 
     def hexdigest(self):
         return self.md5.hexdigest().lower()
@@ -1263,3 +1620,11 @@ class NoChecksum:
 
     def hexdigest(self):
         return ''
+
+
+def checksum_iterator(iterator, checksum_compute):
+    """Pass through the data of an iterator, updating a checksum."""
+
+    for data in iterator:
+        checksum_compute.update(data)
+        yield data
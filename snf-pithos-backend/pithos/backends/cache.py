@@ -0,0 +1,95 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class LRUCache(object):
+    """In-process least recently used cache with a size budget.
+
+       The size of each entry is computed by 'sizeof' and the least
+       recently used entries are evicted whenever the total exceeds
+       'budget'. Entries larger than the budget are never cached.
+       If 'ttl' is set, entries expire that many seconds after they
+       are put. The cache is safe to share among the backends of a worker.
+    """
+
+    def __init__(self, budget, sizeof=len, ttl=None):
+        self.budget = budget
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[2] is not None and \
+                    entry[2] <= time():
+                self.used -= entry[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.budget:
+            return
+        expires = time() + self.ttl if self.ttl else None
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.used -= entry[1]
+            while self._entries and self.used + size > self.budget:
+                k, (v, s, e) = self._entries.popitem(last=False)
+                self.used -= s
+                self.evictions += 1
+            self._entries[key] = (value, size, expires)
+            self.used += size
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.used -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used = 0
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'used': self.used,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
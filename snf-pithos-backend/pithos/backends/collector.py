@@ -0,0 +1,182 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+from binascii import unhexlify
+from hashlib import sha1
+from math import ceil, log
+from struct import unpack
+from time import time, sleep
+
+logger = logging.getLogger(__name__)
+
+# Maps and blocks modified more recently than this (in seconds) are never
+# collected, covering uploads whose versions are not committed yet.
+DEFAULT_MIN_AGE = 24 * 60 * 60
+# Versions whose mapfiles are read per transaction while marking.
+DEFAULT_CHUNK_SIZE = 10000
+# Files removed between pauses while sweeping.
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_ERROR_RATE = 0.001
+
+
+class BloomFilter(object):
+    """Set of strings in a fixed amount of memory.
+
+       Membership tests have no false negatives and false positives
+       at about 'error_rate' once 'capacity' keys have been added.
+    """
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        capacity = max(capacity, 1)
+        bits = int(ceil(-capacity * log(error_rate) / log(2) ** 2))
+        # A power of two, so that odd strides visit distinct bits.
+        self.size = max(1 << (bits - 1).bit_length(), 8)
+        self.hashes = max(int(round(log(2) * self.size / capacity)), 1)
+        self.bits = bytearray(self.size // 8)
+
+    def _positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        h1, h2 = unpack('<QQ', sha1(key).digest()[:16])
+        h2 |= 1
+        mask = self.size - 1
+        return [(h1 + i * h2) & mask for i in xrange(self.hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for p in self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7))
+                   for p in self._positions(key))
+
+
+class GarbageCollector(object):
+    """Mark and sweep collector of the maps and blocks of a backend's store
+       that no version refers to.
+
+       Marking reads the mapfiles of all versions, a chunk per transaction,
+       into Bloom filters; sweeping then removes the unmarked maps and
+       blocks older than 'min_age', 'batch_size' files at a time with a
+       pause of 'delay' seconds in between. False positives only leave
+       some garbage behind, to be collected by a later run.
+    """
+
+    def __init__(self, backend, min_age=DEFAULT_MIN_AGE,
+                 chunk_size=DEFAULT_CHUNK_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 delay=0, error_rate=DEFAULT_ERROR_RATE, dry_run=False):
+        if not hasattr(backend.store, 'block_scan'):
+            raise NotImplementedError(
+                "The block module does not support garbage collection")
+        self.backend = backend
+        self.store = backend.store
+        self.min_age = min_age
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.delay = delay
+        self.error_rate = error_rate
+        self.dry_run = dry_run
+
+    def _execute(self, func, *args):
+        backend = self.backend
+        backend.pre_exec()
+        try:
+            result = func(*args)
+        except:
+            backend.post_exec(False)
+            raise
+        backend.post_exec(True)
+        return result
+
+    def mark(self):
+        """Return Bloom filters of the referenced maps and blocks."""
+
+        node = self.backend.node
+        count, size = self._execute(node.version_count_mapfiles)
+        maps = BloomFilter(count, self.error_rate)
+        # Each version refers to at most one partial block, plus the
+        # empty block that empty objects refer to without a map.
+        blocks = BloomFilter(count + int(size) // self.backend.block_size + 1,
+                             self.error_rate)
+        blocks.add(self.store.block_hash(''))
+
+        after = 0
+        marked = 0
+        while True:
+            rows = self._execute(node.version_list_mapfiles, after,
+                                 self.chunk_size)
+            for serial, mapfile, size, is_snapshot in rows:
+                maps.add(mapfile)
+                if is_snapshot:
+                    # Snapshot maps live in Archipelago.
+                    continue
+                try:
+                    hashes = self.store.map_get(mapfile, size)
+                except:
+                    logger.error("Failed to read mapfile %s of version %s",
+                                 mapfile, serial)
+                    raise
+                for h in hashes:
+                    blocks.add(unhexlify(h))
+            marked += len(rows)
+            if len(rows) < self.chunk_size:
+                break
+            after = rows[-1][0]
+            logger.info("Marked the mapfiles of %s versions", marked)
+        return maps, blocks
+
+    def _sweep(self, scan, marked, remove, before):
+        found = removed = 0
+        batch = []
+        for name, mtime in scan:
+            if mtime >= before or name in marked:
+                continue
+            found += 1
+            batch.append(name)
+            if len(batch) >= self.batch_size:
+                removed += self._remove(remove, batch, before)
+                batch = []
+        if batch:
+            removed += self._remove(remove, batch, before)
+        return found, removed
+
+    def _remove(self, remove, batch, before):
+        if self.dry_run:
+            return 0
+        removed = remove(batch, before)
+        if self.delay:
+            sleep(self.delay)
+        return removed
+
+    def collect(self):
+        """Collect the unreferenced maps and blocks.
+
+           Return the (found, removed) counts of unreferenced maps
+           and of unreferenced blocks.
+        """
+
+        before = time() - self.min_age
+        maps, blocks = self.mark()
+        map_stats = self._sweep(self.store.map_scan(), maps,
+                                self.store.map_remove, before)
+        logger.info("Found %s unreferenced maps, removed %s", *map_stats)
+        block_stats = self._sweep(self.store.block_scan(), blocks,
+                                  self.store.block_remove, before)
+        logger.info("Found %s unreferenced blocks, removed %s", *block_stats)
+        return map_stats, block_stats
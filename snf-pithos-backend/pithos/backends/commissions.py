@@ -0,0 +1,114 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import atexit
+import logging
+
+from threading import Event, Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retrying after the quotaholder failed to respond.
+RETRY_DELAY = 1
+
+
+class CommissionResolver(object):
+    """Resolve the commissions of the backends of a worker in batches.
+
+       Submitted serials are resolved by a background thread, which waits
+       'interval' seconds after the first one to collect more, so that a
+       single call to the quotaholder resolves the serials of many requests.
+       The serials accepted are handed back through pop_accepted(), to be
+       removed from the serials table by the next request.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._accept = []
+        self._reject = []
+        self._accepted = []
+        self._client = None
+        self._lock = Lock()
+        self._pending = Event()
+        self._stopping = Event()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # Started on demand, as threads do not survive forking workers.
+        self._stopping.clear()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, client, accept_serials=(), reject_serials=()):
+        """Queue serials to be resolved through client."""
+        with self._lock:
+            self._client = client
+            self._accept.extend(accept_serials)
+            self._reject.extend(reject_serials)
+            self._start()
+        self._pending.set()
+
+    def pop_accepted(self):
+        """Return the serials accepted since the last call."""
+        with self._lock:
+            accepted, self._accepted = self._accepted, []
+        return accepted
+
+    def stop(self):
+        """Stop the background thread and resolve the queued serials."""
+        self._stopping.set()
+        self._pending.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._pending.wait()
+            self._stopping.wait(self.interval)
+            if not self.flush():
+                self._stopping.wait(RETRY_DELAY)
+
+    def flush(self):
+        """Resolve the queued serials and return whether it succeeded."""
+        with self._lock:
+            self._pending.clear()
+            accept, self._accept = self._accept, []
+            reject, self._reject = self._reject, []
+            client = self._client
+        if not accept and not reject:
+            return True
+
+        try:
+            r = client.resolve_commissions(accept_serials=accept,
+                                           reject_serials=reject)
+        except Exception:
+            logger.exception("Failed to resolve %d commissions",
+                             len(accept) + len(reject))
+            with self._lock:
+                self._accept[:0] = accept
+                self._reject[:0] = reject
+            self._pending.set()
+            return False
+
+        for failed in r['failed']:
+            logger.error("Failed to resolve commission: %s", failed)
+        with self._lock:
+            self._accepted.extend(r['accepted'])
+        return True
@@ -0,0 +1,141 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import atexit
+import errno
+import os
+
+from socket import gethostname
+from threading import Lock
+from time import time
+
+
+class QuotaLeases(object):
+    """Quota reserved in advance from the quotaholder and spent locally.
+
+       A lease of 'size' units is kept per key (holder and source) and is
+       shared among the backends of a worker. Leases expire 'ttl' seconds
+       after they are granted, so that unused quota is given back.
+
+       Leases are journaled by the backends along with the worker owning
+       them, which gives them back when it exits. The leases of workers
+       that are gone are given back by the others: at once if they ran on
+       the same host, otherwise a 'ttl' after they expired.
+    """
+
+    def __init__(self, size, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._leases = {}
+        self._refused = {}
+        self._lock = Lock()
+        self._next_sweep = 0
+        self._exit_pid = None
+
+    def __len__(self):
+        return len(self._leases)
+
+    @property
+    def owner(self):
+        """Identify the worker holding the leases, as host and process."""
+        return '%s:%d' % (gethostname(), os.getpid())
+
+    def expiry(self):
+        """Return when a lease granted now expires."""
+        return time() + self.ttl
+
+    def spend(self, key, amount):
+        """Spend amount from the lease of key and return the id of
+           the lease, or None if it had not enough quota left or expired.
+        """
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None or lease[1] < amount or lease[2] <= time():
+                return None
+            lease[1] -= amount
+            return lease[0]
+
+    def refund(self, key, lease_id, amount):
+        """Give amount back to the lease of key, if it is still lease_id."""
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease[0] == lease_id:
+                lease[1] += amount
+
+    def grant(self, key, lease):
+        """Set the lease of key, a list of its id, amount and expiry."""
+        with self._lock:
+            self._leases[key] = lease
+            self._refused.pop(key, None)
+
+    def release(self, key):
+        """Drop the lease of key and return it, if any."""
+        with self._lock:
+            return self._leases.pop(key, None)
+
+    def restore(self, key, lease):
+        """Put back a released lease, unless another one was granted."""
+        with self._lock:
+            self._leases.setdefault(key, lease)
+
+    def refuse(self, key):
+        """Do not ask for a lease of key again before it would expire."""
+        with self._lock:
+            self._refused[key] = self.expiry()
+
+    def refused(self, key):
+        """Return whether a lease of key was refused recently."""
+        with self._lock:
+            until = self._refused.get(key)
+            if until is not None and until <= time():
+                del self._refused[key]
+                until = None
+            return until is not None
+
+    def sweep_due(self):
+        """Return whether the journal is to be swept for stale leases,
+           which happens on the first call and once per 'ttl' after it.
+        """
+        with self._lock:
+            now = time()
+            if now < self._next_sweep:
+                return False
+            self._next_sweep = now + self.ttl
+            return True
+
+    def stale(self, owner, expires):
+        """Return whether a journaled lease can no longer be spent: its
+           worker on this host is gone or it expired a 'ttl' ago, longer
+           than any request spending it may last.
+        """
+        if expires + self.ttl <= time():
+            return True
+        host, _, pid = owner.rpartition(':')
+        if host != gethostname() or int(pid) == os.getpid():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except OSError as e:
+            return e.errno == errno.ESRCH
+        return False
+
+    def at_exit(self, release):
+        """Call release() when the worker exits, to give back its leases."""
+        with self._lock:
+            # Registered per process, as workers are forked.
+            if self._exit_pid == os.getpid():
+                return
+            self._exit_pid = os.getpid()
+        atexit.register(release)
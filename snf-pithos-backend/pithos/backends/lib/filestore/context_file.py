@@ -0,0 +1,207 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import errno
+import ctypes
+
+from io import FileIO
+from tempfile import mkstemp
+
+# Alignment required by O_DIRECT for the buffer address, file offset
+# and transfer size on the filesystems we care about.
+DIRECT_IO_ALIGNMENT = 4096
+
+# Files are spread under SHARD_DEPTH levels of directories named after
+# consecutive SHARD_WIDTH characters of their key, so that no single
+# directory grows to millions of entries.
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+
+
+def shard_path(root, name, key=None):
+    """Return the path of 'name' under 'root' in its shard directory.
+       The shard is derived from 'key' (by default 'name' itself),
+       which is expected to be a hexadecimal string.
+    """
+    key = key or name
+    shards = [key[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH]
+              for i in xrange(SHARD_DEPTH)]
+    shards.append(name)
+    return os.path.join(root, *shards)
+
+
+def ensure_dir(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def file_write_temp(path, data, sync=True):
+    """Write data to a temporary file in the directory of path
+       and return the temporary file name.
+       The caller is expected to rename it over path (see file_commit).
+    """
+    dirname = os.path.dirname(path)
+    ensure_dir(dirname)
+    fd, tmp = mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        written = 0
+        datalen = len(data)
+        while written < datalen:
+            written += os.write(fd, memoryview(data)[written:])
+        if sync:
+            os.fsync(fd)
+    except:
+        os.close(fd)
+        os.unlink(tmp)
+        raise
+    os.close(fd)
+    return tmp
+
+
+def file_sync_dirs(dirs):
+    """Flush the given directories, making renames into them durable."""
+    for d in dirs:
+        fd = os.open(d, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def file_commit(renames, sync=True):
+    """Atomically move a batch of (temporary file, path) pairs into place.
+       If sync is set, every directory touched is flushed exactly once,
+       after all the renames of the batch have been issued.
+    """
+    dirs = set()
+    for tmp, path in renames:
+        os.rename(tmp, path)
+        dirs.add(os.path.dirname(path))
+    if sync:
+        file_sync_dirs(dirs)
+
+
+def file_discard(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def file_touch(path):
+    """Update the modification time of the file at path and return
+       whether it exists.
+    """
+    try:
+        os.utime(path, None)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        # Read-only stores can still answer for existence.
+        return os.path.exists(path)
+    return True
+
+
+def file_scan(root):
+    """Yield the (name, modification time) of the files under root,
+       skipping the temporary files of writes in progress.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if name.startswith('.tmp-'):
+                continue
+            try:
+                mtime = os.lstat(os.path.join(dirpath, name)).st_mtime
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            yield name, mtime
+
+
+def file_remove(paths, before=None):
+    """Remove the files at paths and return how many were removed.
+       If before is given, files modified since then are kept, as they
+       may have been put back to use after they were found unreferenced.
+    """
+    removed = 0
+    for path in paths:
+        try:
+            if before is not None and os.lstat(path).st_mtime >= before:
+                continue
+            os.unlink(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+        removed += 1
+    return removed
+
+
+def _aligned_buffer(size):
+    size += (-size) % DIRECT_IO_ALIGNMENT
+    raw = ctypes.create_string_buffer(size + DIRECT_IO_ALIGNMENT)
+    offset = (-ctypes.addressof(raw)) % DIRECT_IO_ALIGNMENT
+    # The returned array keeps a reference to raw.
+    return (ctypes.c_char * size).from_buffer(raw, offset)
+
+
+def file_read_direct(path, size):
+    """Read up to size bytes from path bypassing the page cache.
+       Return None if the file does not exist and raise EnvironmentError
+       with EINVAL if the filesystem does not support O_DIRECT.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    buf = _aligned_buffer(size)
+    view = memoryview(buf)
+    total = 0
+    with FileIO(fd, 'r') as f:
+        while total < size:
+            n = f.readinto(view[total:])
+            if not n:
+                break
+            total += n
+    return ctypes.string_at(ctypes.addressof(buf), min(total, size))
+
+
+def file_read(path, size=None, direct=False):
+    """Return the contents of the file at path (at most size bytes,
+       if size is given) or None if the file does not exist.
+       If direct is set and size is known, try reading with O_DIRECT first,
+       falling back to buffered I/O where it is not supported.
+    """
+    if direct and size:
+        try:
+            return file_read_direct(path, size)
+        except EnvironmentError as e:
+            if e.errno != errno.EINVAL:
+                raise
+    try:
+        with open(path, 'rb') as f:
+            return f.read() if size is None else f.read(size)
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
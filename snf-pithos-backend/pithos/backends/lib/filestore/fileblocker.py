@@ -0,0 +1,202 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from hashlib import new as newhasher
+from binascii import hexlify, unhexlify
+
+from context_file import (
+    shard_path,
+    ensure_dir,
+    file_read,
+    file_write_temp,
+    file_commit,
+    file_discard,
+    file_touch,
+    file_scan,
+    file_remove,
+    )
+
+
+class FileBlocker(object):
+    """Blocker.
+       Required constructor parameters: blocksize, blockpath, hashtype.
+       Optional fsync, direct_io.
+    """
+
+    blocksize = None
+    blockpath = None
+    hashtype = None
+
+    def __init__(self, **params):
+        blocksize = params['blocksize']
+        blockpath = params['blockpath']
+        hashtype = params['hashtype']
+        try:
+            hasher = newhasher(hashtype)
+        except ValueError:
+            msg = "Variable hashtype '%s' is not available from hashlib"
+            raise ValueError(msg % (hashtype,))
+
+        hasher.update("")
+        emptyhash = hasher.digest()
+
+        ensure_dir(blockpath)
+        if not os.path.isdir(blockpath):
+            raise RuntimeError("Cannot open path '%s'" % (blockpath,))
+
+        self.blocksize = blocksize
+        self.blockpath = blockpath
+        self.hashtype = hashtype
+        self.hashlen = len(emptyhash)
+        self.emptyhash = emptyhash
+        self.fsync = params.get('fsync', True)
+        self.direct_io = (params.get('direct_io', False) and
+                          hasattr(os, 'O_DIRECT'))
+
+    def _pad(self, block):
+        return block + ('\x00' * (self.blocksize - len(block)))
+
+    def _get_rear_path(self, blkhash):
+        return shard_path(self.blockpath, hexlify(blkhash))
+
+    def _touch_rear_block(self, blkhash):
+        # Found blocks look recently used to the garbage collector,
+        # so that it spares the ones about to be referenced again.
+        return file_touch(self._get_rear_path(blkhash))
+
+    def _read_rear_block(self, blkhash):
+        return file_read(self._get_rear_path(blkhash), self.blocksize,
+                         direct=self.direct_io)
+
+    def block_hash(self, data):
+        """Hash a block of data"""
+        hasher = newhasher(self.hashtype)
+        if data[-1:] == '\x00':  # Only padded blocks are copied.
+            data = bytearray(data).rstrip('\x00')
+        hasher.update(data)
+        return hasher.digest()
+
+    def block_ping(self, hashes):
+        """Check hashes for existence and
+           return those missing from block storage.
+        """
+        notfound = []
+        append = notfound.append
+        seen = set()
+
+        for h in hashes:
+            if h in seen:
+                continue
+            seen.add(h)
+            if not self._touch_rear_block(h):
+                append(h)
+
+        return notfound
+
+    def block_retr(self, hashes):
+        """Retrieve blocks from storage by their hashes."""
+        blocks = []
+        append = blocks.append
+
+        for h in hashes:
+            if h == self.emptyhash:
+                append(self._pad(''))
+                continue
+            block = self._read_rear_block(h)
+            if block is None:
+                break
+            append(self._pad(block))
+
+        return blocks
+
+    def block_retr_iter(self, hashes, window=None):
+        """Retrieve blocks from storage by their hashes and yield them
+           in order. None is yielded in place of a missing block.
+           Local reads are served sequentially, so window is ignored.
+        """
+        for h in hashes:
+            if h == self.emptyhash:
+                yield self._pad('')
+                continue
+            block = self._read_rear_block(h)
+            yield self._pad(block) if block is not None else None
+
+    def block_stor(self, blocklist, hashlist=None):
+        """Store a bunch of blocks and return (hashes, missing).
+           Hashes is a list of the hashes of the blocks,
+           missing is a list of indices in that list indicating
+           which blocks were missing from the store.
+           If given, hashlist holds the precomputed hashes of the blocks.
+        """
+        if hashlist is None:
+            block_hash = self.block_hash
+            hashlist = [block_hash(b) for b in blocklist]
+        missing = []
+        renames = []
+        pending = set()
+        try:
+            for i, h in enumerate(hashlist):
+                if h in pending:
+                    missing.append(i)
+                    continue
+                if self._touch_rear_block(h):
+                    continue
+                missing.append(i)
+                pending.add(h)
+                path = self._get_rear_path(h)
+                tmp = file_write_temp(path, blocklist[i], sync=self.fsync)
+                renames.append((tmp, path))
+            file_commit(renames, sync=self.fsync)
+        except:
+            file_discard([tmp for tmp, _ in renames])
+            raise
+
+        return hashlist, missing
+
+    def block_delta(self, blkhash, offset, data):
+        """Construct and store a new block from a given block
+           and a data 'patch' applied at offset. Return:
+           (the hash of the new block, if the block already existed)
+        """
+
+        blocksize = self.blocksize
+        if offset >= blocksize or not data:
+            return None, None
+
+        block = self.block_retr((blkhash,))
+        if not block:
+            return None, None
+
+        # Patch a single copy of the (padded) block in place.
+        newblock = bytearray(block[0])
+        if offset + len(data) > blocksize:
+            data = data[:blocksize - offset]
+        newblock[offset:offset + len(data)] = data
+
+        h, a = self.block_stor((newblock,))
+        return h[0], 1 if a else 0
+
+    def block_scan(self):
+        """Yield the (hash, modification time) of the stored blocks."""
+        for name, mtime in file_scan(self.blockpath):
+            yield unhexlify(name), mtime
+
+    def block_remove(self, hashes, before=None):
+        """Remove the given blocks, unless modified since before,
+           and return how many were removed.
+        """
+        return file_remove([self._get_rear_path(h) for h in hashes], before)
@@ -0,0 +1,108 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from hashlib import new as newhasher, sha1
+from binascii import hexlify, unhexlify
+
+from context_file import (
+    shard_path,
+    ensure_dir,
+    file_read,
+    file_write_temp,
+    file_commit,
+    file_scan,
+    file_remove,
+    )
+
+
+class FileMapper(object):
+    """Mapper.
+       Required constructor parameters: mappath, namelen, hashtype.
+       Optional fsync.
+    """
+
+    mappath = None
+    namelen = None
+    hashtype = None
+    emptyhash = None
+
+    def __init__(self, **params):
+        self.params = params
+        self.namelen = params['namelen']
+        mappath = params['mappath']
+
+        hashtype = params['hashtype']
+        try:
+            hasher = newhasher(hashtype)
+        except ValueError:
+            msg = "Variable hashtype '%s' is not available from hashlib"
+            raise ValueError(msg % (hashtype,))
+
+        hasher.update("")
+        emptyhash = hasher.digest()
+
+        ensure_dir(mappath)
+        if not os.path.isdir(mappath):
+            raise RuntimeError("Cannot open path '%s'" % (mappath,))
+
+        self.mappath = mappath
+        self.hashtype = hashtype
+        self.hashlen = len(emptyhash)
+        self.emptyhash = emptyhash
+        self.fsync = params.get('fsync', True)
+
+    def _get_rear_path(self, maphash):
+        if os.sep in maphash:
+            raise ValueError("Invalid map name '%s'" % (maphash,))
+        # Map names share a common prefix, so shard them by a digest.
+        return shard_path(self.mappath, maphash, sha1(maphash).hexdigest())
+
+    def _read_rear_map(self, maphash):
+        data = file_read(self._get_rear_path(maphash))
+        if data is None:
+            raise IOError("Could not retrieve mapfile %s" % maphash)
+        return data
+
+    def _write_rear_map(self, maphash, data):
+        path = self._get_rear_path(maphash)
+        tmp = file_write_temp(path, data, sync=self.fsync)
+        file_commit(((tmp, path),), sync=self.fsync)
+
+    def map_retr(self, maphash, size):
+        """Return as a list the hashes map of an object."""
+        data = self._read_rear_map(maphash)
+        namelen = self.namelen
+        return [hexlify(data[i:i + namelen])
+                for i in xrange(0, len(data), namelen)]
+
+    def map_stor(self, maphash, hashes, size, block_size):
+        """Store hashes in the given hashes map."""
+        self._write_rear_map(maphash, ''.join(unhexlify(h) for h in hashes))
+
+    def map_copy(self, dst, src, size):
+        """Copies src map into dst."""
+        self._write_rear_map(dst, self._read_rear_map(src))
+
+    def map_scan(self):
+        """Yield the (name, modification time) of the stored maps."""
+        return file_scan(self.mappath)
+
+    def map_remove(self, names, before=None):
+        """Remove the given maps, unless modified since before,
+           and return how many were removed.
+        """
+        return file_remove([self._get_rear_path(n) for n in names], before)
@@ -0,0 +1,110 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from binascii import unhexlify
+
+from fileblocker import FileBlocker
+from filemapper import FileMapper
+
+
+class Store(object):
+    """Store.
+       Required constructor parameters: path, block_size, hash_algorithm.
+       Optional umask, fsync, direct_io.
+
+       Blocks and maps are kept as plain files under 'path',
+       in content-addressed, sharded directories.
+    """
+
+    def __init__(self, **params):
+        umask = params.get('umask')
+        if umask is not None:
+            os.umask(umask)
+
+        path = params.get('path')
+        if not path:
+            raise ValueError("A block path is required for the file store")
+
+        pb = {'blocksize': params['block_size'],
+              'blockpath': os.path.join(path, 'blocks'),
+              'hashtype': params['hash_algorithm'],
+              'fsync': params.get('fsync', True),
+              'direct_io': params.get('direct_io', False),
+              }
+        self.blocker = FileBlocker(**pb)
+        pm = {'mappath': os.path.join(path, 'maps'),
+              'namelen': self.blocker.hashlen,
+              'hashtype': params['hash_algorithm'],
+              'fsync': params.get('fsync', True),
+              }
+        self.mapper = FileMapper(**pm)
+
+    def map_get(self, name, size):
+        return self.mapper.map_retr(name, size)
+
+    def map_put(self, name, map, size, block_size):
+        self.mapper.map_stor(name, map, size, block_size)
+
+    def map_delete(self, name):
+        pass
+
+    def map_copy(self, dst, src, size):
+        self.mapper.map_copy(dst, src, size)
+
+    def map_scan(self):
+        return self.mapper.map_scan()
+
+    def map_remove(self, names, before=None):
+        return self.mapper.map_remove(names, before)
+
+    def block_get(self, hash):
+        blocks = self.blocker.block_retr((hash,))
+        if not blocks:
+            return None
+        return blocks[0]
+
+    def block_get_archipelago(self, hash):
+        # Kept for interface compatibility with the Archipelago store,
+        # which is addressed by hexlified hashes.
+        return self.block_get(unhexlify(hash))
+
+    def block_retr_iter(self, hashes, window=None):
+        return self.blocker.block_retr_iter(hashes, window)
+
+    def block_put(self, data):
+        hashes, absent = self.blocker.block_stor((data,))
+        return hashes[0]
+
+    def block_put_many(self, blocks, hashes=None):
+        hashes, absent = self.blocker.block_stor(blocks, hashes)
+        return hashes
+
+    def block_hash(self, data):
+        return self.blocker.block_hash(data)
+
+    def block_update(self, hash, offset, data):
+        h, e = self.blocker.block_delta(hash, offset, data)
+        return h
+
+    def block_search(self, map):
+        return self.blocker.block_ping(map)
+
+    def block_scan(self):
+        return self.blocker.block_scan()
+
+    def block_remove(self, hashes, before=None):
+        return self.blocker.block_remove(hashes, before)
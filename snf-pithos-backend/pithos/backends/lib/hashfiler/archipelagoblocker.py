@@ -31,6 +31,9 @@ from pithos.workers import (
 
 monkey.patch_Request()
 
+# Maximum number of xseg requests a single call keeps in flight.
+DEFAULT_IO_DEPTH = 64
+
 
 class ArchipelagoBlocker(object):
     """Blocker.
@@ -61,6 +64,7 @@ class ArchipelagoBlocker(object):
         self.hashtype = hashtype
         self.hashlen = len(emptyhash)
         self.emptyhash = emptyhash
+        self.io_depth = params.get('io_depth') or DEFAULT_IO_DEPTH
 
     def _pad(self, block):
         return block + ('\x00' * (self.blocksize - len(block)))
@@ -83,24 +87,92 @@ class ArchipelagoBlocker(object):
         else:
             return False
 
+    def _submit_batched(self, ioctx, make_request, items):
+        """Submit a request per item, keeping at most io_depth requests
+           in flight, and yield (item, success, request) in order.
+           Requests are released when the caller advances the iteration.
+        """
+        io_depth = self.io_depth
+        for start in xrange(0, len(items), io_depth):
+            reqs = []
+            try:
+                for item in items[start:start + io_depth]:
+                    req = make_request(ioctx, item)
+                    reqs.append((item, req))
+                    req.submit()
+                for item, req in reqs:
+                    req.wait()
+                for item, req in reqs:
+                    yield item, req.success(), req
+            finally:
+                for item, req in reqs:
+                    req.put()
+
+    def _check_rear_blocks(self, blkhashes):
+        """Return the set of the given hashes that exist in block storage,
+           issuing all the info requests before waiting on any of them.
+        """
+        dst_port = self.dst_port
+
+        def info_request(ioctx, blkhash):
+            return Request.get_info_request(ioctx, dst_port, hexlify(blkhash))
+
+        found = set()
+        ioctx = self.ioctx_pool.pool_get()
+        try:
+            for h, ret, req in self._submit_batched(ioctx, info_request,
+                                                    blkhashes):
+                if ret:
+                    found.add(h)
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
+        return found
+
+    def _put_rear_blocks(self, blocks):
+        """Write the given (hash, data) pairs concurrently."""
+        dst_port = self.dst_port
+
+        def write_request(ioctx, block):
+            blkhash, data = block
+            # Blocks may be assembled in bytearrays or memoryviews.
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            else:
+                data = str(data)
+            return Request.get_write_request(ioctx, dst_port, hexlify(blkhash),
+                                             data=data, offset=0,
+                                             datalen=len(data))
+
+        ioctx = self.ioctx_pool.pool_get()
+        try:
+            for _, ret, req in self._submit_batched(ioctx, write_request,
+                                                    blocks):
+                if not ret:
+                    raise IOError("archipelago: Write request error")
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
+
     def block_hash(self, data):
         """Hash a block of data"""
         hasher = newhasher(self.hashtype)
-        hasher.update(data.rstrip('\x00'))
+        if data[-1:] == '\x00':  # Only padded blocks are copied.
+            data = bytearray(data).rstrip('\x00')
+        hasher.update(data)
         return hasher.digest()
 
     def block_ping(self, hashes):
         """Check hashes for existence and
            return those missing from block storage.
         """
-        notfound = []
-        append = notfound.append
-
+        unique = []
+        seen = set()
         for h in hashes:
-            if h not in notfound and not self._check_rear_block(h):
-                append(h)
+            if h not in seen:
+                seen.add(h)
+                unique.append(h)
 
-        return notfound
+        found = self._check_rear_blocks(unique)
+        return [h for h in unique if h not in found]
 
     def block_retr(self, hashes):
         """Retrieve blocks from storage by their hashes."""
@@ -163,19 +235,79 @@ class ArchipelagoBlocker(object):
         self.ioctx_pool.pool_put(ioctx)
         return blocks
 
-    def block_stor(self, blocklist):
+    def _retr_rear_blocks(self, blkhashes):
+        """Return a dict with the data of those of the given (unique) hashes
+           that exist in block storage. All the info requests are submitted
+           before waiting on them, and so are all the read requests.
+        """
+        dst_port = self.dst_port
+
+        def info_request(ioctx, blkhash):
+            return Request.get_info_request(ioctx, dst_port, hexlify(blkhash))
+
+        def read_request(ioctx, block):
+            blkhash, size = block
+            return Request.get_read_request(ioctx, dst_port, hexlify(blkhash),
+                                            size=size)
+
+        blocks = {}
+        ioctx = self.ioctx_pool.pool_get()
+        try:
+            sizes = []
+            for h, ret, req in self._submit_batched(ioctx, info_request,
+                                                    blkhashes):
+                if ret:
+                    info = req.get_data(_type=xseg_reply_info)
+                    sizes.append((h, info.contents.size))
+            for block, ret, req in self._submit_batched(ioctx, read_request,
+                                                        sizes):
+                if not ret:
+                    raise Exception("Cannot retrieve Archipelago data.")
+                h, size = block
+                blocks[h] = string_at(req.get_data(), size)
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
+        return blocks
+
+    def block_retr_iter(self, hashes, window=None):
+        """Retrieve blocks from storage by their hashes and yield them
+           in order, fetching up to 'window' blocks concurrently ahead of
+           the consumer. None is yielded in place of a missing block.
+        """
+        window = window or self.io_depth
+        emptyhash = self.emptyhash
+        for start in xrange(0, len(hashes), window):
+            batch = hashes[start:start + window]
+            unique = set(batch)
+            unique.discard(emptyhash)
+            blocks = self._retr_rear_blocks(list(unique))
+            for h in batch:
+                if h == emptyhash:
+                    yield self._pad('')
+                    continue
+                block = blocks.get(h)
+                yield self._pad(block) if block is not None else None
+
+    def block_stor(self, blocklist, hashlist=None):
         """Store a bunch of blocks and return (hashes, missing).
            Hashes is a list of the hashes of the blocks,
            missing is a list of indices in that list indicating
            which blocks were missing from the store.
+           If given, hashlist holds the precomputed hashes of the blocks.
         """
-        block_hash = self.block_hash
-        hashlist = [block_hash(b) for b in blocklist]
-        missing = [i for i, h in enumerate(hashlist) if not
-                   self._check_rear_block(h)]
+        if hashlist is None:
+            block_hash = self.block_hash
+            hashlist = [block_hash(b) for b in blocklist]
+        absent = set(self.block_ping(hashlist))
+        missing = [i for i, h in enumerate(hashlist) if h in absent]
+
+        writes = []
         for i in missing:
-            with self._get_rear_block(hashlist[i], 1) as rbl:
-                rbl.sync_write(blocklist[i])  # XXX: verify?
+            h = hashlist[i]
+            if h in absent:
+                absent.remove(h)  # write each block only once
+                writes.append((h, blocklist[i]))
+        self._put_rear_blocks(writes)  # XXX: verify?
 
         return hashlist, missing
 
@@ -193,12 +325,11 @@ class ArchipelagoBlocker(object):
         if not block:
             return None, None
 
-        block = block[0]
-        newblock = block[:offset] + data
-        if len(newblock) > blocksize:
-            newblock = newblock[:blocksize]
-        elif len(newblock) < blocksize:
-            newblock += block[len(newblock):]
+        # Patch a single copy of the (padded) block in place.
+        newblock = bytearray(block[0])
+        if offset + len(data) > blocksize:
+            data = data[:blocksize - offset]
+        newblock[offset:offset + len(data)] = data
 
         h, a = self.block_stor((newblock,))
         return h[0], 1 if a else 0
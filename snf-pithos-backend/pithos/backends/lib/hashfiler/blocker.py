@@ -42,19 +42,25 @@ class Blocker(object):
         """Retrieve blocks from storage by their hashes."""
         return self.archip_blocker.block_retr(hashes)
 
+    def block_retr_iter(self, hashes, window=None):
+        """Retrieve blocks from storage by their hashes, reading ahead."""
+        return self.archip_blocker.block_retr_iter(hashes, window)
+
     def block_retr_archipelago(self, hashes):
         """Retrieve blocks from storage by theri hashes."""
         return self.archip_blocker.block_retr_archipelago(hashes)
 
-    def block_stor(self, blocklist):
+    def block_stor(self, blocklist, hashlist=None):
         """Store a bunch of blocks and return (hashes, missing).
            Hashes is a list of the hashes of the blocks,
            missing is a list of indices in that list indicating
            which blocks were missing from the store.
+           If given, hashlist holds the precomputed hashes of the blocks.
 
         """
 
-        (hashes, missing) = self.archip_blocker.block_stor(blocklist)
+        (hashes, missing) = self.archip_blocker.block_stor(blocklist,
+                                                           hashlist)
         return (hashes, missing)
 
     def block_delta(self, blkhash, offset, data):
@@ -13,17 +13,25 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from objpool import ObjectPool
+from archipelago.common import Segment, Xseg_ctx
+
+from pithos.workers import glue
+
 from blocker import Blocker
 from mapper import Mapper
 
 
 class Store(object):
     """Store.
-       Required constructor parameters: path, block_size, hash_algorithm,
-       blockpool, mappool.
+       Required constructor parameters: block_size, hash_algorithm,
+       archipelago_cfile, xseg_pool_size.
     """
 
     def __init__(self, **params):
+        glue.WorkerGlue.setupXsegPool(ObjectPool, Segment, Xseg_ctx,
+                                      cfile=params['archipelago_cfile'],
+                                      pool_size=params['xseg_pool_size'])
         pb = {'blocksize': params['block_size'],
               'hashtype': params['hash_algorithm'],
               'archipelago_cfile': params['archipelago_cfile'],
@@ -59,10 +67,20 @@ class Store(object):
             return None
         return blocks[0]
 
+    def block_retr_iter(self, hashes, window=None):
+        return self.blocker.block_retr_iter(hashes, window)
+
     def block_put(self, data):
         hashes, absent = self.blocker.block_stor((data,))
         return hashes[0]
 
+    def block_put_many(self, blocks, hashes=None):
+        hashes, absent = self.blocker.block_stor(blocks, hashes)
+        return hashes
+
+    def block_hash(self, data):
+        return self.blocker.block_hash(data)
+
     def block_update(self, hash, offset, data):
         h, e = self.blocker.block_delta(hash, offset, data)
         return h
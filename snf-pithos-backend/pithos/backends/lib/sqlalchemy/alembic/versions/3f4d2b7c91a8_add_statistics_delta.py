@@ -0,0 +1,37 @@
+"""Add statistics deltas table
+
+Revision ID: 3f4d2b7c91a8
+Revises: 5adc52055209
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f4d2b7c91a8'
+down_revision = '5adc52055209'
+
+
+def upgrade():
+    op.create_table(
+        'statistics_deltas',
+        sa.Column('serial', sa.Integer, primary_key=True),
+        sa.Column('node', sa.Integer,
+                  sa.ForeignKey('nodes.node',
+                                ondelete='CASCADE',
+                                onupdate='CASCADE')),
+        sa.Column('population', sa.Integer, nullable=False, default=0),
+        sa.Column('size', sa.BigInteger, nullable=False, default=0),
+        sa.Column('mtime', sa.DECIMAL(precision=16, scale=6)),
+        sa.Column('cluster', sa.Integer, nullable=False, default=0),
+        mysql_engine='InnoDB')
+    op.create_index('idx_statistics_deltas_node_cluster',
+                    'statistics_deltas', ['node', 'cluster'])
+
+
+def downgrade():
+    op.drop_index('idx_statistics_deltas_node_cluster',
+                  tablename='statistics_deltas')
+    op.drop_table('statistics_deltas')
@@ -0,0 +1,30 @@
+"""Add quotaholder leases table
+
+Revision ID: 6b1c0f3e2a75
+Revises: 3f4d2b7c91a8
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '6b1c0f3e2a75'
+down_revision = '3f4d2b7c91a8'
+
+
+def upgrade():
+    op.create_table(
+        'qh_leases',
+        sa.Column('lease', sa.Integer, primary_key=True),
+        sa.Column('holder', sa.String(256)),
+        sa.Column('source', sa.String(256)),
+        sa.Column('amount', sa.BigInteger, nullable=False, default=0),
+        sa.Column('expires', sa.DECIMAL(precision=16, scale=6)),
+        sa.Column('owner', sa.String(256)),
+        mysql_engine='InnoDB')
+
+
+def downgrade():
+    op.drop_table('qh_leases')
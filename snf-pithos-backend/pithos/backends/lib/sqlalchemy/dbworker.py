@@ -25,6 +25,22 @@ class DBWorker(object):
         self.wrapper = wrapper
         self.conn = wrapper.conn
         self.engine = wrapper.engine
+        self._statements = {}
+
+    def execute_prepared(self, name, build, **params):
+        """Execute the statement registered as name with params.
+
+           The statement is built by build() on first use and should take
+           its arguments as bind parameters, so that it is compiled once
+           per connection instead of on every call.
+        """
+
+        s = self._statements.get(name)
+        if s is None:
+            s = self._statements[name] = build()
+        conn = self.conn.execution_options(
+            compiled_cache=self.wrapper.compiled_cache)
+        return conn.execute(s, **params)
 
     def escape_like(self, s, escape_char=ESCAPE_CHAR):
         return (s.replace(escape_char, escape_char * 2).
@@ -13,15 +13,55 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from threading import Lock
+
 from sqlalchemy import create_engine
 from sqlalchemy.pool import NullPool
 from sqlalchemy.interfaces import PoolListener
+from sqlalchemy.exc import DisconnectionError
+
+
+class PingListener(PoolListener):
+    """Replace pooled connections that went away while idle."""
+
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        try:
+            cursor = dbapi_con.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            dbapi_con.rollback()
+        except Exception:
+            raise DisconnectionError()
+
+
+_engines = {}
+_engines_lock = Lock()
+
+
+def _pooled_engine(db, pool_size):
+    """Return the engine pooling up to pool_size idle connections to db.
+       Engines are shared by all the wrappers of a process, so that
+       connections survive the backends that used them.
+    """
+
+    with _engines_lock:
+        engine = _engines.get((db, pool_size))
+        if engine is None:
+            engine = create_engine(
+                db, pool_size=pool_size, max_overflow=-1,
+                listeners=[PingListener()], isolation_level='READ COMMITTED')
+            _engines[(db, pool_size)] = engine
+        return engine
 
 
 class DBWrapper(object):
-    """Database connection wrapper."""
+    """Database connection wrapper.
+
+       If pool_size is set, connections (other than SQLite ones) are
+       taken from a shared pool instead of being opened for each wrapper.
+    """
 
-    def __init__(self, db):
+    def __init__(self, db, pool_size=0):
         if db.startswith('sqlite://'):
             class ForeignKeysListener(PoolListener):
                 def connect(self, dbapi_con, con_record):
@@ -34,14 +74,17 @@ class DBWrapper(object):
         #elif db.startswith('mysql://'):
         #    db = '%s?charset=utf8&use_unicode=0' %db
         #    self.engine = create_engine(db, convert_unicode=True)
+        elif pool_size:
+            self.engine = _pooled_engine(db, pool_size)
         else:
-            #self.engine = create_engine(db, pool_size=0, max_overflow=-1)
             self.engine = create_engine(
                 db, poolclass=NullPool, isolation_level='READ COMMITTED')
         self.engine.echo = False
         self.engine.echo_pool = False
         self.conn = self.engine.connect()
         self.trans = None
+        # Compiled forms of the statements prepared by the DB workers.
+        self.compiled_cache = {}
 
     def close(self):
         self.conn.close()
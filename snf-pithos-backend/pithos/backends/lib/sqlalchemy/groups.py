@@ -15,7 +15,7 @@
 
 from collections import defaultdict
 from sqlalchemy import Table, Column, String, MetaData
-from sqlalchemy.sql import select, and_
+from sqlalchemy.sql import select, and_, bindparam
 from sqlalchemy.schema import Index
 from sqlalchemy.exc import NoSuchTableError
 
@@ -149,9 +149,10 @@ class Groups(DBWorker):
     def group_parents(self, member):
         """Return all (owner, group) tuples that contain member."""
 
-        s = select([self.groups.c.owner, self.groups.c.name],
-                   self.groups.c.member == member)
-        r = self.conn.execute(s)
+        def build():
+            return select([self.groups.c.owner, self.groups.c.name],
+                          self.groups.c.member == bindparam('member'))
+        r = self.execute_prepared('group_parents', build, member=member)
         l = r.fetchall()
         r.close()
         return l
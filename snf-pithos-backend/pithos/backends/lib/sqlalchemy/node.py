@@ -23,7 +23,8 @@ from sqlalchemy import (Table, Integer, BigInteger, DECIMAL, Boolean,
 from sqlalchemy.schema import Index, Sequence
 from sqlalchemy.sql import (func, and_, or_, not_, select, bindparam, exists,
                             functions)
-from sqlalchemy.sql.expression import true, literal, type_coerce
+from sqlalchemy.sql.expression import (true, null, literal, type_coerce,
+                                       case)
 from sqlalchemy.exc import NoSuchTableError, IntegrityError
 
 from dbworker import DBWorker, ESCAPE_CHAR
@@ -33,6 +34,10 @@ from pithos.backends.filter import parse_filters
 
 DEFAULT_DISKSPACE_RESOURCE = 'pithos.diskspace'
 ROOTNODE = 0
+# Ancestors resolved per query; enough for object, container and account.
+ANCESTORS_PER_QUERY = 3
+# Rows fetched per query by latest_version_iter.
+LISTING_PAGE_SIZE = 1000
 
 (MATCH_PREFIX, MATCH_EXACT) = range(2)
 
@@ -122,6 +127,22 @@ def create_tables(engine):
                           primary_key=True, autoincrement=False))
     Table('statistics', metadata, *columns, mysql_engine='InnoDB')
 
+    #create statistics deltas table
+    columns = []
+    columns.append(Column('serial', Integer, primary_key=True))
+    columns.append(Column('node', Integer,
+                          ForeignKey('nodes.node',
+                                     ondelete='CASCADE',
+                                     onupdate='CASCADE')))
+    columns.append(Column('population', Integer, nullable=False, default=0))
+    columns.append(Column('size', BigInteger, nullable=False, default=0))
+    columns.append(Column('mtime', DECIMAL(precision=16, scale=6)))
+    columns.append(Column('cluster', Integer, nullable=False, default=0))
+    statistics_deltas = Table('statistics_deltas', metadata, *columns,
+                              mysql_engine='InnoDB')
+    Index('idx_statistics_deltas_node_cluster', statistics_deltas.c.node,
+          statistics_deltas.c.cluster)
+
     #create versions table
     columns = []
     columns.append(Column('serial', Integer, primary_key=True))
@@ -215,12 +236,15 @@ class Node(DBWorker):
     def __init__(self, **params):
         self._props = params.pop('props')
         self.mapfile_prefix = params.pop('mapfile_prefix', 'snf_file_')
+        self.deferred_statistics = params.pop('deferred_statistics', False)
         DBWorker.__init__(self, **params)
         try:
             metadata = MetaData(self.engine)
             self.nodes = Table('nodes', metadata, autoload=True)
             self.policy = Table('policy', metadata, autoload=True)
             self.statistics = Table('statistics', metadata, autoload=True)
+            self.statistics_deltas = Table('statistics_deltas', metadata,
+                                           autoload=True)
             self.versions = Table('versions', metadata, autoload=True)
             self.attributes = Table('attributes', metadata, autoload=True)
             self.mapfile_seq = Sequence('mapfile_seq', metadata)
@@ -266,11 +290,13 @@ class Node(DBWorker):
         """
 
         # Use LIKE for comparison to avoid MySQL problems with trailing spaces.
-        s = select([self.nodes.c.node],
-                   self.nodes.c.path.like(self.escape_like(path),
-                                          escape=ESCAPE_CHAR),
-                   for_update=for_update)
-        r = self.conn.execute(s)
+        def build():
+            return select([self.nodes.c.node],
+                          self.nodes.c.path.like(bindparam('path'),
+                                                 escape=ESCAPE_CHAR),
+                          for_update=for_update)
+        r = self.execute_prepared(('node_lookup', for_update), build,
+                                  path=self.escape_like(path))
         row = r.fetchone()
         r.close()
         if row:
@@ -291,18 +317,72 @@ class Node(DBWorker):
         r.close()
         return [row[0] for row in rows]
 
+    def node_create_bulk(self, parent, paths):
+        """Create the nodes of the paths that do not exist under parent.
+           Return a dict mapping each of paths to its node.
+        """
+
+        if not paths:
+            return {}
+        s = select([self.nodes.c.path, self.nodes.c.node],
+                   self.nodes.c.path.in_(paths))
+        r = self.conn.execute(s)
+        nodes = dict(r.fetchall())
+        r.close()
+        missing = [path for path in paths if path not in nodes]
+        if missing:
+            self.conn.execute(
+                self.nodes.insert(),
+                [{'parent': parent, 'path': path} for path in missing]).close()
+            s = select([self.nodes.c.path, self.nodes.c.node],
+                       self.nodes.c.path.in_(missing))
+            r = self.conn.execute(s)
+            nodes.update(r.fetchall())
+            r.close()
+        return nodes
+
     def node_get_properties(self, node):
         """Return the node's (parent, path).
            Return None if the node is not found.
         """
 
-        s = select([self.nodes.c.parent, self.nodes.c.path])
-        s = s.where(self.nodes.c.node == node)
-        r = self.conn.execute(s)
+        def build():
+            return select([self.nodes.c.parent, self.nodes.c.path],
+                          self.nodes.c.node == bindparam('node'))
+        r = self.execute_prepared('node_get_properties', build, node=node)
         l = r.fetchone()
         r.close()
         return l
 
+    def node_get_ancestors(self, node, depth=None):
+        """Return the node's ancestors, starting with its parent and
+           up to the root or up to ``depth`` ancestors (if not None).
+           Each query resolves ANCESTORS_PER_QUERY levels.
+        """
+
+        ancestors = []
+        while node != ROOTNODE and (depth is None or len(ancestors) < depth):
+            aliases = [self.nodes.alias('n%d' % i)
+                       for i in range(ANCESTORS_PER_QUERY)]
+            j = aliases[0]
+            for child, parent in zip(aliases, aliases[1:]):
+                j = j.outerjoin(parent, parent.c.node == child.c.parent)
+            s = select([a.c.parent.label('p%d' % i)
+                        for i, a in enumerate(aliases)], from_obj=[j])
+            s = s.where(aliases[0].c.node == node)
+            r = self.conn.execute(s)
+            row = r.fetchone()
+            r.close()
+            if row is None:
+                break
+            for node in row:
+                if node is None:
+                    return ancestors
+                ancestors.append(node)
+                if node == ROOTNODE or len(ancestors) == depth:
+                    return ancestors
+        return ancestors
+
     def node_get_parent_path(self, node):
         """Return the node's parent path.
            Return None if the node is not found.
@@ -647,50 +727,107 @@ class Node(DBWorker):
            for all versions under node that belong to the cluster.
         """
 
-        s = select([self.statistics.c.population,
-                    self.statistics.c.size,
-                    self.statistics.c.mtime])
-        s = s.where(and_(self.statistics.c.node == node,
-                         self.statistics.c.cluster == cluster))
-        r = self.conn.execute(s)
+        def build():
+            return select(
+                [self.statistics.c.population, self.statistics.c.size,
+                 self.statistics.c.mtime],
+                and_(self.statistics.c.node == bindparam('node'),
+                     self.statistics.c.cluster == bindparam('cluster')))
+        r = self.execute_prepared('statistics_get', build, node=node,
+                                  cluster=cluster)
         row = r.fetchone()
         r.close()
-        return row
+        if not self.deferred_statistics:
+            return row
+
+        # Add the deltas that have not been folded yet.
+        d = self.statistics_deltas
+        s = select([func.sum(d.c.population), func.sum(d.c.size),
+                    func.max(d.c.serial)])
+        s = s.where(and_(d.c.node == node, d.c.cluster == cluster))
+        r = self.conn.execute(s)
+        population, size, serial = r.fetchone()
+        r.close()
+        if serial is None:
+            return row
+        s = select([d.c.mtime], d.c.serial == serial)
+        r = self.conn.execute(s)
+        mtime = r.fetchone()[0]
+        r.close()
+        population, size = int(population), int(size)
+        if row:
+            population += row[0]
+            size += row[1]
+        return max(population, 0), size, mtime
 
     def statistics_update(self, node, population, size, mtime, cluster=0):
         """Update the statistics of the given node.
            Statistics keep track the population, total
            size of objects and mtime in the node's namespace.
            May be zero or positive or negative numbers.
+           With deferred statistics, the change is recorded as a delta,
+           to be folded later by statistics_fold.
         """
-        s = select([self.statistics.c.population, self.statistics.c.size],
-                   and_(self.statistics.c.node == node,
-                        self.statistics.c.cluster == cluster))
-        rp = self.conn.execute(s)
-        r = rp.fetchone()
-        rp.close()
-        if not r:
-            prepopulation, presize = (0, 0)
+        if self.deferred_statistics:
+            ins = self.statistics_deltas.insert()
+            ins = ins.values(node=node, population=population, size=size,
+                             mtime=mtime, cluster=cluster)
+            self.conn.execute(ins).close()
         else:
-            prepopulation, presize = r
-        population += prepopulation
-        population = max(population, 0)
-        size += presize
-
-        #insert or replace
-        #TODO better upsert
-        u = self.statistics.update().where(and_(
-            self.statistics.c.node == node,
-            self.statistics.c.cluster == cluster))
-        u = u.values(population=population, size=size, mtime=mtime)
+            self._statistics_apply(node, population, size, mtime, cluster)
+
+    def _statistics_apply(self, node, population, size, mtime, cluster=0):
+        st = self.statistics
+        u = st.update().where(and_(st.c.node == node,
+                                   st.c.cluster == cluster))
+        u = u.values(population=case([(st.c.population + population < 0, 0)],
+                                     else_=st.c.population + population),
+                     size=st.c.size + size,
+                     mtime=mtime)
         rp = self.conn.execute(u)
         rp.close()
         if rp.rowcount == 0:
-            ins = self.statistics.insert()
-            ins = ins.values(node=node, population=population, size=size,
-                             mtime=mtime, cluster=cluster)
+            ins = st.insert()
+            ins = ins.values(node=node, population=max(population, 0),
+                             size=size, mtime=mtime, cluster=cluster)
             self.conn.execute(ins).close()
 
+    def statistics_fold(self, limit=10000):
+        """Fold up to limit of the oldest statistics deltas into
+           the statistics of their nodes.
+           Return the number of deltas folded.
+
+           The deltas are locked as they are read, so that an overlapping
+           fold waits for this one and skips the deltas it deleted.
+        """
+
+        d = self.statistics_deltas
+        s = select([d.c.serial, d.c.node, d.c.cluster, d.c.population,
+                    d.c.size, d.c.mtime], for_update=True)
+        s = s.order_by(d.c.serial).limit(limit)
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        if not rows:
+            return 0
+
+        # Rows are in serial order, so the last mtime of each node wins.
+        totals = {}
+        for serial, node, cluster, population, size, mtime in rows:
+            key = (node, cluster)
+            if key in totals:
+                total_population, total_size, _ = totals[key]
+                population += total_population
+                size += total_size
+            totals[key] = (population, size, mtime)
+        for (node, cluster), (population, size, mtime) in totals.iteritems():
+            self._statistics_apply(node, population, size, mtime, cluster)
+
+        serials = [row[0] for row in rows]
+        s = d.delete().where(d.c.serial.in_(serials))
+        self.conn.execute(s).close()
+        return len(rows)
+
     def statistics_update_ancestors(self, node, population, size, mtime,
                                     cluster=0, recursion_depth=None):
         """Update the statistics of the given node's parent.
@@ -699,20 +836,36 @@ class Node(DBWorker):
            Population is not recursive.
         """
 
-        i = 0
-        while True:
-            if node == ROOTNODE:
-                break
-            if recursion_depth is not None and recursion_depth <= i:
-                break
-            props = self.node_get_properties(node)
-            if props is None:
-                break
-            parent, path = props
+        ancestors = self.node_get_ancestors(node, recursion_depth)
+        for parent in ancestors:
             self.statistics_update(parent, population, size, mtime, cluster)
-            node = parent
             population = 0  # Population isn't recursive
-            i += 1
+
+    def _statistics_update_nodes(self, deltas, mtime,
+                                 update_statistics_ancestors_depth=None):
+        """Apply the (node, population, size, cluster) deltas to the
+           ancestors of the nodes, adding up the deltas of siblings.
+        """
+
+        if not deltas:
+            return
+        s = select([self.nodes.c.node, self.nodes.c.parent],
+                   self.nodes.c.node.in_(set(d[0] for d in deltas)))
+        r = self.conn.execute(s)
+        parents = dict(r.fetchall())
+        r.close()
+        totals = {}
+        for node, population, size, cluster in deltas:
+            key = (parents[node], cluster)
+            if key in totals:
+                node, total_population, total_size = totals[key]
+                population += total_population
+                size += total_size
+            totals[key] = (node, population, size)
+        for (parent, cluster), (node, population, size) in totals.iteritems():
+            self.statistics_update_ancestors(
+                node, population, size, mtime, cluster,
+                update_statistics_ancestors_depth)
 
     def statistics_latest(self, node, before=inf, except_cluster=0):
         """Return population, total size and last mtime
@@ -845,9 +998,7 @@ class Node(DBWorker):
         """
 
         mtime = time()
-        if size == 0:
-            mapfile = None
-        elif mapfile is None:
+        if size != 0 and mapfile is None:
             mapfile = literal(self.mapfile_prefix) + \
                 type_coerce(functions.next_value(self.mapfile_seq), String)
         s = self.versions.insert().returning(self.versions.c.serial,
@@ -870,6 +1021,62 @@ class Node(DBWorker):
 
         return serial, mtime, mapfile
 
+    def version_create_bulk(self, versions,
+                            update_statistics_ancestors_depth=None):
+        """Create a version for each of versions, given as dicts with the
+           arguments of version_create. The nodes must be distinct.
+           Return the (serial, mtime, mapfile) of each new version.
+        """
+
+        if not versions:
+            return []
+        mtime = time()
+        new_mapfile = []
+        given_mapfile = []
+        for v in versions:
+            values = {'node': v['node'], 'hash': v['hash'],
+                      'size': v['size'], 'type': v['type'],
+                      'source': v['source'], 'mtime': mtime,
+                      'muser': v['muser'], 'uuid': v['uuid'],
+                      'checksum': v['checksum'],
+                      'cluster': v.get('cluster', 0),
+                      'available': v.get('available', MAP_AVAILABLE),
+                      'map_check_timestamp': v.get('map_check_timestamp'),
+                      'is_snapshot': v.get('is_snapshot', False)}
+            if v['size'] != 0 and v.get('mapfile') is None:
+                new_mapfile.append(values)
+            else:
+                values['mapfile'] = v.get('mapfile')
+                given_mapfile.append(values)
+        if new_mapfile:
+            mapfile = literal(self.mapfile_prefix) + \
+                type_coerce(functions.next_value(self.mapfile_seq), String)
+            s = self.versions.insert().values(mapfile=mapfile)
+            self.conn.execute(s, new_mapfile).close()
+        if given_mapfile:
+            self.conn.execute(self.versions.insert(), given_mapfile).close()
+
+        nodes = [v['node'] for v in versions]
+        latest = select([func.max(self.versions.c.serial)],
+                        self.versions.c.node == self.nodes.c.node)
+        s = self.nodes.update().where(self.nodes.c.node.in_(nodes))
+        s = s.values(latest_version=latest.as_scalar())
+        self.conn.execute(s).close()
+        s = select([self.nodes.c.node, self.versions.c.serial,
+                    self.versions.c.mapfile],
+                   and_(self.nodes.c.node.in_(nodes),
+                        self.versions.c.serial ==
+                        self.nodes.c.latest_version))
+        r = self.conn.execute(s)
+        created = dict((row[0], row[1:]) for row in r.fetchall())
+        r.close()
+        self._statistics_update_nodes(
+            [(v['node'], 1, v['size'], v.get('cluster', 0))
+             for v in versions],
+            mtime, update_statistics_ancestors_depth)
+        return [(created[node][0], mtime, created[node][1])
+                for node in nodes]
+
     def version_lookup(self, node, before=inf, cluster=0, all_props=True,
                        keys=()):
         """Lookup the current version of the given node.
@@ -887,6 +1094,24 @@ class Node(DBWorker):
                impact on the performance.
         """
 
+        if before == inf and not keys:
+            # The lookup of the latest version is prepared.
+            def build():
+                return self._version_lookup_select(
+                    bindparam('node'), before, bindparam('cluster'), all_props,
+                    keys)
+            r = self.execute_prepared(('version_lookup', all_props), build,
+                                      node=node, cluster=cluster)
+        else:
+            r = self.conn.execute(self._version_lookup_select(
+                node, before, cluster, all_props, keys))
+        props = r.fetchone()
+        r.close()
+        if props:
+            return props
+        return None
+
+    def _version_lookup_select(self, node, before, cluster, all_props, keys):
         v = self.versions.alias('v')
         if not all_props:
             s = select([v.c.serial])
@@ -908,14 +1133,8 @@ class Node(DBWorker):
         else:
             c = select([self.nodes.c.latest_version],
                        self.nodes.c.node == node)
-        s = s.where(and_(v.c.serial == c,
-                         v.c.cluster == cluster))
-        r = self.conn.execute(s)
-        props = r.fetchone()
-        r.close()
-        if props:
-            return props
-        return None
+        return s.where(and_(v.c.serial == c,
+                            v.c.cluster == cluster))
 
     def version_lookup_bulk(self, nodes, before=inf, cluster=0,
                             all_props=True, order_by_path=False,
@@ -1018,6 +1237,111 @@ class Node(DBWorker):
         s = s.values(cluster=cluster)
         self.conn.execute(s).close()
 
+    def version_recluster_bulk(self, serials, cluster,
+                               update_statistics_ancestors_depth=None):
+        """Move the versions into another cluster."""
+
+        if not serials:
+            return
+        s = select([self.versions.c.node, self.versions.c.size,
+                    self.versions.c.cluster],
+                   and_(self.versions.c.serial.in_(serials),
+                        self.versions.c.cluster != cluster))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        if not rows:
+            return
+
+        deltas = []
+        for node, size, oldcluster in rows:
+            deltas.append((node, -1, -size, oldcluster))
+            deltas.append((node, 1, size, cluster))
+        self._statistics_update_nodes(deltas, time(),
+                                      update_statistics_ancestors_depth)
+
+        s = self.versions.update()
+        s = s.where(self.versions.c.serial.in_(serials))
+        s = s.values(cluster=cluster)
+        self.conn.execute(s).close()
+
+    def version_remove_bulk(self, serials,
+                            update_statistics_ancestors_depth=None):
+        """Remove the serials specified.
+           Return the (serial, hash, size) of the removed versions.
+        """
+
+        if not serials:
+            return []
+        s = select([self.versions.c.serial, self.versions.c.node,
+                    self.versions.c.hash, self.versions.c.size,
+                    self.versions.c.cluster],
+                   self.versions.c.serial.in_(serials))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        if not rows:
+            return []
+
+        self._statistics_update_nodes(
+            [(node, -1, -size, cluster) for _, node, _, size, cluster in rows],
+            time(), update_statistics_ancestors_depth)
+
+        s = self.versions.delete().where(self.versions.c.serial.in_(serials))
+        self.conn.execute(s).close()
+
+        latest = select([func.max(self.versions.c.serial)],
+                        self.versions.c.node == self.nodes.c.node)
+        s = self.nodes.update()
+        s = s.where(and_(self.nodes.c.node.in_(set(row[1] for row in rows)),
+                         self.nodes.c.latest_version.in_(serials)))
+        s = s.values(latest_version=latest.as_scalar())
+        self.conn.execute(s).close()
+        return [(serial, hash, size) for serial, _, hash, size, _ in rows]
+
+    def version_count_mapfiles(self):
+        """Return the number and total size of versions with a mapfile."""
+
+        s = select([func.count(self.versions.c.serial),
+                    func.sum(self.versions.c.size)],
+                   self.versions.c.mapfile != null())
+        r = self.conn.execute(s)
+        count, size = r.fetchone()
+        r.close()
+        return count, size or 0
+
+    def version_list_mapfiles(self, after=0, limit=10000):
+        """Return the (serial, mapfile, size, is_snapshot) of up to limit
+           versions with a mapfile and a serial greater than after,
+           ordered by serial.
+        """
+
+        v = self.versions
+        s = select([v.c.serial, v.c.mapfile, v.c.size, v.c.is_snapshot],
+                   and_(v.c.serial > after, v.c.mapfile != null()))
+        s = s.order_by(v.c.serial).limit(limit)
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return rows
+
+    def version_stats_prefix(self, prefix):
+        """Return the number and the greatest serial of the versions,
+           in any cluster, of the nodes whose path starts with prefix.
+        """
+
+        v = self.versions
+        n = self.nodes
+        c = select([n.c.node],
+                   n.c.path.like(self.escape_like(prefix) + '%',
+                                 escape=ESCAPE_CHAR))
+        s = select([func.count(v.c.serial), func.max(v.c.serial)],
+                   v.c.node.in_(c))
+        r = self.conn.execute(s)
+        row = r.fetchone()
+        r.close()
+        return tuple(row)
+
     def version_remove(self, serial, update_statistics_ancestors_depth=None):
         """Remove the serial specified."""
 
@@ -1138,12 +1462,45 @@ class Node(DBWorker):
                              is_latest=True, key=k, value=v)
             self.conn.execute(s).close()
 
+    def attribute_copy_bulk(self, copies):
+        """Copy all the attributes of versions to other versions.
+           Copies are given as (source serial, source node,
+           destination serial, destination node) tuples.
+        """
+
+        if not copies:
+            return
+        dest = dict(((src, src_node), (serial, node)) for
+                    src, src_node, serial, node in copies)
+        a = self.attributes
+        s = select([a.c.serial, a.c.node, a.c.domain, a.c.key, a.c.value],
+                   a.c.serial.in_(set(c[0] for c in copies)))
+        r = self.conn.execute(s)
+        values = [{'serial': dest[(serial, node)][0],
+                   'domain': domain,
+                   'node': dest[(serial, node)][1],
+                   'is_latest': True,
+                   'key': k,
+                   'value': v} for serial, node, domain, k, v in r.fetchall()
+                  if (serial, node) in dest]
+        r.close()
+        if values:
+            self.conn.execute(a.insert(), values).close()
+
     def attribute_unset_is_latest(self, node, exclude):
         u = self.attributes.update().where(and_(
             self.attributes.c.node == node,
             self.attributes.c.serial != exclude)).values({'is_latest': False})
         self.conn.execute(u)
 
+    def attribute_unset_is_latest_bulk(self, nodes, exclude):
+        if not nodes:
+            return
+        u = self.attributes.update().where(and_(
+            self.attributes.c.node.in_(nodes),
+            not_(self.attributes.c.serial.in_(exclude))))
+        self.conn.execute(u.values({'is_latest': False})).close()
+
     def latest_attribute_keys(self, parent, domain, before=inf,
                               except_cluster=0, pathq=None):
         """Return a list with all keys pairs defined
@@ -1193,6 +1550,29 @@ class Node(DBWorker):
                             except_cluster=0, pathq=[], domain=None,
                             filterq=[], sizeq=None, all_props=False):
         """Return a (list of (path, serial) tuples, list of common prefixes)
+           for the current versions of the paths with the given parent.
+           See latest_version_iter for the matching criteria.
+
+           Limit applies to the paths and prefixes together.
+        """
+
+        matches = []
+        prefixes = []
+        for props in self.latest_version_iter(
+                parent, prefix, delimiter, start, limit, before,
+                except_cluster, pathq, domain, filterq, sizeq, all_props):
+            if props[1] is None:
+                prefixes.append(props[0])
+            else:
+                matches.append(props)
+        return matches, prefixes
+
+    def latest_version_iter(self, parent, prefix='', delimiter=None,
+                            start='', limit=None, before=inf,
+                            except_cluster=0, pathq=[], domain=None,
+                            filterq=[], sizeq=None, all_props=False,
+                            page_size=LISTING_PAGE_SIZE):
+        """Generate (path, serial) tuples, ordered by path,
            for the current versions of the paths with the given parent,
            matching the following criteria.
 
@@ -1229,23 +1609,31 @@ class Node(DBWorker):
 
                 h. the size is in the range set by sizeq
 
-           The list of common prefixes includes the prefixes
-           matching up to the first delimiter after prefix,
-           and are reported only once, as "virtual directories".
+           Paths with the delimiter occuring after the prefix are rolled up
+           into common prefixes, matching up to the first delimiter after
+           prefix. These are generated once, as (prefix, None) tuples
+           ("virtual directories"), in their place in the path order.
            The delimiter is included in the prefixes.
 
            If arguments are None, then the corresponding matching rule
            will always match.
 
-           Limit applies to the first list of tuples returned.
+           Limit (if not None) applies to the tuples and prefixes together.
 
            If all_props is True, return all properties after path,
            not just serial.
+
+           Rows are fetched page_size at a time, each query continuing
+           from the last path seen or skipping past the last common prefix.
+           The rows of a page are fetched at once, so the database may be
+           used while iterating.
         """
 
         if not start or start < prefix:
             start = strprevling(prefix)
         nextling = strnextling(prefix)
+        if limit:
+            page_size = min(page_size, limit)
 
         v = self.versions.alias('v')
         if before != inf:
@@ -1346,51 +1734,51 @@ class Node(DBWorker):
                              self.attributes.c.value.op(o)(val)))
                     s = s.where(exists(subs))
 
-        s = s.order_by(d4.c.path)
+        s = s.order_by(d4.c.path).limit(page_size)
 
-        if not delimiter:
-            s = s.limit(limit)
-            rp = self.conn.execute(s, start=start)
-            r = rp.fetchall()
-            rp.close()
-            return r, ()
+        def fetch_page(start):
+            r = self.conn.execute(s, start=start)
+            rows = r.fetchall()
+            r.close()
+            return rows
+
+        return self._rollup_versions(fetch_page, start, prefix, delimiter,
+                                     limit, page_size)
+
+    def _rollup_versions(self, fetch_page, start, prefix, delimiter, limit,
+                         page_size):
+        """Generate the rows returned by fetch_page, rolling up paths
+           into common prefixes for latest_version_iter.
+        """
 
         pfz = len(prefix)
-        dz = len(delimiter)
+        dz = len(delimiter) if delimiter else 0
         count = 0
-        prefixes = []
-        pappend = prefixes.append
-        matches = []
-        mappend = matches.append
-
-        rp = self.conn.execute(s, start=start)
+        pf = None
         while True:
-            props = rp.fetchone()
-            if props is None:
-                break
-            path = props[0]
-            idx = path.find(delimiter, pfz)
-
-            if idx < 0:
-                mappend(props)
+            rows = fetch_page(start)
+            for props in rows:
+                path = props[0]
+                if pf is not None:
+                    if path.startswith(pf):
+                        continue
+                    pf = None
+                if delimiter:
+                    idx = path.find(delimiter, pfz)
+                    if idx >= 0 and idx + dz != len(path):
+                        pf = path[:idx + dz]
+                        props = (pf, None)
+                yield props
                 count += 1
-                if count >= limit:
-                    break
-                continue
-
-            if idx + dz == len(path):
-                mappend(props)
-                count += 1
-                continue  # Get one more, in case there is a path.
-            pf = path[:idx + dz]
-            pappend(pf)
-            if count >= limit:
-                break
-
-            rp = self.conn.execute(s, start=strnextling(pf))  # New start.
-        rp.close()
-
-        return matches, prefixes
+                if limit and count >= limit:
+                    return
+            if len(rows) < page_size:
+                return
+            # Skip the rest of the common prefix or continue after the page.
+            if pf is not None:
+                start = strprevling(strnextling(pf))
+            else:
+                start = rows[-1][0]
 
     def latest_uuid(self, uuid, cluster):
         """Return the latest version of the given uuid and cluster.
@@ -1415,9 +1803,12 @@ class Node(DBWorker):
         r.close()
         return l
 
-    def domain_object_list(self, domain, paths, cluster=None):
+    def domain_object_list(self, domain, paths, cluster=None, account=None):
         """Return a list of (path, property list, attribute dictionary)
-           for the objects in the specific domain and cluster.
+           for the objects in the specific domain and cluster,
+           ordered by path.
+           If paths or account are given, return only the objects with
+           these paths or in the containers of the account.
         """
 
         v = self.versions.alias('v')
@@ -1437,15 +1828,25 @@ class Node(DBWorker):
         s = s.where(a.c.domain == domain)
         s = s.where(a.c.node == n.c.node)
         s = s.where(a.c.is_latest == true())
+        conds = []
         if paths:
-            s = s.where(n.c.path.in_(paths))
+            conds.append(n.c.path.in_(paths))
+        if account is not None:
+            account_node = select([self.nodes.c.node],
+                                  self.nodes.c.path == account)
+            containers = select([self.nodes.c.node],
+                                self.nodes.c.parent.in_(account_node))
+            conds.append(n.c.parent.in_(containers))
+        if conds:
+            s = s.where(or_(*conds))
+        s = s.order_by(n.c.path, v.c.serial)
 
         r = self.conn.execute(s)
         rows = r.fetchall()
         r.close()
 
+        # Rows are ordered, so the attributes of each object are adjacent.
         group_by = itemgetter(slice(len(props)))
-        rows.sort(key=group_by)
         groups = groupby(rows, group_by)
         return [(k[0], k[1:], dict([i[len(props):] for i in data])) for
                 (k, data) in groups]
@@ -13,8 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy.sql import select, literal, or_, and_
-from sqlalchemy.sql.expression import join, union
+from sqlalchemy.sql import select, or_, and_
 
 from xfeatures import XFeatures
 from groups import Groups
@@ -32,6 +31,8 @@ WRITE = 1
 class Permissions(XFeatures, Groups, Public, Node):
 
     def __init__(self, **params):
+        self.principals_cache = params.pop('principals_cache', None)
+        self._principals = {}
         XFeatures.__init__(self, **params)
         Groups.__init__(self, **params)
         Public.__init__(self, **params)
@@ -64,23 +65,6 @@ class Permissions(XFeatures, Groups, Public, Node):
         if w:
             self.feature_setmany(feature, WRITE, w)
 
-    def access_get_for_bulk(self, perms):
-        """Get permissions for path."""
-        allowed = None
-        d = defaultdict(list)
-        for value, feature_id, key in perms:
-            d[key].append(value)
-        permissions = d
-        if READ in permissions:
-            allowed = 0
-            permissions['read'] = permissions[READ]
-            del(permissions[READ])
-        if WRITE in permissions:
-            allowed = 1
-            permissions['write'] = permissions[WRITE]
-            del(permissions[WRITE])
-        return (permissions, allowed)
-
     def access_get(self, path):
         """Get permissions for path."""
 
@@ -96,6 +80,33 @@ class Permissions(XFeatures, Groups, Public, Node):
             del(permissions[WRITE])
         return permissions
 
+    def access_get_bulk(self, paths):
+        """Get permissions for paths.
+           Return a dict mapping the paths with permissions to their
+           permissions, as returned by access_get.
+        """
+
+        if not paths:
+            return {}
+        j = self.xfeatures.join(
+            self.xfeaturevals,
+            self.xfeatures.c.feature_id == self.xfeaturevals.c.feature_id)
+        s = select([self.xfeatures.c.path, self.xfeaturevals.c.key,
+                    self.xfeaturevals.c.value], from_obj=[j])
+        s = s.where(self.xfeatures.c.path.in_(paths))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return self._permissions_by_path(rows)
+
+    def _permissions_by_path(self, rows):
+        names = {READ: 'read', WRITE: 'write'}
+        d = {}
+        for path, key, value in rows:
+            permissions = d.setdefault(path, defaultdict(list))
+            permissions[names.get(key, key)].append(value)
+        return d
+
     def access_members(self, path):
         feature = self.xfeature_get(path)
         if not feature:
@@ -132,39 +143,78 @@ class Permissions(XFeatures, Groups, Public, Node):
         if not feature:
             return False
         members = self.feature_get(feature, access)
-        if member in members or '*' in members:
-            return True
-        for owner, group in self.group_parents(member):
-            if owner + ':' + group in members:
-                return True
-        return False
-
-    def access_check_bulk(self, paths, member):
-        rows = None
-        xfeatures_xfeaturevals = \
-            self.xfeaturevals.join(self.xfeatures,
-                                   onclause=
-                                   and_(self.xfeatures.c.feature_id ==
-                                        self.xfeaturevals.c.feature_id,
-                                        self.xfeatures.c.path.in_(paths)))
-        s = select([self.xfeatures.c.path,
-                   self.xfeaturevals.c.value,
-                   self.xfeaturevals.c.feature_id,
-                   self.xfeaturevals.c.key],
-                   from_obj=[xfeatures_xfeaturevals])
+        return not self.access_principals(member).isdisjoint(members)
+
+    def access_check_many(self, paths, member):
+        """Return the access granted to member for each of paths.
+           The result maps the paths member has access to, to the set
+           of access keys (READ, WRITE) granted, in a single query.
+        """
+
+        if not paths:
+            return {}
+        principals = self.access_principals(member)
+        j = self.xfeatures.join(
+            self.xfeaturevals,
+            self.xfeatures.c.feature_id == self.xfeaturevals.c.feature_id)
+        s = select([self.xfeatures.c.path, self.xfeaturevals.c.key],
+                   from_obj=[j]).distinct()
+        s = s.where(and_(self.xfeatures.c.path.in_(paths),
+                         self.xfeaturevals.c.value.in_(principals)))
         r = self.conn.execute(s)
         rows = r.fetchall()
         r.close()
-        if rows:
-            access_check_paths = {}
-            for path, value, feature_id, key in rows:
-                try:
-                    access_check_paths[path].append((value, feature_id, key))
-                except KeyError:
-                    access_check_paths[path] = [(value, feature_id, key)]
-            access_check_paths['group_parents'] = self.group_parents(member)
-            return access_check_paths
-        return None
+        d = {}
+        for path, key in rows:
+            d.setdefault(path, set()).add(key)
+        return d
+
+    def access_principals(self, member):
+        """Return the principals member is matched against in permissions:
+           the member itself, '*' and every 'owner:group' containing member.
+
+           Principals are kept for the rest of the request and,
+           if a principals cache is configured, shared among requests.
+        """
+
+        principals = self._principals.get(member)
+        if principals is None and self.principals_cache is not None:
+            principals = self.principals_cache.get(member)
+        if principals is None:
+            principals = frozenset(
+                [member, '*'] + [owner + ':' + group for owner, group in
+                                 self.group_parents(member)])
+            if self.principals_cache is not None:
+                self.principals_cache.put(member, principals)
+        self._principals[member] = principals
+        return principals
+
+    def access_reset_principals(self, shared=False):
+        """Forget the principals computed in this request.
+           If shared is set, clear the principals cache too.
+        """
+
+        self._principals = {}
+        if shared and self.principals_cache is not None:
+            self.principals_cache.clear()
+
+    def _inherit_candidates(self, paths):
+        """Return the path components that may influence the access
+           for paths, without duplicates and in the order of paths.
+        """
+
+        valid = []
+        seen = set()
+        for path in paths:
+            parts = path.rstrip('/').split('/')
+            for i in range(1, len(parts)):
+                subp = '/'.join(parts[:i + 1])
+                candidates = [subp] if subp == path else [subp, subp + '/']
+                for c in candidates:
+                    if c not in seen:
+                        seen.add(c)
+                        valid.append(c)
+        return valid
 
     def access_inherit(self, path):
         """Return the paths influencing the access for path."""
@@ -175,30 +225,17 @@ class Permissions(XFeatures, Groups, Public, Node):
 #         # Compute valid.
 #         return [x[0] for x in r if x[0] in valid]
 
-        # Only keep path components.
-        parts = path.rstrip('/').split('/')
-        valid = []
-        for i in range(1, len(parts)):
-            subp = '/'.join(parts[:i + 1])
-            valid.append(subp)
-            if subp != path:
-                valid.append(subp + '/')
-        return [x for x in valid if self.xfeature_get(x)]
+        # Only keep path components, looked up with a single query.
+        valid = self._inherit_candidates([path])
+        found = set(x[1] for x in self.xfeature_get_bulk(valid) or [])
+        return [x for x in valid if x in found]
 
     def access_inherit_bulk(self, paths):
-        """Return the paths influencing the access for path."""
+        """Return the paths influencing the access for paths."""
 
         # Only keep path components.
-        valid = []
-        for path in paths:
-            parts = path.rstrip('/').split('/')
-            for i in range(1, len(parts)):
-                subp = '/'.join(parts[:i + 1])
-                valid.append(subp)
-                if subp != path:
-                    valid.append(subp + '/')
-        valid = self.xfeature_get_bulk(valid)
-        return [x[1] for x in valid]
+        valid = self._inherit_candidates(paths)
+        return [x[1] for x in self.xfeature_get_bulk(valid) or []]
 
     def access_list_paths(self, member, prefix=None, include_owned=False,
                           include_containers=True):
@@ -213,18 +250,10 @@ class Permissions(XFeatures, Groups, Public, Node):
         """
 
         xfeatures_xfeaturevals = self.xfeatures.join(self.xfeaturevals)
-
-        selectable = (self.groups.c.owner + ':' + self.groups.c.name)
-        member_groups = select([selectable.label('value')],
-                               self.groups.c.member == member)
-
-        members = select([literal(member).label('value')])
-        any = select([literal('*').label('value')])
-
-        u = union(member_groups, members, any).alias()
-        inner_join = join(xfeatures_xfeaturevals, u,
-                          self.xfeaturevals.c.value == u.c.value)
-        s = select([self.xfeatures.c.path], from_obj=[inner_join]).distinct()
+        principals = self.access_principals(member)
+        s = select([self.xfeatures.c.path],
+                   from_obj=[xfeatures_xfeaturevals]).distinct()
+        s = s.where(self.xfeaturevals.c.value.in_(principals))
         if prefix:
             like = lambda p: self.xfeatures.c.path.like(
                 self.escape_like(p) + '%', escape=ESCAPE_CHAR)
@@ -244,7 +273,8 @@ class Permissions(XFeatures, Groups, Public, Node):
                                 self.nodes.c.node.in_(container_nodes))
             s = select([self.nodes.c.path], condition)
             r = self.conn.execute(s)
-            l += [row[0] for row in r.fetchall() if row[0] not in l]
+            seen = set(l)
+            l += [row[0] for row in r.fetchall() if row[0] not in seen]
             r.close()
         return l
 
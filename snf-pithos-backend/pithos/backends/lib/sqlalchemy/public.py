@@ -15,7 +15,7 @@
 
 from dbworker import DBWorker
 from sqlalchemy import Table, Column, String, Integer, Boolean, MetaData
-from sqlalchemy.sql import and_, select
+from sqlalchemy.sql import and_, select, bindparam
 from sqlalchemy.schema import Index
 from sqlalchemy.exc import NoSuchTableError
 
@@ -98,16 +98,26 @@ class Public(DBWorker):
         self.conn.execute(s).close()
 
     def public_get(self, path):
-        s = select([self.public.c.url])
-        s = s.where(and_(self.public.c.path == path,
-                         self.public.c.active == True))
-        r = self.conn.execute(s)
+        def build():
+            return select([self.public.c.url],
+                          and_(self.public.c.path == bindparam('path'),
+                               self.public.c.active == True))
+        r = self.execute_prepared('public_get', build, path=path)
         row = r.fetchone()
         r.close()
         if row:
             return row[0]
         return None
 
+    def public_get_bulk(self, paths):
+        s = select([self.public.c.path, self.public.c.url])
+        s = s.where(and_(self.public.c.path.in_(paths),
+                         self.public.c.active == True))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return rows
+
     def public_list(self, prefix):
         s = select([self.public.c.path, self.public.c.url])
         s = s.where(self.public.c.path.like(
@@ -14,7 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from sqlalchemy import Table, Column, MetaData
-from sqlalchemy.types import BigInteger
+from sqlalchemy.types import BigInteger, Integer, String, DECIMAL
 from sqlalchemy.sql import select
 from sqlalchemy.exc import NoSuchTableError
 
@@ -27,6 +27,15 @@ def create_tables(engine):
     columns.append(Column('serial', BigInteger, primary_key=True))
     Table('qh_serials', metadata, *columns, mysql_engine='InnoDB')
 
+    columns = []
+    columns.append(Column('lease', Integer, primary_key=True))
+    columns.append(Column('holder', String(256)))
+    columns.append(Column('source', String(256)))
+    columns.append(Column('amount', BigInteger, nullable=False, default=0))
+    columns.append(Column('expires', DECIMAL(precision=16, scale=6)))
+    columns.append(Column('owner', String(256)))
+    Table('qh_leases', metadata, *columns, mysql_engine='InnoDB')
+
     metadata.create_all(engine)
     return metadata.sorted_tables
 
@@ -40,6 +49,7 @@ class QuotaholderSerial(DBWorker):
         try:
             metadata = MetaData(self.engine)
             self.qh_serials = Table('qh_serials', metadata, autoload=True)
+            self.qh_leases = Table('qh_leases', metadata, autoload=True)
         except NoSuchTableError:
             tables = create_tables(self.engine)
             map(lambda t: self.__setattr__(t.name, t), tables)
@@ -91,3 +101,42 @@ class QuotaholderSerial(DBWorker):
             self.qh_serials.c.serial.in_(serials)
         )
         self.conn.execute(st).close()
+
+    def insert_lease(self, holder, source, amount, expires, owner):
+        """Journal a quota lease and return its id."""
+
+        s = self.qh_leases.insert()
+        r = self.conn.execute(s, holder=holder, source=source, amount=amount,
+                              expires=expires, owner=owner)
+        inserted_primary_key = r.inserted_primary_key[0]
+        r.close()
+        return inserted_primary_key
+
+    def spend_lease(self, lease, amount):
+        """Subtract amount from the quota left in a lease."""
+
+        s = self.qh_leases.update().where(self.qh_leases.c.lease == lease)
+        s = s.values(amount=self.qh_leases.c.amount - amount)
+        self.conn.execute(s).close()
+
+    def delete_lease(self, lease):
+        """Delete a lease and return whether it was still journaled."""
+
+        s = self.qh_leases.delete().where(self.qh_leases.c.lease == lease)
+        r = self.conn.execute(s)
+        deleted = r.rowcount > 0
+        r.close()
+        return deleted
+
+    def list_leases(self):
+        """Return the journaled leases as
+           (lease, holder, source, amount, expires, owner).
+        """
+
+        l = self.qh_leases
+        s = select([l.c.lease, l.c.holder, l.c.source, l.c.amount,
+                    l.c.expires, l.c.owner])
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return rows
@@ -15,7 +15,7 @@
 
 from collections import defaultdict
 from sqlalchemy import Table, Column, String, Integer, MetaData, ForeignKey
-from sqlalchemy.sql import select, and_
+from sqlalchemy.sql import select, and_, bindparam
 from sqlalchemy.schema import Index
 from sqlalchemy.exc import NoSuchTableError
 
@@ -76,10 +76,10 @@ class XFeatures(DBWorker):
     def xfeature_get(self, path):
         """Return feature for path."""
 
-        s = select([self.xfeatures.c.feature_id])
-        s = s.where(self.xfeatures.c.path == path)
-        s = s.order_by(self.xfeatures.c.path)
-        r = self.conn.execute(s)
+        def build():
+            return select([self.xfeatures.c.feature_id],
+                          self.xfeatures.c.path == bindparam('path'))
+        r = self.execute_prepared('xfeature_get', build, path=path)
         row = r.fetchone()
         r.close()
         if row:
@@ -187,10 +187,13 @@ class XFeatures(DBWorker):
     def feature_get(self, feature, key):
         """Return the list of values for a key of a feature."""
 
-        s = select([self.xfeaturevals.c.value])
-        s = s.where(and_(self.xfeaturevals.c.feature_id == feature,
-                         self.xfeaturevals.c.key == key))
-        r = self.conn.execute(s)
+        def build():
+            return select(
+                [self.xfeaturevals.c.value],
+                and_(self.xfeaturevals.c.feature_id == bindparam('feature'),
+                     self.xfeaturevals.c.key == bindparam('key')))
+        r = self.execute_prepared('feature_get', build, feature=feature,
+                                  key=key)
         l = [row[0] for row in r.fetchall()]
         r.close()
         return l
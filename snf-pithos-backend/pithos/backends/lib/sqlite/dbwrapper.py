@@ -20,9 +20,13 @@ except ImportError:
 
 
 class DBWrapper(object):
-    """Database connection wrapper."""
+    """Database connection wrapper.
 
-    def __init__(self, db):
+       SQLite connections are not pooled and pool_size is ignored.
+       The sqlite3 module caches the prepared statements by itself.
+    """
+
+    def __init__(self, db, pool_size=0):
         self.conn = sqlite3.connect(db, check_same_thread=False)
         self.conn.execute(""" pragma case_sensitive_like = on """)
 
@@ -24,6 +24,10 @@ from pithos.backends.filter import parse_filters
 
 
 ROOTNODE = 0
+# Ancestors resolved per query; enough for object, container and account.
+ANCESTORS_PER_QUERY = 3
+# Rows fetched per query by latest_version_iter.
+LISTING_PAGE_SIZE = 1000
 
 (MATCH_PREFIX, MATCH_EXACT) = range(2)
 
@@ -79,6 +83,7 @@ class Node(DBWorker):
         for p in self._props:
             setattr(self, p.upper(), self._props[p])
         self.mapfile_prefix = params.pop('mapfile_prefix', 'snf_file_')
+        self.deferred_statistics = params.pop('deferred_statistics', False)
         DBWorker.__init__(self, **params)
         execute = self.execute
 
@@ -122,6 +127,21 @@ class Node(DBWorker):
                             on update cascade
                             on delete cascade ) """)
 
+        execute(""" create table if not exists statistics_deltas
+                          ( serial     integer primary key,
+                            node       integer,
+                            population integer not null default 0,
+                            size       integer not null default 0,
+                            mtime      integer,
+                            cluster    integer not null default 0,
+                            foreign key (node)
+                            references nodes(node)
+                            on update cascade
+                            on delete cascade ) """)
+        execute(""" create index if not exists
+                    idx_statistics_deltas_node_cluster
+                    on statistics_deltas(node, cluster) """)
+
         execute(""" create table if not exists versions
                           ( serial     integer primary key,
                             node       integer,
@@ -215,6 +235,27 @@ class Node(DBWorker):
             return [row[0] for row in r]
         return None
 
+    def node_create_bulk(self, parent, paths):
+        """Create the nodes of the paths that do not exist under parent.
+           Return a dict mapping each of paths to its node.
+        """
+
+        if not paths:
+            return {}
+        placeholders = ','.join('?' for path in paths)
+        q = "select path, node from nodes where path in (%s)" % placeholders
+        self.execute(q, paths)
+        nodes = dict(self.fetchall())
+        missing = [path for path in paths if path not in nodes]
+        if missing:
+            q = "insert into nodes (parent, path) values (?, ?)"
+            self.executemany(q, ((parent, path) for path in missing))
+            q = "select path, node from nodes where path in (%s)" % \
+                ','.join('?' for path in missing)
+            self.execute(q, missing)
+            nodes.update(self.fetchall())
+        return nodes
+
     def node_get_properties(self, node):
         """Return the node's (parent, path).
            Return None if the node is not found.
@@ -224,6 +265,30 @@ class Node(DBWorker):
         self.execute(q, (node,))
         return self.fetchone()
 
+    def node_get_ancestors(self, node, depth=None):
+        """Return the node's ancestors, starting with its parent and
+           up to the root or up to ``depth`` ancestors (if not None).
+           Each query resolves ANCESTORS_PER_QUERY levels.
+        """
+
+        q = ("select %s from nodes as n0 %s where n0.node = ?") % (
+            ', '.join('n%d.parent' % i for i in range(ANCESTORS_PER_QUERY)),
+            ' '.join('left join nodes as n%d on n%d.node = n%d.parent' % (
+                i, i, i - 1) for i in range(1, ANCESTORS_PER_QUERY)))
+        ancestors = []
+        while node != ROOTNODE and (depth is None or len(ancestors) < depth):
+            self.execute(q, (node,))
+            row = self.fetchone()
+            if row is None:
+                break
+            for node in row:
+                if node is None:
+                    return ancestors
+                ancestors.append(node)
+                if node == ROOTNODE or len(ancestors) == depth:
+                    return ancestors
+        return ancestors
+
     def node_get_parent_path(self, node):
         """Return the node's parent path.
            Return None if the node is not found.
@@ -449,30 +514,86 @@ class Node(DBWorker):
         q = ("select population, size, mtime from statistics "
              "where node = ? and cluster = ?")
         self.execute(q, (node, cluster))
-        return self.fetchone()
+        row = self.fetchone()
+        if not self.deferred_statistics:
+            return row
+
+        # Add the deltas that have not been folded yet.
+        q = ("select sum(population), sum(size), max(serial) "
+             "from statistics_deltas where node = ? and cluster = ?")
+        self.execute(q, (node, cluster))
+        population, size, serial = self.fetchone()
+        if serial is None:
+            return row
+        q = "select mtime from statistics_deltas where serial = ?"
+        self.execute(q, (serial,))
+        mtime = self.fetchone()[0]
+        if row:
+            population += row[0]
+            size += row[1]
+        return max(population, 0), size, mtime
 
     def statistics_update(self, node, population, size, mtime, cluster=0):
         """Update the statistics of the given node.
            Statistics keep track the population, total
            size of objects and mtime in the node's namespace.
            May be zero or positive or negative numbers.
+           With deferred statistics, the change is recorded as a delta,
+           to be folded later by statistics_fold.
         """
 
-        qs = ("select population, size from statistics "
+        if self.deferred_statistics:
+            q = ("insert into statistics_deltas "
+                 "(node, population, size, mtime, cluster) "
+                 "values (?, ?, ?, ?, ?)")
+            self.execute(q, (node, population, size, mtime, cluster))
+        else:
+            self._statistics_apply(node, population, size, mtime, cluster)
+
+    def _statistics_apply(self, node, population, size, mtime, cluster=0):
+        qu = ("update statistics "
+              "set population = max(population + ?, 0), "
+              "size = size + ?, mtime = ? "
               "where node = ? and cluster = ?")
-        qu = ("insert or replace into statistics "
+        qi = ("insert into statistics "
               "(node, population, size, mtime, cluster) "
               "values (?, ?, ?, ?, ?)")
-        self.execute(qs, (node, cluster))
-        r = self.fetchone()
-        if r is None:
-            prepopulation, presize = (0, 0)
-        else:
-            prepopulation, presize = r
-        population += prepopulation
-        population = max(population, 0)
-        size += presize
-        self.execute(qu, (node, population, size, mtime, cluster))
+        self.execute(qu, (population, size, mtime, node, cluster))
+        if self.cur.rowcount == 0:
+            self.execute(qi, (node, max(population, 0), size, mtime, cluster))
+
+    def statistics_fold(self, limit=10000):
+        """Fold up to limit of the oldest statistics deltas into
+           the statistics of their nodes.
+           Return the number of deltas folded.
+
+           The write lock is taken before the deltas are read, so that an
+           overlapping fold waits for this one and reads what is left.
+        """
+
+        self.execute("update statistics_deltas set serial = serial where 0")
+        q = ("select serial, node, cluster, population, size, mtime "
+             "from statistics_deltas order by serial limit ?")
+        self.execute(q, (limit,))
+        rows = self.fetchall()
+        if not rows:
+            return 0
+
+        # Rows are in serial order, so the last mtime of each node wins.
+        totals = {}
+        for serial, node, cluster, population, size, mtime in rows:
+            key = (node, cluster)
+            if key in totals:
+                total_population, total_size, _ = totals[key]
+                population += total_population
+                size += total_size
+            totals[key] = (population, size, mtime)
+        for (node, cluster), (population, size, mtime) in totals.iteritems():
+            self._statistics_apply(node, population, size, mtime, cluster)
+
+        q = "delete from statistics_deltas where serial = ?"
+        self.executemany(q, ((row[0],) for row in rows))
+        return len(rows)
 
     def statistics_update_ancestors(self, node, population, size, mtime,
                                     cluster=0, recursion_depth=None):
@@ -481,20 +602,36 @@ class Node(DBWorker):
            Population is not recursive.
         """
 
-        i = 0
-        while True:
-            if node == ROOTNODE:
-                break
-            if recursion_depth is not None and recursion_depth <= i:
-                break
-            props = self.node_get_properties(node)
-            if props is None:
-                break
-            parent, path = props
+        ancestors = self.node_get_ancestors(node, recursion_depth)
+        for parent in ancestors:
             self.statistics_update(parent, population, size, mtime, cluster)
-            node = parent
             population = 0  # Population isn't recursive
-            i += 1
+
+    def _statistics_update_nodes(self, deltas, mtime,
+                                 update_statistics_ancestors_depth=None):
+        """Apply the (node, population, size, cluster) deltas to the
+           ancestors of the nodes, adding up the deltas of siblings.
+        """
+
+        if not deltas:
+            return
+        nodes = list(set(d[0] for d in deltas))
+        q = "select node, parent from nodes where node in (%s)" % \
+            ','.join('?' for node in nodes)
+        self.execute(q, nodes)
+        parents = dict(self.fetchall())
+        totals = {}
+        for node, population, size, cluster in deltas:
+            key = (parents[node], cluster)
+            if key in totals:
+                node, total_population, total_size = totals[key]
+                population += total_population
+                size += total_size
+            totals[key] = (node, population, size)
+        for (parent, cluster), (node, population, size) in totals.iteritems():
+            self.statistics_update_ancestors(
+                node, population, size, mtime, cluster,
+                update_statistics_ancestors_depth)
 
     def statistics_latest(self, node, before=inf, except_cluster=0):
         """Return population, total size and last mtime
@@ -575,7 +712,7 @@ class Node(DBWorker):
                        checksum, cluster=0,
                        update_statistics_ancestors_depth=None,
                        available=MAP_AVAILABLE, map_check_timestamp=None,
-                       mapfile=True, is_snapshot=False):
+                       mapfile=None, is_snapshot=False):
         """Create a new version from the given properties.
            Return the (serial, mtime, mapfile) of the new version.
 
@@ -583,9 +720,7 @@ class Node(DBWorker):
        Otherwise, assign to the mapfile a new unique identifier.
         """
 
-        if size == 0:
-            mapfile = None
-        elif mapfile is None:
+        if size != 0 and mapfile is None:
             q = ("insert into mapfile_seq (dummy) values (?)")
             serial = self.execute(q, (False,)).lastrowid
             mapfile = ''.join([self.mapfile_prefix, unicode(serial)])
@@ -606,6 +741,55 @@ class Node(DBWorker):
 
         return serial, mtime, mapfile
 
+    def version_create_bulk(self, versions,
+                            update_statistics_ancestors_depth=None):
+        """Create a version for each of versions, given as dicts with the
+           arguments of version_create. The nodes must be distinct.
+           Return the (serial, mtime, mapfile) of each new version.
+        """
+
+        if not versions:
+            return []
+        mtime = time()
+        rows = []
+        for v in versions:
+            size = v['size']
+            mapfile = v.get('mapfile')
+            if size != 0 and mapfile is None:
+                q = ("insert into mapfile_seq (dummy) values (?)")
+                serial = self.execute(q, (False,)).lastrowid
+                mapfile = ''.join([self.mapfile_prefix, unicode(serial)])
+            rows.append((v['node'], v['hash'], size, v['type'], v['source'],
+                         mtime, v['muser'], v['uuid'], v['checksum'],
+                         v.get('cluster', 0),
+                         v.get('available', MAP_AVAILABLE),
+                         v.get('map_check_timestamp'), mapfile,
+                         v.get('is_snapshot', False)))
+        q = ("insert into versions (node, hash, size, type, source, mtime, "
+             "muser, uuid, checksum, cluster, available, "
+             "map_check_timestamp, mapfile, is_snapshot) "
+             "values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+        self.executemany(q, rows)
+
+        nodes = [v['node'] for v in versions]
+        placeholders = ','.join('?' for node in nodes)
+        q = ("update nodes set latest_version = "
+             "(select max(serial) from versions "
+             " where versions.node = nodes.node) "
+             "where node in (%s)" % placeholders)
+        self.execute(q, nodes)
+        q = ("select n.node, v.serial, v.mapfile from nodes n, versions v "
+             "where n.node in (%s) and v.serial = n.latest_version" %
+             placeholders)
+        self.execute(q, nodes)
+        created = dict((r[0], r[1:]) for r in self.fetchall())
+        self._statistics_update_nodes(
+            [(v['node'], 1, v['size'], v.get('cluster', 0))
+             for v in versions],
+            mtime, update_statistics_ancestors_depth)
+        return [(created[node][0], mtime, created[node][1])
+                for node in nodes]
+
     def version_lookup(self, node, before=inf, cluster=0, all_props=True,
                        keys=()):
         """Lookup the current version of the given node.
@@ -670,7 +854,7 @@ class Node(DBWorker):
             q = q % ("serial", subq, '')
         else:
             if keys:
-                cols = ','.join(k for k in keys if k in self._props)
+                cols = ','.join('v.' + k for k in keys if k in self._props)
             else:
                 cols = ("v.serial, v.node, v.hash, v.size, v.type, v.source, "
                         "v.mtime, v.muser, v.uuid, v.checksum, v.cluster, "
@@ -734,6 +918,96 @@ class Node(DBWorker):
         q = "update versions set cluster = ? where serial = ?"
         self.execute(q, (cluster, serial))
 
+    def version_recluster_bulk(self, serials, cluster,
+                               update_statistics_ancestors_depth=None):
+        """Move the versions into another cluster."""
+
+        if not serials:
+            return
+        placeholders = ','.join('?' for serial in serials)
+        q = ("select node, size, cluster from versions "
+             "where serial in (%s) and cluster != ?" % placeholders)
+        self.execute(q, list(serials) + [cluster])
+        rows = self.fetchall()
+        if not rows:
+            return
+
+        deltas = []
+        for node, size, oldcluster in rows:
+            deltas.append((node, -1, -size, oldcluster))
+            deltas.append((node, 1, size, cluster))
+        self._statistics_update_nodes(deltas, time(),
+                                      update_statistics_ancestors_depth)
+
+        q = "update versions set cluster = ? where serial in (%s)" % \
+            placeholders
+        self.execute(q, [cluster] + list(serials))
+
+    def version_remove_bulk(self, serials,
+                            update_statistics_ancestors_depth=None):
+        """Remove the serials specified.
+           Return the (serial, hash, size) of the removed versions.
+        """
+
+        if not serials:
+            return []
+        placeholders = ','.join('?' for serial in serials)
+        q = ("select serial, node, hash, size, cluster from versions "
+             "where serial in (%s)" % placeholders)
+        self.execute(q, serials)
+        rows = self.fetchall()
+        if not rows:
+            return []
+
+        self._statistics_update_nodes(
+            [(node, -1, -size, cluster) for _, node, _, size, cluster in rows],
+            time(), update_statistics_ancestors_depth)
+
+        q = "delete from versions where serial in (%s)" % placeholders
+        self.execute(q, serials)
+
+        nodes = list(set(row[1] for row in rows))
+        q = ("update nodes set latest_version = "
+             "(select max(serial) from versions "
+             " where versions.node = nodes.node) "
+             "where node in (%s) and latest_version in (%s)" %
+             (','.join('?' for node in nodes), placeholders))
+        self.execute(q, nodes + list(serials))
+        return [(serial, hash, size) for serial, _, hash, size, _ in rows]
+
+    def version_count_mapfiles(self):
+        """Return the number and total size of versions with a mapfile."""
+
+        q = ("select count(serial), sum(size) from versions "
+             "where mapfile is not null")
+        self.execute(q)
+        count, size = self.fetchone()
+        return count, size or 0
+
+    def version_list_mapfiles(self, after=0, limit=10000):
+        """Return the (serial, mapfile, size, is_snapshot) of up to limit
+           versions with a mapfile and a serial greater than after,
+           ordered by serial.
+        """
+
+        q = ("select serial, mapfile, size, is_snapshot from versions "
+             "where serial > ? and mapfile is not null "
+             "order by serial limit ?")
+        self.execute(q, (after, limit))
+        return self.fetchall()
+
+    def version_stats_prefix(self, prefix):
+        """Return the number and the greatest serial of the versions,
+           in any cluster, of the nodes whose path starts with prefix.
+        """
+
+        q = ("select count(serial), max(serial) from versions "
+             "where node in (select node "
+             "from nodes "
+             "where path like ? escape '\\')")
+        self.execute(q, (self.escape_like(prefix) + '%',))
+        return tuple(self.fetchone())
+
     def version_remove(self, serial, update_statistics_ancestors_depth=None):
         """Remove the serial specified."""
 
@@ -826,11 +1100,33 @@ class Node(DBWorker):
              "where serial = ?")
         self.execute(q, (dest, source))
 
+    def attribute_copy_bulk(self, copies):
+        """Copy all the attributes of versions to other versions.
+           Copies are given as (source serial, source node,
+           destination serial, destination node) tuples.
+        """
+
+        q = ("insert into attributes "
+             "(serial, domain, node, is_latest, key, value) "
+             "select ?, domain, ?, 1, key, value from attributes "
+             "where serial = ? and node = ?")
+        self.executemany(q, ((dest, dest_node, src, src_node) for
+                         src, src_node, dest, dest_node in copies))
+
     def attribute_unset_is_latest(self, node, exclude):
         q = ("update attributes set is_latest = 0 "
              "where node = ? and serial != ?")
         self.execute(q, (node, exclude))
 
+    def attribute_unset_is_latest_bulk(self, nodes, exclude):
+        if not nodes:
+            return
+        q = ("update attributes set is_latest = 0 "
+             "where node in (%s) and serial not in (%s)" %
+             (','.join('?' for node in nodes),
+              ','.join('?' for serial in exclude)))
+        self.execute(q, list(nodes) + list(exclude))
+
     def _construct_filters(self, domain, filterq):
         if not domain or not filterq:
             return None, None
@@ -991,6 +1287,29 @@ class Node(DBWorker):
                             except_cluster=0, pathq=[], domain=None,
                             filterq=[], sizeq=None, all_props=False):
         """Return a (list of (path, serial) tuples, list of common prefixes)
+           for the current versions of the paths with the given parent.
+           See latest_version_iter for the matching criteria.
+
+           Limit applies to the paths and prefixes together.
+        """
+
+        matches = []
+        prefixes = []
+        for props in self.latest_version_iter(
+                parent, prefix, delimiter, start, limit, before,
+                except_cluster, pathq, domain, filterq, sizeq, all_props):
+            if props[1] is None:
+                prefixes.append(props[0])
+            else:
+                matches.append(props)
+        return matches, prefixes
+
+    def latest_version_iter(self, parent, prefix='', delimiter=None,
+                            start='', limit=None, before=inf,
+                            except_cluster=0, pathq=[], domain=None,
+                            filterq=[], sizeq=None, all_props=False,
+                            page_size=LISTING_PAGE_SIZE):
+        """Generate (path, serial) tuples, ordered by path,
            for the current versions of the paths with the given parent,
            matching the following criteria.
 
@@ -1027,25 +1346,31 @@ class Node(DBWorker):
 
                 h. the size is in the range set by sizeq
 
-           The list of common prefixes includes the prefixes
-           matching up to the first delimiter after prefix,
-           and are reported only once, as "virtual directories".
+           Paths with the delimiter occuring after the prefix are rolled up
+           into common prefixes, matching up to the first delimiter after
+           prefix. These are generated once, as (prefix, None) tuples
+           ("virtual directories"), in their place in the path order.
            The delimiter is included in the prefixes.
 
            If arguments are None, then the corresponding matching rule
            will always match.
 
-           Limit applies to the first list of tuples returned.
+           Limit (if not None) applies to the tuples and prefixes together.
 
            If all_props is True, return all properties after path,
            not just serial.
-        """
 
-        execute = self.execute
+           Rows are fetched page_size at a time, each query continuing
+           from the last path seen or skipping past the last common prefix.
+           The rows of a page are fetched at once, so the database may be
+           used while iterating.
+        """
 
         if not start or start < prefix:
             start = strprevling(prefix)
         nextling = strnextling(prefix)
+        if limit:
+            page_size = min(page_size, limit)
 
         q = ("select distinct n.path, %s "
              "from versions v, nodes n "
@@ -1084,52 +1409,51 @@ class Node(DBWorker):
         else:
             q = q.replace("attributes a, ", "")
             q = q.replace("and a.serial = v.serial ", "")
-        q += " order by n.path"
+        q += " order by n.path limit ?"
+        args.append(page_size)
 
-        if not delimiter:
-            if limit:
-                q += " limit ?"
-                args.append(limit)
-            execute(q, args)
-            return self.fetchall(), ()
+        def fetch_page(start):
+            args[start_index] = start
+            self.execute(q, args)
+            return self.fetchall()
+
+        return self._rollup_versions(fetch_page, start, prefix, delimiter,
+                                     limit, page_size)
+
+    def _rollup_versions(self, fetch_page, start, prefix, delimiter, limit,
+                         page_size):
+        """Generate the rows returned by fetch_page, rolling up paths
+           into common prefixes for latest_version_iter.
+        """
 
         pfz = len(prefix)
-        dz = len(delimiter)
+        dz = len(delimiter) if delimiter else 0
         count = 0
-        fetchone = self.fetchone
-        prefixes = []
-        pappend = prefixes.append
-        matches = []
-        mappend = matches.append
-
-        execute(q, args)
+        pf = None
         while True:
-            props = fetchone()
-            if props is None:
-                break
-            path = props[0]
-            idx = path.find(delimiter, pfz)
-
-            if idx < 0:
-                mappend(props)
+            rows = fetch_page(start)
+            for props in rows:
+                path = props[0]
+                if pf is not None:
+                    if path.startswith(pf):
+                        continue
+                    pf = None
+                if delimiter:
+                    idx = path.find(delimiter, pfz)
+                    if idx >= 0 and idx + dz != len(path):
+                        pf = path[:idx + dz]
+                        props = (pf, None)
+                yield props
                 count += 1
-                if count >= limit:
-                    break
-                continue
-
-            if idx + dz == len(path):
-                mappend(props)
-                count += 1
-                continue  # Get one more, in case there is a path.
-            pf = path[:idx + dz]
-            pappend(pf)
-            if count >= limit:
-                break
-
-            args[start_index] = strnextling(pf)  # New start.
-            execute(q, args)
-
-        return matches, prefixes
+                if limit and count >= limit:
+                    return
+            if len(rows) < page_size:
+                return
+            # Skip the rest of the common prefix or continue after the page.
+            if pf is not None:
+                start = strprevling(strnextling(pf))
+            else:
+                start = rows[-1][0]
 
     def latest_uuid(self, uuid, cluster):
         """Return the latest version of the given uuid and cluster.
@@ -1154,9 +1478,12 @@ class Node(DBWorker):
         self.execute(q, args)
         return self.fetchone()
 
-    def domain_object_list(self, domain, paths, cluster=None):
+    def domain_object_list(self, domain, paths, cluster=None, account=None):
         """Return a list of (path, property list, attribute dictionary)
-           for the objects in the specific domain and cluster.
+           for the objects in the specific domain and cluster,
+           ordered by path.
+           If paths or account are given, return only the objects with
+           these paths or in the containers of the account.
         """
 
         props = ('n.path', 'v.serial', 'v.node', 'v.hash', 'v.size', 'v.type',
@@ -1170,18 +1497,27 @@ class Node(DBWorker):
              "a.domain = ? and "
              "a.node = n.node and "
              "a.is_latest = 1 ") % ','.join(cols)
+        conds = []
         if paths:
-            q += ("and path in (%s) " % ','.join('?' for _ in paths))
+            conds.append("n.path in (%s)" % ','.join('?' for _ in paths))
             map(args.append, paths)
+        if account is not None:
+            conds.append("n.parent in (select node from nodes "
+                         "where parent = (select node from nodes "
+                         "where path = ?))")
+            args.append(account)
+        if conds:
+            q += "and (%s) " % ' or '.join(conds)
         if cluster is not None:
-            q += "and v.cluster = ?"
+            q += "and v.cluster = ? "
             args += [cluster]
+        q += "order by n.path, v.serial"
 
         self.execute(q, args)
         rows = self.fetchall()
 
+        # Rows are ordered, so the attributes of each object are adjacent.
         group_by = itemgetter(slice(len(props)))
-        rows.sort(key=group_by)
         groups = groupby(rows, group_by)
         return [(k[0], k[1:], dict([i[len(props):] for i in data])) for
                 (k, data) in groups]
@@ -27,6 +27,8 @@ WRITE = 1
 class Permissions(XFeatures, Groups, Public, Node):
 
     def __init__(self, **params):
+        self.principals_cache = params.pop('principals_cache', None)
+        self._principals = {}
         XFeatures.__init__(self, **params)
         Groups.__init__(self, **params)
         Public.__init__(self, **params)
@@ -59,24 +61,6 @@ class Permissions(XFeatures, Groups, Public, Node):
         if w:
             self.feature_setmany(feature, WRITE, w)
 
-    def access_get_for_bulk(self, perms):
-        """Get permissions for paths."""
-
-        allowed = None
-        d = defaultdict(list)
-        for value, feature_id, key in perms:
-            d[key].append(value)
-        permissions = d
-        if READ in permissions:
-            allowed = 0
-            permissions['read'] = permissions[READ]
-            del(permissions[READ])
-        if WRITE in permissions:
-            allowed = 1
-            permissions['write'] = permissions[WRITE]
-            del(permissions[WRITE])
-        return (permissions, allowed)
-
     def access_get(self, path):
         """Get permissions for path."""
 
@@ -92,6 +76,29 @@ class Permissions(XFeatures, Groups, Public, Node):
             del(permissions[WRITE])
         return permissions
 
+    def access_get_bulk(self, paths):
+        """Get permissions for paths.
+           Return a dict mapping the paths with permissions to their
+           permissions, as returned by access_get.
+        """
+
+        if not paths:
+            return {}
+        q = ("select f.path, v.key, v.value "
+             "from xfeatures f, xfeaturevals v "
+             "where f.feature_id = v.feature_id and f.path in (%s)" %
+             ','.join('?' for _ in paths))
+        self.execute(q, paths)
+        return self._permissions_by_path(self.fetchall())
+
+    def _permissions_by_path(self, rows):
+        names = {READ: 'read', WRITE: 'write'}
+        d = {}
+        for path, key, value in rows:
+            permissions = d.setdefault(path, defaultdict(list))
+            permissions[names.get(key, key)].append(value)
+        return d
+
     def access_members(self, path):
         feature = self.xfeature_get(path)
         if not feature:
@@ -128,30 +135,75 @@ class Permissions(XFeatures, Groups, Public, Node):
         if not feature:
             return False
         members = self.feature_get(feature, access)
-        if member in members or '*' in members:
-            return True
-        for owner, group in self.group_parents(member):
-            if owner + ':' + group in members:
-                return True
-        return False
-
-    def access_check_bulk(self, paths, member):
-        rows = None
-        q = ("select x.path, xvals.value, xvals.feature_id, xvals.key "
-             "from xfeaturevals xvals join xfeatures x "
-             "on xvals.feature_id = x.feature_id "
-             "where x.path in (%s)") % ','.join('?' for _ in paths)
-        self.execute(q, paths)
+        return not self.access_principals(member).isdisjoint(members)
+
+    def access_check_many(self, paths, member):
+        """Return the access granted to member for each of paths.
+           The result maps the paths member has access to, to the set
+           of access keys (READ, WRITE) granted, in a single query.
+        """
+
+        if not paths:
+            return {}
+        principals = self.access_principals(member)
+        q = ("select distinct f.path, v.key "
+             "from xfeatures f, xfeaturevals v "
+             "where f.feature_id = v.feature_id and f.path in (%s) "
+             "and v.value in (%s)" % (','.join('?' for _ in paths),
+                                      ','.join('?' for _ in principals)))
+        self.execute(q, list(paths) + list(principals))
         rows = self.fetchall()
-        if rows:
-            access_check_paths = {}
-            for path, value, feature_id, key in rows:
-                try:
-                    access_check_paths[path].append((value, feature_id, key))
-                except KeyError:
-                    access_check_paths[path] = [(value, feature_id, key)]
-            return access_check_paths
-        return None
+        d = {}
+        for path, key in rows:
+            d.setdefault(path, set()).add(key)
+        return d
+
+    def access_principals(self, member):
+        """Return the principals member is matched against in permissions:
+           the member itself, '*' and every 'owner:group' containing member.
+
+           Principals are kept for the rest of the request and,
+           if a principals cache is configured, shared among requests.
+        """
+
+        principals = self._principals.get(member)
+        if principals is None and self.principals_cache is not None:
+            principals = self.principals_cache.get(member)
+        if principals is None:
+            principals = frozenset(
+                [member, '*'] + [owner + ':' + group for owner, group in
+                                 self.group_parents(member)])
+            if self.principals_cache is not None:
+                self.principals_cache.put(member, principals)
+        self._principals[member] = principals
+        return principals
+
+    def access_reset_principals(self, shared=False):
+        """Forget the principals computed in this request.
+           If shared is set, clear the principals cache too.
+        """
+
+        self._principals = {}
+        if shared and self.principals_cache is not None:
+            self.principals_cache.clear()
+
+    def _inherit_candidates(self, paths):
+        """Return the path components that may influence the access
+           for paths, without duplicates and in the order of paths.
+        """
+
+        valid = []
+        seen = set()
+        for path in paths:
+            parts = path.rstrip('/').split('/')
+            for i in range(1, len(parts)):
+                subp = '/'.join(parts[:i + 1])
+                candidates = [subp] if subp == path else [subp, subp + '/']
+                for c in candidates:
+                    if c not in seen:
+                        seen.add(c)
+                        valid.append(c)
+        return valid
 
     def access_inherit(self, path):
         """Return the paths influencing the access for path."""
@@ -162,30 +214,17 @@ class Permissions(XFeatures, Groups, Public, Node):
 #         # Compute valid.
 #         return [x[0] for x in r if x[0] in valid]
 
-        # Only keep path components.
-        parts = path.rstrip('/').split('/')
-        valid = []
-        for i in range(1, len(parts)):
-            subp = '/'.join(parts[:i + 1])
-            valid.append(subp)
-            if subp != path:
-                valid.append(subp + '/')
-        return [x for x in valid if self.xfeature_get(x)]
+        # Only keep path components, looked up with a single query.
+        valid = self._inherit_candidates([path])
+        found = set(x[1] for x in self.xfeature_get_bulk(valid) or [])
+        return [x for x in valid if x in found]
 
     def access_inherit_bulk(self, paths):
         """Return the paths influencing the access for paths."""
 
         # Only keep path components.
-        valid = []
-        for path in paths:
-            parts = path.rstrip('/').split('/')
-            for i in range(1, len(parts)):
-                subp = '/'.join(parts[:i + 1])
-                valid.append(subp)
-                if subp != path:
-                    valid.append(subp + '/')
-        valid = self.xfeature_get_bulk(valid)
-        return [x[1] for x in valid]
+        valid = self._inherit_candidates(paths)
+        return [x[1] for x in self.xfeature_get_bulk(valid) or []]
 
     def access_list_paths(self, member, prefix=None, include_owned=False,
                           include_containers=True):
@@ -199,13 +238,12 @@ class Permissions(XFeatures, Groups, Public, Node):
 
         """
 
+        principals = self.access_principals(member)
         q = ("select distinct path from xfeatures inner join "
-             "  (select distinct feature_id, key from xfeaturevals inner join "
-             "     (select owner || ':' || name as value from groups "
-             "      where member = ? union select ? union select '*') "
-             "   using (value)) "
-             "using (feature_id)")
-        p = (member, member)
+             "  (select distinct feature_id from xfeaturevals "
+             "   where value in (%s)) "
+             "using (feature_id)" % ','.join('?' for _ in principals))
+        p = tuple(principals)
         if prefix:
             q += " where "
             paths = self.access_inherit(prefix) or [prefix]
@@ -224,7 +262,8 @@ class Permissions(XFeatures, Groups, Public, Node):
                 q += ("or node in (%s)" % select_containers)
                 args += [node]
             self.execute(q, args)
-            l += [r[0] for r in self.fetchall() if r[0] not in l]
+            seen = set(l)
+            l += [r[0] for r in self.fetchall() if r[0] not in seen]
         return l
 
     def access_list_shared(self, prefix=''):
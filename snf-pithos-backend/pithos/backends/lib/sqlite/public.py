@@ -79,6 +79,13 @@ class Public(DBWorker):
             return row[0]
         return None
 
+    def public_get_bulk(self, paths):
+        placeholders = ','.join('?' for path in paths)
+        q = ("select path, url from public where "
+             "path in (%s) and active = 1" % placeholders)
+        self.execute(q, paths)
+        return self.fetchall()
+
     def public_list(self, prefix):
         q = ("select path, url from public where "
              "path like ? escape '\\' and active = 1")
@@ -25,6 +25,13 @@ class QuotaholderSerial(DBWorker):
 
         execute(""" create table if not exists qh_serials
                           ( serial bigint primary key) """)
+        execute(""" create table if not exists qh_leases
+                          ( lease   integer primary key,
+                            holder  text,
+                            source  text,
+                            amount  bigint not null default 0,
+                            expires real,
+                            owner   text ) """)
 
     def get_lower(self, serial):
         """Return entries lower than serial."""
@@ -60,3 +67,33 @@ class QuotaholderSerial(DBWorker):
         placeholders = ','.join('?' for _ in serials)
         q = "delete from qh_serials where serial in (%s)" % placeholders
         self.conn.execute(q, serials)
+
+    def insert_lease(self, holder, source, amount, expires, owner):
+        """Journal a quota lease and return its id."""
+
+        q = ("insert into qh_leases (holder, source, amount, expires, owner) "
+             "values (?, ?, ?, ?, ?)")
+        return self.execute(q, (holder, source, amount, expires,
+                                owner)).lastrowid
+
+    def spend_lease(self, lease, amount):
+        """Subtract amount from the quota left in a lease."""
+
+        q = "update qh_leases set amount = amount - ? where lease = ?"
+        self.execute(q, (amount, lease))
+
+    def delete_lease(self, lease):
+        """Delete a lease and return whether it was still journaled."""
+
+        q = "delete from qh_leases where lease = ?"
+        return self.execute(q, (lease,)).rowcount > 0
+
+    def list_leases(self):
+        """Return the journaled leases as
+           (lease, holder, source, amount, expires, owner).
+        """
+
+        q = ("select lease, holder, source, amount, expires, owner "
+             "from qh_leases")
+        self.execute(q)
+        return self.fetchall()
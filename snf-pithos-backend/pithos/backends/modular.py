@@ -19,20 +19,25 @@ import logging
 import hashlib
 import binascii
 
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, OrderedDict, deque
 from functools import wraps, partial
+from itertools import islice
+from multiprocessing.pool import ThreadPool, ApplyResult
+from threading import Lock
 from traceback import format_exc
 from time import time
 
 from pithos.workers import glue
-from archipelago.common import Segment, Xseg_ctx
-from objpool import ObjectPool
 
 try:
     from astakosclient import AstakosClient
+    from astakosclient.errors import QuotaLimit
 except ImportError:
     AstakosClient = None
 
+    class QuotaLimit(Exception):
+        pass
+
 from pithos.backends.exceptions import (
     NotAllowedError, QuotaError,
     AccountExists, ContainerExists, AccountNotEmpty,
@@ -66,21 +71,207 @@ class HashMap(list):
         h.update(v)
         return h.digest()
 
+    def _leaves(self):
+        h = list(self)
+        s = 2
+        while s < len(h):
+            s = s * 2
+        h += [('\x00' * len(h[0]))] * (s - len(h))
+        return h
+
     def hash(self):
         if len(self) == 0:
             return self._hash_raw('')
         if len(self) == 1:
             return self.__getitem__(0)
 
-        h = list(self)
-        s = 2
-        while s < len(h):
-            s = s * 2
-        h += [('\x00' * len(h[0]))] * (s - len(h))
-        while len(h) > 1:
-            h = [self._hash_raw(h[x] + h[x + 1]) for x in range(0, len(h), 2)]
+        # Reduce the tree in place, one level at a time.
+        h = self._leaves()
+        n = len(h)
+        while n > 1:
+            for x in xrange(0, n, 2):
+                h[x / 2] = self._hash_raw(h[x] + h[x + 1])
+            n = n / 2
         return h[0]
 
+    def tree(self, base=None):
+        """Return the levels of the Merkle tree, from the padded leaves
+        up to the root.
+
+        If 'base' holds the levels of another tree, nodes whose children
+        are the same in both trees are reused instead of rehashed, so
+        only the paths to changed leaves are recomputed.
+        """
+        if len(self) == 0:
+            return [[self._hash_raw('')]]
+        if len(self) == 1:
+            return [[self.__getitem__(0)]]
+
+        level = self._leaves()
+        levels = [level]
+        depth = 0
+        while len(level) > 1:
+            if base is not None and depth + 1 < len(base):
+                base_level, base_up = base[depth], base[depth + 1]
+            else:
+                base_level, base_up = (), ()
+            up = []
+            for x in xrange(0, len(level), 2):
+                if (x + 1 < len(base_level) and
+                        base_level[x] == level[x] and
+                        base_level[x + 1] == level[x + 1]):
+                    up.append(base_up[x / 2])
+                else:
+                    up.append(self._hash_raw(level[x] + level[x + 1]))
+            level = up
+            levels.append(level)
+            depth += 1
+        return levels
+
+
+class HashList(object):
+    """A list of block hashes stored as contiguous raw digests.
+
+    Behaves like a list of hexlified hashes, which are only produced
+    when an item is accessed. Slicing returns a new HashList.
+    """
+
+    __slots__ = ('digest_size', 'data')
+    __hash__ = None
+
+    def __init__(self, digest_size, data=''):
+        self.digest_size = digest_size
+        self.data = bytearray(data)
+
+    @classmethod
+    def from_hexlist(cls, digest_size, hexlist):
+        return cls(digest_size, binascii.unhexlify(''.join(hexlist)))
+
+    def __len__(self):
+        return len(self.data) / self.digest_size
+
+    def _offset(self, index):
+        n = len(self)
+        if index < 0:
+            index += n
+        if index < 0 or index >= n:
+            raise IndexError('HashList index out of range')
+        return index * self.digest_size
+
+    def __getitem__(self, index):
+        ds = self.digest_size
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return HashList(ds, self.data[start * ds:stop * ds])
+            return [self[i] for i in xrange(start, stop, step)]
+        o = self._offset(index)
+        return binascii.hexlify(self.data[o:o + ds])
+
+    def __setitem__(self, index, value):
+        o = self._offset(index)
+        self.data[o:o + self.digest_size] = binascii.unhexlify(value)
+
+    def __iter__(self):
+        data = self.data
+        ds = self.digest_size
+        hexlify = binascii.hexlify
+        for o in xrange(0, len(data), ds):
+            yield hexlify(data[o:o + ds])
+
+    def __eq__(self, other):
+        if isinstance(other, HashList):
+            return self.data == other.data
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, value):
+        self.data.extend(binascii.unhexlify(value))
+
+    def extend(self, values):
+        if isinstance(values, HashList):
+            self.data.extend(values.data)
+        else:
+            self.data.extend(binascii.unhexlify(''.join(values)))
+
+    def digest(self, index):
+        o = self._offset(index)
+        return str(self.data[o:o + self.digest_size])
+
+    def digests(self):
+        data = self.data
+        ds = self.digest_size
+        return [str(data[o:o + ds]) for o in xrange(0, len(data), ds)]
+
+    def tostring(self):
+        return str(self.data)
+
+
+class HashmapSequence(object):
+    """The hashmaps of a list of versions, read when first accessed.
+
+    Accessing a hashmap starts reading the next 'window' ones on 'pool',
+    if given, so that they are ready by the time they are needed. Read
+    hashmaps are kept, but failed reads are not, so that they are retried
+    on the next access.
+    """
+
+    def __init__(self, read, versions, pool=None, window=0):
+        self.read = read
+        self.versions = versions
+        self.pool = pool
+        self.window = window
+        self._hashmaps = [None] * len(versions)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._hashmaps)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('HashmapSequence index out of range')
+        hashmaps = self._hashmaps
+        with self._lock:
+            if self.pool is not None:
+                end = min(index + self.window + 1, len(hashmaps))
+                for i in xrange(index, end):
+                    if hashmaps[i] is None:
+                        hashmaps[i] = self.pool.apply_async(
+                            self.read, (self.versions[i],))
+            hashmap = hashmaps[index]
+        try:
+            if hashmap is None:
+                hashmap = self.read(self.versions[index])
+            elif isinstance(hashmap, ApplyResult):
+                hashmap = hashmap.get()
+        except:
+            with self._lock:
+                if hashmaps[index] is hashmap:
+                    hashmaps[index] = None
+            raise
+        hashmaps[index] = hashmap
+        return hashmap
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
 # Default modules and settings.
 DEFAULT_DB_MODULE = 'pithos.backends.lib.sqlalchemy'
 DEFAULT_DB_CONNECTION = 'sqlite:///backend.db'
@@ -88,6 +279,11 @@ DEFAULT_BLOCK_MODULE = 'pithos.backends.lib.hashfiler'
 DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024  # 4MB
 DEFAULT_HASH_ALGORITHM = 'sha256'
 DEFAULT_BLOCK_PARAMS = {'mappool': None, 'blockpool': None}
+DEFAULT_BLOCK_WINDOW = 16
+# Paths looked up per query by bulk lookups (SQLite allows 999 parameters).
+DEFAULT_PATHS_PER_QUERY = 500
+# Objects handled per batch when copying, moving or deleting a directory.
+DEFAULT_BULK_BATCH_SIZE = 250
 
 # Default setting for new accounts.
 DEFAULT_ACCOUNT_QUOTA = 0  # No quota.
@@ -122,6 +318,20 @@ DEFAULT_ACC_MAX_GROUP_MEMBERS = 32
 
 logger = logging.getLogger(__name__)
 
+# Worker threads shared by all the backends of a process, for hashing and
+# storing uploaded blocks and reading the maps of manifest segments.
+# Created on first use, after any fork.
+_upload_pool = None
+_upload_pool_lock = Lock()
+
+
+def _get_upload_pool(size):
+    global _upload_pool
+    with _upload_pool_lock:
+        if _upload_pool is None:
+            _upload_pool = ThreadPool(size)
+        return _upload_pool
+
 _propnames = ('serial', 'node', 'hash', 'size', 'type', 'source', 'mtime',
               'muser', 'uuid', 'checksum', 'cluster', 'available',
               'map_check_timestamp', 'mapfile', 'is_snapshot')
@@ -248,7 +458,18 @@ class ModularBackend(object):
                  mapfile_prefix=DEFAULT_MAPFILE_PREFIX,
                  resource_max_metadata=DEFAULT_RESOURCE_MAX_METADATA,
                  acc_max_groups=DEFAULT_ACC_MAX_GROUPS,
-                 acc_max_group_members=DEFAULT_ACC_MAX_GROUP_MEMBERS):
+                 acc_max_group_members=DEFAULT_ACC_MAX_GROUP_MEMBERS,
+                 block_cache=None,
+                 map_cache=None,
+                 merkle_cache=None,
+                 upload_workers=0,
+                 deferred_statistics=False,
+                 principals_cache=None,
+                 db_pool_size=0,
+                 quota_leases=None,
+                 commission_resolver=None,
+                 meta_cache=None,
+                 manifest_cache=None):
 
         not_nullable = ('block_size', 'hash_algorithm', 'block_params',
                         'public_url_security', 'public_url_alphabet',
@@ -274,6 +495,7 @@ class ModularBackend(object):
         self.public_url_security = public_url_security
         self.public_url_alphabet = public_url_alphabet
         self.hash_algorithm = hash_algorithm
+        self.digest_size = hashlib.new(hash_algorithm).digest_size
         self.block_size = block_size
         self.free_versioning = free_versioning
         self.map_check_interval = map_check_interval
@@ -287,7 +509,8 @@ class ModularBackend(object):
             return sys.modules[m]
 
         self.db_module = load_module(db_module)
-        self.wrapper = self.db_module.DBWrapper(db_connection)
+        self.wrapper = self.db_module.DBWrapper(db_connection,
+                                                pool_size=db_pool_size)
         params = {'wrapper': self.wrapper}
         self.config = self.db_module.Config(**params)
         self.commission_serials = self.db_module.QuotaholderSerial(**params)
@@ -295,8 +518,12 @@ class ModularBackend(object):
             setattr(self, x, getattr(self.db_module, x))
         params.update({'mapfile_prefix': self.mapfile_prefix,
                        'props': _props(_propnames)})
-        self.permissions = self.db_module.Permissions(**params)
-        self.node = self.db_module.Node(**params)
+        # Group membership is cached per request and, if a principals
+        # cache is given, shared among the backends of a worker.
+        self.permissions = self.db_module.Permissions(
+            principals_cache=principals_cache, **params)
+        self.node = self.db_module.Node(
+            deferred_statistics=deferred_statistics, **params)
         for x in ['ROOTNODE', 'MATCH_PREFIX', 'MATCH_EXACT']:
             setattr(self, x, getattr(self.db_module, x))
         for p in _propnames:
@@ -304,18 +531,25 @@ class ModularBackend(object):
 
         self.ALLOWED = ['read', 'write']
 
-        glue.WorkerGlue.setupXsegPool(ObjectPool, Segment, Xseg_ctx,
-                                      cfile=archipelago_conf_file,
-                                      pool_size=xseg_pool_size)
-
-        self.ioctx_pool = glue.WorkerGlue.ioctx_pool
+        # The block module sets up the xseg pool if it needs one.
         self.block_module = load_module(block_module)
         self.block_params = block_params
         params = {'block_size': self.block_size,
                   'hash_algorithm': self.hash_algorithm,
-                  'archipelago_cfile': archipelago_conf_file}
+                  'archipelago_cfile': archipelago_conf_file,
+                  'xseg_pool_size': xseg_pool_size}
         params.update(self.block_params)
         self.store = self.block_module.Store(**params)
+        self.ioctx_pool = glue.WorkerGlue.ioctx_pool
+        # Blocks are immutable, so a cache keyed by hash can be shared
+        # among all the backends of a worker.
+        self.block_cache = block_cache
+        # Mapfiles are never rewritten, so the same holds for object maps.
+        self.map_cache = map_cache
+        # Merkle trees are cached by their root, to rehash only the changed
+        # paths when a new version of an object is written.
+        self.merkle_cache = merkle_cache
+        self.upload_workers = upload_workers
 
         self.astakos_auth_url = astakos_auth_url
         self.service_token = service_token
@@ -332,6 +566,21 @@ class ModularBackend(object):
                 pool_size=astakosclient_poolsize)
 
         self.serials = []
+        # Quota reserved from the quotaholder per worker, spent by size
+        # changes without a commission of their own.
+        self.quota_leases = quota_leases
+        self.lease_spent = []
+        self.lease_released = []
+        self.lease_granted = []
+        # Resolves commissions in the background, batched across requests.
+        self.commission_resolver = commission_resolver
+        # Prepared object metadata of the API, checked against the
+        # version tag of the object and dropped on permission changes.
+        self.meta_cache = meta_cache
+        self.meta_changed = False
+        # Sizes and hashmaps of the segments of manifest objects,
+        # checked against the versions under the manifest's prefix.
+        self.manifest_cache = manifest_cache
 
         self._move_object = partial(self._copy_object, is_move=True)
 
@@ -350,11 +599,31 @@ class ModularBackend(object):
         self.lock_container_path = lock_container_path
         self.wrapper.execute()
         self.serials = []
+        self.lease_spent = []
+        self.lease_released = []
+        self.lease_granted = []
+        self.meta_changed = False
         self._reset_allowed_paths()
+        self.permissions.access_reset_principals()
         self.in_transaction = True
 
     def post_exec(self, success_status=True):
-        if success_status:
+        resolver = self.commission_resolver
+        if success_status and resolver is not None:
+            # forget the serials accepted in the background
+            accepted = resolver.pop_accepted()
+            if accepted:
+                self.commission_serials.delete_many(accepted)
+            if self.serials:
+                self.commission_serials.insert_many(
+                    self.serials)
+            self.wrapper.commit()
+            if self.serials:
+                resolver.submit(self.astakosclient,
+                                accept_serials=self.serials)
+            self._grant_quota_leases()
+            self._clear_meta_cache()
+        elif success_status:
             # register serials
             if self.serials:
                 self.commission_serials.insert_many(
@@ -374,15 +643,52 @@ class ModularBackend(object):
                     r['accepted'])
 
             self.wrapper.commit()
+            self._grant_quota_leases()
+            self._clear_meta_cache()
         else:
-            if self.serials:
+            if self.serials and resolver is not None:
+                resolver.submit(self.astakosclient,
+                                reject_serials=self.serials)
+            elif self.serials:
                 r = self.astakosclient.resolve_commissions(
                     accept_serials=[],
                     reject_serials=self.serials)
                 self.commission_serials.delete_many(
                     r['rejected'])
             self.wrapper.rollback()
+            # the journal is rolled back along with the leases
+            for key, lease in self.lease_released:
+                self.quota_leases.restore(key, lease)
+            for key, lease_id, amount in self.lease_spent:
+                self.quota_leases.refund(key, lease_id, amount)
         self.in_transaction = False
+        if (success_status and self.quota_leases is not None and
+                self.quota_leases.sweep_due()):
+            self._sweep_quota_leases()
+
+    def _grant_quota_leases(self):
+        if not self.lease_granted:
+            return
+        self.quota_leases.at_exit(partial(self._sweep_quota_leases,
+                                          exiting=True))
+        for key, lease in self.lease_granted:
+            self.quota_leases.grant(key, lease)
+
+    def _sweep_quota_leases(self, exiting=False):
+        """Give back the quota left in the stale leases of the journal,
+           or in all the leases of this worker if it exits.
+        """
+
+        try:
+            self._release_quota_leases(exiting)
+        except Exception:
+            logger.exception("Failed to give back quota leases")
+
+    def _clear_meta_cache(self):
+        if self.meta_changed and self.meta_cache is not None:
+            # Permissions may be inherited, so drop everything.
+            self.meta_cache.clear()
+        self.meta_changed = False
 
     def close(self):
         """Close the backend connection."""
@@ -538,6 +844,8 @@ class ModularBackend(object):
 
         self.permissions.group_destroy(account)
         self.permissions.group_addmany(account, groups)
+        self.permissions.access_reset_principals(shared=True)
+        self.meta_changed = True
 
     @debug_method
     @backend_method
@@ -622,6 +930,8 @@ class ModularBackend(object):
                                      update_statistics_ancestors_depth=-1):
             raise AccountNotEmpty("Account is not empty")
         self.permissions.group_destroy(account)
+        self.permissions.access_reset_principals(shared=True)
+        self.meta_changed = True
 
         # remove all the cached allowed paths
         # removing the specific path could be more expensive
@@ -900,17 +1210,8 @@ class ModularBackend(object):
                     user, account, -size, project, name=path)
         else:
             # remove only contents
-            src_names = self._list_objects_no_limit(
-                user, account, container, prefix='', delimiter=None,
-                virtual=False, domain=None, keys=[], shared=False, until=None,
-                size_range=None, all_props=True, public=False,
-                listing_limit=listing_limit)
-            freed_space = 0
-            for t in src_names:
-                del_size = self._delete_object(user, account, container, t[0],
-                                               delimiter=None,
-                                               report_size_change=False)
-                freed_space += del_size
+            freed_space = self._delete_objects_bulk(
+                user, account, container, listing_limit=listing_limit)
 
             self._report_size_change(
                 user, account, -freed_space, project, name='/'.join((account,
@@ -924,12 +1225,28 @@ class ModularBackend(object):
     def _list_objects(self, user, account, container, prefix, delimiter,
                       marker, limit, virtual, domain, keys, shared, until,
                       size_range, all_props, public):
+        if not limit or limit > 10000:
+            limit = 10000
+        return list(islice(self._iter_objects(
+            user, account, container, prefix, delimiter, marker, limit,
+            virtual, domain, keys, shared, until, size_range, all_props,
+            public), limit))
+
+    def _iter_objects(self, user, account, container, prefix, delimiter,
+                      marker, limit, virtual, domain, keys, shared, until,
+                      size_range, all_props, public, page_size=None):
+        """Generate the object listing of a container, ordered by name.
+
+           Limit (if not None) is a hint for the listing of the container
+           nodes; the caller applies it to the result.
+        """
+
         if user != account and until:
             raise NotAllowedError("Browsing other account's "
                                   "history is not allowed")
 
-        objects = set()
         if shared and public:
+            objects = set()
             # get shared first
             shared_paths = self._list_object_permissions(
                 user, account, container, prefix, shared=True, public=False)
@@ -946,23 +1263,20 @@ class ModularBackend(object):
             objects = list(objects)
 
             objects.sort(key=lambda x: x[0])
+            return iter(objects)
         elif public:
-            objects = self._list_public_object_properties(
-                user, account, container, prefix, all_props)
-        else:
-            allowed = self._list_object_permissions(
-                user, account, container, prefix, shared, public=False)
-            if shared and not allowed:
-                return []
-            path, node = self._lookup_container(account, container)
-            allowed = self._get_formatted_paths(allowed)
-            objects = self._list_object_properties(
-                node, path, prefix, delimiter, marker, limit, virtual, domain,
-                keys, until, size_range, allowed, all_props)
+            return iter(self._list_public_object_properties(
+                user, account, container, prefix, all_props))
 
-        # apply limits
-        start, limit = self._list_limits(objects, marker, limit)
-        return objects[start:start + limit]
+        allowed = self._list_object_permissions(
+            user, account, container, prefix, shared, public=False)
+        if shared and not allowed:
+            return iter([])
+        path, node = self._lookup_container(account, container)
+        allowed = self._get_formatted_paths(allowed)
+        return self._iter_object_properties(
+            node, path, prefix, delimiter, marker, limit, virtual, domain,
+            keys, until, size_range, allowed, all_props, page_size)
 
     def _list_public_object_properties(self, user, account, container, prefix,
                                        all_props):
@@ -981,18 +1295,10 @@ class ModularBackend(object):
                                delimiter, virtual, domain, keys, shared, until,
                                size_range, all_props, public,
                                listing_limit=10000):
-        objects = []
-        while True:
-            marker = objects[-1][0] if objects else None
-            limit = listing_limit
-            l = self._list_objects(
-                user, account, container, prefix, delimiter, marker, limit,
-                virtual, domain, keys, shared, until, size_range, all_props,
-                public)
-            objects.extend(l)
-            if not l or len(l) < limit:
-                break
-        return objects
+        return list(self._iter_objects(
+            user, account, container, prefix, delimiter, None, None,
+            virtual, domain, keys, shared, until, size_range, all_props,
+            public, page_size=listing_limit))
 
     def _list_object_permissions(self, user, account, container, prefix,
                                  shared, public):
@@ -1074,25 +1380,68 @@ class ModularBackend(object):
         props = self._list_objects(
             user, account, container, prefix, delimiter, marker, limit,
             virtual, domain, keys, shared, until, size_range, True, public)
-        objects = []
-        for p in props:
-            if len(p) == 2:
-                objects.append({'subdir': p[0]})
-            else:
-                objects.append({
-                    'name': p[0],
-                    'bytes': p[self.SIZE + 1],
-                    'type': p[self.TYPE + 1],
-                    'hash': p[self.HASH + 1],
-                    'version': p[self.SERIAL + 1],
-                    'version_timestamp': p[self.MTIME + 1],
-                    'modified': p[self.MTIME + 1] if until is None else None,
-                    'modified_by': p[self.MUSER + 1],
-                    'uuid': p[self.UUID + 1],
-                    'checksum': p[self.CHECKSUM + 1],
-                    'available': p[self.AVAILABLE + 1],
-                    'map_check_timestamp': p[self.MAP_CHECK_TIMESTAMP + 1]})
-        return objects
+        return [self._object_meta_dict(p, until) for p in props]
+
+    def _object_meta_dict(self, p, until):
+        if len(p) == 2:
+            return {'subdir': p[0]}
+        return {
+            'name': p[0],
+            'bytes': p[self.SIZE + 1],
+            'type': p[self.TYPE + 1],
+            'hash': p[self.HASH + 1],
+            'version': p[self.SERIAL + 1],
+            'version_timestamp': p[self.MTIME + 1],
+            'modified': p[self.MTIME + 1] if until is None else None,
+            'modified_by': p[self.MUSER + 1],
+            'uuid': p[self.UUID + 1],
+            'checksum': p[self.CHECKSUM + 1],
+            'available': p[self.AVAILABLE + 1],
+            'map_check_timestamp': p[self.MAP_CHECK_TIMESTAMP + 1]}
+
+    @debug_method
+    def iter_objects(self, user, account, container, prefix='',
+                     delimiter=None, marker=None, limit=10000, virtual=True,
+                     domain=None, keys=None, shared=False, until=None,
+                     size_range=None, public=False):
+        """Generate the list_objects listing, fetching it page by page.
+
+        Same parameters with list_objects, but limit may be None to list
+        all objects (it is otherwise capped to 10000 as well). The generator
+        must be consumed inside the transaction of the caller (between
+        pre_exec and post_exec).
+
+        Raises:
+            NotAllowedError: Operation not permitted
+            ItemNotExists: Container does not exist
+        """
+
+        keys = keys or []
+        if limit is not None and (not limit or limit > 10000):
+            limit = 10000
+        return islice(self._iter_objects(
+            user, account, container, prefix, delimiter, marker, limit,
+            virtual, domain, keys, shared, until, size_range, False, public),
+            limit)
+
+    @debug_method
+    def iter_object_meta(self, user, account, container, prefix='',
+                         delimiter=None, marker=None, limit=10000,
+                         virtual=True, domain=None, keys=None, shared=False,
+                         until=None, size_range=None, public=False):
+        """Generate the list_object_meta listing, fetching it page by page.
+
+        Same parameters and requirements with iter_objects.
+        """
+
+        keys = keys or []
+        if limit is not None and (not limit or limit > 10000):
+            limit = 10000
+        props = islice(self._iter_objects(
+            user, account, container, prefix, delimiter, marker, limit,
+            virtual, domain, keys, shared, until, size_range, True, public),
+            limit)
+        return (self._object_meta_dict(p, until) for p in props)
 
     @debug_method
     @backend_method
@@ -1118,6 +1467,55 @@ class ModularBackend(object):
             public[path] = p
         return public
 
+    @debug_method
+    @backend_method
+    def list_object_public_bulk(self, user, account, container, names):
+        """Return a mapping of object paths to public ids for the names."""
+
+        if not names:
+            return {}
+        cpath = '/'.join((account, container, ''))
+        return dict(self.permissions.public_get_bulk(
+            [cpath + name for name in names]))
+
+    @debug_method
+    @backend_method
+    def list_object_permissions_bulk(self, user, account, container, names):
+        """Return the names which enforce permissions visible to user,
+           as list_object_permissions would for their paths.
+        """
+
+        if not names:
+            return []
+        cpath = '/'.join((account, container, ''))
+        paths = [cpath + name for name in names]
+        if user != account:
+            enforced = self.permissions.access_check_many(paths, user)
+        else:
+            enforced = set(x[1] for x in
+                           self.permissions.xfeature_get_bulk(paths) or [])
+        return [name for name, path in zip(names, paths) if path in enforced]
+
+    @debug_method
+    @backend_method
+    def get_object_version_tag(self, user, account, container, name):
+        """Return a tag that changes with the latest version of the object,
+           or None if its metadata are not final yet.
+
+        Raises:
+            NotAllowedError: Operation not permitted
+            ItemNotExists: Container/object does not exist
+        """
+
+        self._can_read_object(user, account, container, name)
+        path, node = self._lookup_object(account, container, name)
+        props = self._get_version(node)
+        if props[self.AVAILABLE] == MAP_UNAVAILABLE:
+            return None
+        # The checksum is updated in place.
+        return (props[self.SERIAL], props[self.CHECKSUM],
+                props[self.AVAILABLE])
+
     @debug_method
     @backend_method
     def get_object_meta(self, user, account, container, name, domain=None,
@@ -1230,27 +1628,29 @@ class ModularBackend(object):
         from which the object gets its permissions from,
         along with a dictionary containing the permissions."""
 
-        permissions_path = self._get_permissions_path_bulk(account, container,
-                                                           names)
-        access_objects = self.permissions.access_check_bulk(permissions_path,
-                                                            user)
-        # group_parents = access_objects['group_parents']
+        permissions_path = self._get_permissions_path_bulk(
+            account, container, names) or []
+        if user != account:
+            access = self.permissions.access_check_many(permissions_path,
+                                                        user)
+        permissions = self.permissions.access_get_bulk(permissions_path)
         nobject_permissions = {}
         cpath = '/'.join((account, container, ''))
         cpath_idx = len(cpath)
         for path in permissions_path:
-            allowed = 1
+            allowed = 'write'
             name = path[cpath_idx:]
             if user != account:
-                try:
-                    allowed = access_objects[path]
-                except KeyError:
+                keys = access.get(path, ())
+                if self.WRITE in keys:
+                    allowed = 'write'
+                elif self.READ in keys:
+                    allowed = 'read'
+                else:
                     raise NotAllowedError("User does not have access "
                                           "to path: %s" % path)
-            access_dict, allowed = \
-                self.permissions.access_get_for_bulk(access_objects[path])
-            nobject_permissions[name] = (self.ALLOWED[allowed], path,
-                                         access_dict)
+            nobject_permissions[name] = (allowed, path,
+                                         permissions.get(path, {}))
         self._lookup_objects(permissions_path)
         return nobject_permissions
 
@@ -1311,6 +1711,7 @@ class ModularBackend(object):
             self.permissions.access_set(path, permissions)
         except:
             raise ValueError("Invalid users/groups in permissions")
+        self.meta_changed = True
 
         # remove all the cached allowed paths
         # filtering out only those affected could be more expensive
@@ -1353,6 +1754,7 @@ class ModularBackend(object):
         else:
             self.permissions.public_set(
                 path, self.public_url_security, self.public_url_alphabet)
+        self.meta_changed = True
 
     def _update_available(self, props):
         """Checks if the object map exists and updates the database"""
@@ -1402,8 +1804,21 @@ class ModularBackend(object):
             size = props[self.SIZE]
             if size == 0:
                 return [self.empty_string_hash]
+            return self._get_map(props[self.MAPFILE], size)
         return self.store.map_get(props[self.MAPFILE], props[self.SIZE])
 
+    def _get_map(self, mapfile, size):
+        cache = self.map_cache
+        if cache is not None:
+            packed = cache.get(mapfile)
+            if packed is not None:
+                return HashList(self.digest_size, packed)
+        hashmap = HashList.from_hexlist(self.digest_size,
+                                        self.store.map_get(mapfile, size))
+        if cache is not None:
+            cache.put(mapfile, hashmap.tostring())
+        return hashmap
+
     @debug_method
     @backend_method
     def get_object_hashmap(self, user, account, container, name, version=None):
@@ -1420,6 +1835,59 @@ class ModularBackend(object):
         return props[self.IS_SNAPSHOT], props[self.SIZE], \
             self._get_object_hashmap(props, update_available=True)
 
+    @debug_method
+    @backend_method
+    def get_manifest_hashmaps(self, user, account, container, prefix):
+        """Return the sizes and the hashmaps of the objects under prefix,
+           which make up the data of a manifest object, in name order.
+
+        The versions are listed at once and the hashmap of the first one
+        is read, so that a missing or broken segment is reported before
+        any data are sent. The rest are read when first accessed, ahead
+        on the upload workers if any. The listed versions are cached for
+        the account owner while the versions under the prefix are
+        unchanged; the hashmaps are read through this backend on each call.
+
+        Raises:
+            NotAllowedError: Operation not permitted
+            ItemNotExists: Container does not exist
+            IllegalOperationError: A snapshot's hashmap is unavailable
+            BrokenSnapshot: A snapshot is broken
+        """
+
+        # Listings of other users depend on their permissions.
+        cache = self.manifest_cache if user == account else None
+        versions = None
+        if cache is not None:
+            path = '/'.join((account, container, prefix))
+            tag = self.node.version_stats_prefix(path)
+            cached = cache.get(path)
+            if cached is not None and cached[0] == tag:
+                versions = cached[1]
+
+        if versions is None:
+            versions = [x[1:] for x in self._list_objects_no_limit(
+                user, account, container, prefix, None, False, None, [],
+                False, None, None, True, False,
+                listing_limit=DEFAULT_BULK_BATCH_SIZE)]
+            for props in versions:
+                if (props[self.IS_SNAPSHOT] and
+                        props[self.AVAILABLE] != MAP_AVAILABLE):
+                    self._update_available(props)
+        sizes = [props[self.SIZE] for props in versions]
+        if self.upload_workers:
+            pool = _get_upload_pool(self.upload_workers)
+        else:
+            pool = None
+        hashmaps = HashmapSequence(
+            partial(self._get_object_hashmap, update_available=False),
+            versions, pool, 2 * self.upload_workers)
+        if hashmaps:
+            hashmaps[0]  # Raises if the first segment cannot be read.
+        if cache is not None:
+            cache.put(path, (tag, versions))
+        return sizes, hashmaps
+
     def _copy_metadata(self, src_version, dest_version, dest_node,
                        exclude_domain, src_node=None):
         domains = self.node.attribute_get_domains(src_version,
@@ -1476,38 +1944,42 @@ class ModularBackend(object):
                                           update_statistics_ancestors_depth=1)
         size_delta = size - del_size
         if size_delta > 0:
-            # Check account quota.
-            if not self.using_external_quotaholder:
-                account_quota = long(self._get_policy(
-                    account_node, is_account_policy=True)[QUOTA_POLICY])
-                account_usage = self._get_statistics(account_node,
-                                                     compute=True)[1]
-                if (account_quota > 0 and account_usage > account_quota):
-                    raise QuotaError(
-                        'Account quota exceeded: limit: %s, usage: %s' % (
-                            account_quota, account_usage))
-
-            # Check container quota.
-            container_quota = long(self._get_policy(
-                container_node, is_account_policy=False)[QUOTA_POLICY])
-            container_usage = self._get_statistics(container_node)[1]
-            if (container_quota > 0 and container_usage > container_quota):
-                # This must be executed in a transaction, so the version is
-                # never created if it fails.
-                raise QuotaError(
-                    'Container quota exceeded: limit: %s, usage: %s' % (
-                        container_quota, container_usage
-                    )
-                )
+            self._check_quota(account_node, container_node)
 
         if report_size_change:
             self._report_size_change(
                 user, account, size_delta, project, name=path)
         if permissions is not None:
             self.permissions.access_set(path, permissions)
+            self.meta_changed = True
 
         return dest_version_id, size_delta, mapfile
 
+    def _check_quota(self, account_node, container_node):
+        # Check account quota.
+        if not self.using_external_quotaholder:
+            account_quota = long(self._get_policy(
+                account_node, is_account_policy=True)[QUOTA_POLICY])
+            account_usage = self._get_statistics(account_node,
+                                                 compute=True)[1]
+            if (account_quota > 0 and account_usage > account_quota):
+                raise QuotaError(
+                    'Account quota exceeded: limit: %s, usage: %s' % (
+                        account_quota, account_usage))
+
+        # Check container quota.
+        container_quota = long(self._get_policy(
+            container_node, is_account_policy=False)[QUOTA_POLICY])
+        container_usage = self._get_statistics(container_node)[1]
+        if (container_quota > 0 and container_usage > container_quota):
+            # This must be executed in a transaction, so the version is
+            # never created if it fails.
+            raise QuotaError(
+                'Container quota exceeded: limit: %s, usage: %s' % (
+                    container_quota, container_usage
+                )
+            )
+
     @debug_method
     @backend_method
     def register_object_map(self, user, account, container, name, size, type,
@@ -1592,6 +2064,7 @@ class ModularBackend(object):
                 "The object's size does not match "
                 "with the object's hashmap length")
 
+        base_hash = None
         try:
             path, node = self._lookup_object(account, container, name,
                                              lock_container=True)
@@ -1606,18 +2079,22 @@ class ModularBackend(object):
                 if props[self.IS_SNAPSHOT]:
                     raise IllegalOperationError(
                         'Cannot update Archipelago volume hashmap.')
+                base_hash = props[self.HASH]
         meta = meta or {}
         if size == 0:  # No such thing as an empty hashmap.
             hashmap = [self.put_block('')]
         map_ = HashMap(self.block_size, self.hash_algorithm)
-        map_.extend([self._unhexlify_hash(x) for x in hashmap])
+        if isinstance(hashmap, HashList):
+            map_.extend(hashmap.digests())
+        else:
+            map_.extend([self._unhexlify_hash(x) for x in hashmap])
         missing = self.store.block_search(map_)
         if missing:
             ie = IndexError()
             ie.data = [binascii.hexlify(x) for x in missing]
             raise ie
 
-        hash_ = map_.hash()
+        hash_ = self._merkle_hash(map_, base_hash)
         hexlified = binascii.hexlify(hash_)
         # _update_object_hash() locks destination path
         dest_version_id, _, mapfile = self._update_object_hash(
@@ -1755,13 +2232,28 @@ class ModularBackend(object):
             src_names.sort(key=lambda x: x[2])  # order by nodes
             paths = [elem[0] for elem in src_names]
             nodes = [elem[2] for elem in src_names]
+            dest_prefix = (dest_name + delimiter if not
+                           dest_name.endswith(delimiter) else dest_name)
+            # The owner's objects are copied in batches, unless the source
+            # and destination overlap.
+            overlap = (not cross_account and not cross_container and
+                       (prefix.startswith(dest_prefix) or
+                        dest_prefix.startswith(prefix)))
+            if user == src_account and user == dest_account and not overlap:
+                serials, size_delta, del_size = self._copy_objects_bulk(
+                    user, src_account, src_container, prefix, dest_account,
+                    dest_container, dest_prefix, paths, nodes, is_move,
+                    report_size_change=(not bulk_report_size_change))
+                dest_versions.extend(serials)
+                occupied_space += size_delta
+                freed_space += del_size
+                paths = nodes = []
+
             # TODO: Will do another fetch of the properties
             # in duplicate version...
             props = self._get_versions(nodes)
 
             for prop, vsrc_name, node in zip(props, paths, nodes):
-                dest_prefix = (dest_name + delimiter if not
-                               dest_name.endswith(delimiter) else dest_name)
                 _version_id = prop[self.SERIAL]
                 _type = prop[self.TYPE]
                 _dest_name = vsrc_name.replace(prefix, dest_prefix, 1)
@@ -1784,6 +2276,197 @@ class ModularBackend(object):
                 name=dest_obj_path)
         return dest_versions, occupied_space, freed_space
 
+    def _copy_objects_bulk(self, user, src_account, src_container, prefix,
+                           dest_account, dest_container, dest_prefix,
+                           names, nodes, is_move=False,
+                           report_size_change=True):
+        """Copy or move the objects with the given names and nodes, from
+           under prefix to under dest_prefix, in batches of
+           DEFAULT_BULK_BATCH_SIZE objects. Return the new versions and the
+           space occupied and freed, as _copy_object does.
+        """
+
+        dest_versions = []
+        occupied_space = 0
+        freed_space = 0
+        src_container_path, src_container_node = self._lookup_container(
+            src_account, src_container)
+        dest_container_path, dest_container_node = self._lookup_container(
+            dest_account, dest_container)
+        dest_account_node = self._lookup_account(dest_account, True)[1]
+        src_project = self._get_project(src_container_node)
+        dest_project = self._get_project(dest_container_node)
+
+        total = len(nodes)
+        for i in xrange(0, total, DEFAULT_BULK_BATCH_SIZE):
+            batch = zip(names[i:i + DEFAULT_BULK_BATCH_SIZE],
+                        nodes[i:i + DEFAULT_BULK_BATCH_SIZE])
+            props = dict((p[self.NODE], p) for p in
+                         self._get_versions([node for _, node in batch]))
+            batch = [(name, node) for name, node in batch if node in props]
+            if not is_move:
+                for name, node in batch:
+                    if props[node][self.AVAILABLE] != MAP_AVAILABLE:
+                        raise NotAllowedError(
+                            "Copying objects not available in the storage "
+                            "backend is forbidden.")
+
+            # Create the destination versions, keeping the previous ones
+            # in history.
+            dest_paths = ['/'.join((dest_container_path,
+                                    name.replace(prefix, dest_prefix, 1)))
+                          for name, node in batch]
+            dest_nodes = self.node.node_create_bulk(dest_container_node,
+                                                    dest_paths)
+            dest_nodes = [dest_nodes[path] for path in dest_paths]
+            pre_versions = self.node.version_lookup_bulk(
+                dest_nodes, inf, CLUSTER_NORMAL, keys=('node', 'serial',
+                                                       'size'))
+            pre_versions = dict((node, (serial, size)) for
+                                node, serial, size in pre_versions)
+            self.node.version_recluster_bulk(
+                [serial for serial, size in pre_versions.itervalues()],
+                CLUSTER_HISTORY, update_statistics_ancestors_depth=1)
+            versions = []
+            for (name, node), dest_node in zip(batch, dest_nodes):
+                p = props[node]
+                versions.append({
+                    'node': dest_node, 'hash': p[self.HASH],
+                    'size': p[self.SIZE], 'type': p[self.TYPE],
+                    'source': p[self.SERIAL], 'muser': user,
+                    'uuid': (p[self.UUID] if is_move else
+                             self._generate_uuid()),
+                    'checksum': p[self.CHECKSUM], 'cluster': CLUSTER_NORMAL,
+                    'available': p[self.AVAILABLE],
+                    'map_check_timestamp': p[self.MAP_CHECK_TIMESTAMP],
+                    'mapfile': p[self.MAPFILE] if is_move else None,
+                    'is_snapshot': p[self.IS_SNAPSHOT]})
+            created = self.node.version_create_bulk(
+                versions, update_statistics_ancestors_depth=1)
+            serials = [c[0] for c in created]
+            self.node.attribute_unset_is_latest_bulk(dest_nodes, serials)
+            self.node.attribute_copy_bulk(
+                [(props[node][self.SERIAL], node, serial, dest_node) for
+                 (name, node), serial, dest_node in
+                 zip(batch, serials, dest_nodes)])
+
+            # Store the destination mapfiles of copies.
+            for (name, node), (_, _, mapfile) in zip(batch, created):
+                p = props[node]
+                size = p[self.SIZE]
+                if size == 0 or p[self.MAPFILE] == mapfile:
+                    continue
+                try:
+                    hashmap = self._get_object_hashmap(
+                        p, update_available=False)
+                except:
+                    raise NotAllowedError(
+                        "Copy is not permitted: failed to get source "
+                        "object's mapfile: %s" % p[self.MAPFILE])
+                if p[self.IS_SNAPSHOT]:
+                    self.store.map_copy(mapfile, p[self.MAPFILE], size)
+                else:
+                    self.store.map_put(mapfile, hashmap, size,
+                                       self.block_size)
+
+            del_sizes = self._apply_versioning_bulk(
+                dest_account, dest_container, pre_versions.values(),
+                update_statistics_ancestors_depth=1)
+            size_deltas = []
+            for dest_node, v in zip(dest_nodes, versions):
+                pre_version = pre_versions.get(dest_node)
+                size_deltas.append(v['size'] - del_sizes.get(
+                    pre_version and pre_version[0], 0))
+            if any(delta > 0 for delta in size_deltas):
+                self._check_quota(dest_account_node, dest_container_node)
+            dest_versions.extend(serials)
+            occupied_space += sum(size_deltas)
+
+            # Delete the sources of moves.
+            freed_sizes = [0] * len(batch)
+            if is_move:
+                freed_sizes = self._delete_objects_batch(
+                    user, src_account, src_container, src_container_path,
+                    [name for name, _ in batch],
+                    [props[node] for _, node in batch])
+                freed_space += sum(freed_sizes)
+
+            if report_size_change:
+                for (name, _), path, occupied, freed in zip(
+                        batch, dest_paths, size_deltas, freed_sizes):
+                    self._report_size_change(user, dest_account, occupied,
+                                             dest_project, name=path)
+                    self._report_size_change(
+                        user, src_account, -freed, src_project,
+                        name='/'.join((src_container_path, name)))
+            logger.info("%s %s/%s objects from %s/%s to %s/%s",
+                        'Moved' if is_move else 'Copied',
+                        i + len(batch), total, src_container_path, prefix,
+                        dest_container_path, dest_prefix)
+        return dest_versions, occupied_space, freed_space
+
+    def _delete_objects_batch(self, user, account, container, container_path,
+                              names, props):
+        """Delete the objects with the given names, whose latest versions
+           are props, with a few statements for the whole batch.
+           Return the space freed by each object.
+        """
+
+        serials = [p[self.SERIAL] for p in props]
+        self.node.version_recluster_bulk(serials, CLUSTER_HISTORY,
+                                         update_statistics_ancestors_depth=1)
+        deleted = []
+        for p in props:
+            deleted.append({
+                'node': p[self.NODE], 'hash': None, 'size': 0, 'type': '',
+                'source': p[self.SERIAL], 'muser': user,
+                'uuid': p[self.UUID], 'checksum': '',
+                'cluster': CLUSTER_DELETED, 'available': p[self.AVAILABLE],
+                'map_check_timestamp': p[self.MAP_CHECK_TIMESTAMP],
+                'mapfile': p[self.MAPFILE],
+                'is_snapshot': p[self.IS_SNAPSHOT]})
+        created = self.node.version_create_bulk(
+            deleted, update_statistics_ancestors_depth=1)
+        self.node.attribute_unset_is_latest_bulk(
+            [p[self.NODE] for p in props], [c[0] for c in created])
+        del_sizes = self._apply_versioning_bulk(
+            account, container,
+            [(p[self.SERIAL], p[self.SIZE]) for p in props],
+            update_statistics_ancestors_depth=1)
+        self.permissions.access_clear_bulk(
+            ['/'.join((container_path, name)) for name in names])
+        self.meta_changed = True
+        return [del_sizes.get(serial, 0) for serial in serials]
+
+    def _delete_objects_bulk(self, user, account, container, prefix='',
+                             listing_limit=None):
+        """Delete the objects under prefix in batches of
+           DEFAULT_BULK_BATCH_SIZE objects, following the listing as it
+           goes. Return the space freed; the caller reports it.
+        """
+
+        container_path, container_node = self._lookup_container(account,
+                                                                container)
+        listing = self._iter_objects(
+            user, account, container, prefix, None, None, None, False, None,
+            [], False, None, None, True, False,
+            page_size=listing_limit or DEFAULT_BULK_BATCH_SIZE)
+        freed_space = 0
+        deleted = 0
+        while True:
+            batch = list(islice(listing, DEFAULT_BULK_BATCH_SIZE))
+            if not batch:
+                break
+            names = dict((t[2], t[0]) for t in batch)
+            props = self._get_versions(names.keys())
+            freed_space += sum(self._delete_objects_batch(
+                user, account, container, container_path,
+                [names[p[self.NODE]] for p in props], props))
+            deleted += len(props)
+            logger.info("Deleted %s objects from %s/%s",
+                        deleted, container_path, prefix)
+        return freed_space
+
     @debug_method
     @backend_method
     def copy_object(self, user, src_account, src_container, src_name,
@@ -1888,6 +2571,7 @@ class ModularBackend(object):
                 self._get_version(node)
             except NameError:
                 self.permissions.access_clear(path)
+                self.meta_changed = True
             self._report_size_change(
                 user, account, -size, project, name=path)
             return size
@@ -1908,19 +2592,10 @@ class ModularBackend(object):
 
         if delimiter:
             prefix = name + delimiter if not name.endswith(delimiter) else name
-            src_names = self._list_objects_no_limit(
-                user, account, container, prefix, delimiter=None,
-                virtual=False, domain=None, keys=[], shared=False, until=None,
-                size_range=None, all_props=True, public=False,
-                listing_limit=listing_limit)
-            for t in src_names:
-                path = '/'.join((account, container, t[0]))
-                del_size = self._delete_object(user, account, container, t[0],
-                                               delimiter=None,
-                                               report_size_change=False)
-                freed_space += del_size
-                paths.append(path)
+            freed_space += self._delete_objects_bulk(
+                user, account, container, prefix, listing_limit)
         self.permissions.access_clear_bulk(paths)
+        self.meta_changed = True
 
         if report_size_change:
             path = '/'.join([account, container, name])
@@ -2078,17 +2753,127 @@ class ModularBackend(object):
         """
 
         logger.debug("get_block: %s", hash)
+        cache = self.block_cache
+        if cache is not None:
+            block = cache.get(hash)
+            if block is not None:
+                return block
         block = self.store.block_get_archipelago(hash)
         if not block:
             raise ItemNotExists("Block does not exist")
+        if cache is not None:
+            cache.put(hash, block)
         return block
 
+    def get_blocks(self, hashes, window=None):
+        """Return an iterator over the data of the given blocks, in order.
+
+        Up to 'window' blocks are fetched from the storage ahead of
+        the consumer.
+
+        Raises:
+            ItemNotExists: Block does not exist
+        """
+
+        logger.debug("get_blocks: %s %s", len(hashes), window)
+        if self.block_cache is not None:
+            blocks = self._get_cached_blocks(hashes, window)
+        elif isinstance(hashes, HashList):
+            blocks = self.store.block_retr_iter(hashes.digests(), window)
+        else:
+            blocks = self.store.block_retr_iter(
+                [self._unhexlify_hash(h) for h in hashes], window)
+        for block in blocks:
+            if not block:
+                raise ItemNotExists("Block does not exist")
+            yield block
+
+    def _get_cached_blocks(self, hashes, window):
+        """Yield the given blocks, fetching only the ones missing from
+        the block cache from the storage."""
+
+        cache = self.block_cache
+        window = window or DEFAULT_BLOCK_WINDOW
+        for start in xrange(0, len(hashes), window):
+            batch = hashes[start:start + window]
+            blocks = {}
+            missing = []
+            for h in batch:
+                if h not in blocks:
+                    blocks[h] = cache.get(h)
+                    if blocks[h] is None:
+                        missing.append(h)
+            fetched = self.store.block_retr_iter(
+                [self._unhexlify_hash(h) for h in missing], window)
+            for h, block in zip(missing, fetched):
+                if block:
+                    cache.put(h, block)
+                blocks[h] = block
+            for h in batch:
+                yield blocks[h]
+
     def put_block(self, data):
         """Store a block and return the hash."""
 
         logger.debug("put_block: %s", len(data))
         return binascii.hexlify(self.store.block_put(data))
 
+    def put_blocks(self, blocks):
+        """Store the blocks yielded by an iterable and return
+        (bytes stored, list of hashes in order).
+
+        With upload workers, blocks are hashed and stored on a thread
+        pool while the next ones are being received. The number of
+        blocks in flight is bounded, to cap the memory used.
+        """
+
+        if not self.upload_workers:
+            size = 0
+            hashes = []
+            for data in blocks:
+                size += len(data)
+                hashes.append(self.put_block(data))
+            return size, hashes
+
+        pool = _get_upload_pool(self.upload_workers)
+        window = 2 * self.upload_workers
+        size = 0
+        digests = []
+        hashing = deque()  # (data, async hash), in order.
+        hashed = []  # (data, hash), waiting to be stored as a batch.
+        storing = deque()  # Async batch stores.
+
+        def store_hashed():
+            storing.append(pool.apply_async(
+                self.store.block_put_many,
+                ([d for d, h in hashed], [h for d, h in hashed])))
+            del hashed[:]
+            while len(storing) > 2:
+                storing.popleft().get()
+
+        for data in blocks:
+            size += len(data)
+            hashing.append(
+                (data, pool.apply_async(self.store.block_hash, (data,))))
+            while hashing and (len(hashing) > window or
+                               hashing[0][1].ready()):
+                data, result = hashing.popleft()
+                digest = result.get()
+                digests.append(digest)
+                hashed.append((data, digest))
+                if len(hashed) >= self.upload_workers:
+                    store_hashed()
+        for data, result in hashing:
+            digest = result.get()
+            digests.append(digest)
+            hashed.append((data, digest))
+        if hashed:
+            store_hashed()
+        for result in storing:
+            result.get()
+        logger.debug("put_blocks: %s %s", size, len(digests))
+        return size, [binascii.hexlify(h) for h in digests]
+
     def update_block(self, hash, data, offset=0, is_snapshot=False):
         """Update a known block and return the hash.
 
@@ -2363,6 +3148,15 @@ class ModularBackend(object):
                                 domain=None, keys=None, until=None,
                                 size_range=None, allowed=None,
                                 all_props=False):
+        return list(islice(self._iter_object_properties(
+            parent, path, prefix, delimiter, marker, limit, virtual, domain,
+            keys, until, size_range, allowed, all_props), limit))
+
+    def _iter_object_properties(self, parent, path, prefix='', delimiter=None,
+                                marker=None, limit=None, virtual=True,
+                                domain=None, keys=None, until=None,
+                                size_range=None, allowed=None,
+                                all_props=False, page_size=None):
         keys = keys or []
         allowed = allowed or []
         cont_prefix = path + '/'
@@ -2371,14 +3165,22 @@ class ModularBackend(object):
         before = until if until is not None else inf
         filterq = keys if domain else []
         sizeq = size_range
-
-        objects, prefixes = self.node.latest_version_list(
-            parent, prefix, delimiter, start, limit, before, CLUSTER_DELETED,
-            allowed, domain, filterq, sizeq, all_props)
-        objects.extend([(p, None) for p in prefixes] if virtual else [])
-        objects.sort(key=lambda x: x[0])
-        objects = [(x[0][len(cont_prefix):],) + x[1:] for x in objects]
-        return objects
+        kwargs = {'page_size': page_size} if page_size else {}
+        if not virtual and delimiter:
+            # Common prefixes are dropped, so they must not count.
+            limit = None
+
+        cz = len(cont_prefix)
+        for props in self.node.latest_version_iter(
+                parent, prefix, delimiter, start, limit, before,
+                CLUSTER_DELETED, allowed, domain, filterq, sizeq, all_props,
+                **kwargs):
+            if props[1] is None:
+                if not virtual:
+                    continue
+                yield (props[0][cz:], None)
+            else:
+                yield (props[0][cz:],) + tuple(props[1:])
 
     # Reporting functions.
 
@@ -2396,12 +3198,75 @@ class ModularBackend(object):
         if not self.using_external_quotaholder:
             return
 
+        if self.quota_leases is not None and size > 0:
+            self._spend_quota_lease(account, size, source, name)
+        else:
+            self._issue_commission(account, size, source, name)
+
+    def _issue_commission(self, account, size, source, name):
+        if size == 0:
+            return
         serial = self.astakosclient.issue_one_commission(
             holder=account,
             provisions={(source, 'pithos.diskspace'): size},
             name=name)
         self.serials.append(serial)
 
+    def _spend_quota_lease(self, account, size, source, name):
+        """Spend size from the quota leased for account on source.
+
+        When the lease is exhausted or expired, a single commission gives
+        back what is left of it and reserves size plus a new lease.
+        Without headroom for a new lease, only size is reserved, and no
+        lease is asked for until the refused one would have expired.
+        Leases are journaled along with the request.
+        """
+
+        leases = self.quota_leases
+        key = (account, source)
+        lease_id = leases.spend(key, size)
+        if lease_id is not None:
+            self.commission_serials.spend_lease(lease_id, size)
+            self.lease_spent.append((key, lease_id, size))
+            return
+
+        left = 0
+        lease = leases.release(key)
+        if lease is not None:
+            self.lease_released.append((key, lease))
+            # Stale leases may have been given back by another worker.
+            if self.commission_serials.delete_lease(lease[0]):
+                left = lease[1]
+        if leases.refused(key):
+            self._issue_commission(account, size - left, source, name)
+            return
+        try:
+            self._issue_commission(account, size + leases.size - left,
+                                   source, name)
+        except QuotaLimit:
+            leases.refuse(key)
+            self._issue_commission(account, size - left, source, name)
+        else:
+            expires = leases.expiry()
+            lease_id = self.commission_serials.insert_lease(
+                account, source, leases.size, expires, leases.owner)
+            self.lease_granted.append((key, [lease_id, leases.size,
+                                             expires]))
+
+    @backend_method
+    def _release_quota_leases(self, exiting=False):
+        leases = self.quota_leases
+        owner = leases.owner
+        for lease_id, holder, source, amount, expires, lease_owner in \
+                self.commission_serials.list_leases():
+            if exiting:
+                if lease_owner != owner:
+                    continue
+            elif not leases.stale(lease_owner, float(expires)):
+                continue
+            if self.commission_serials.delete_lease(lease_id):
+                self._issue_commission(holder, -amount, source, '')
+
     # Policy functions.
 
     def _check_project(self, value):
@@ -2490,6 +3355,29 @@ class ModularBackend(object):
                 version_id, keys=('size',))[0]
         return 0
 
+    def _apply_versioning_bulk(self, account, container, versions,
+                               update_statistics_ancestors_depth=None):
+        """Delete the provided (version, size) pairs if such is the policy.
+           Return a dict mapping the versions to the size removed.
+        """
+
+        if not versions:
+            return {}
+        path, node = self._lookup_container(account, container)
+        versioning = self._get_policy(
+            node, is_account_policy=False)[VERSIONING_POLICY]
+        if versioning != 'auto':
+            removed = self.node.version_remove_bulk(
+                [version_id for version_id, size in versions],
+                update_statistics_ancestors_depth)
+            for version_id, hash, size in removed:
+                self.store.map_delete(hash)
+            return dict((version_id, size) for
+                        version_id, hash, size in removed)
+        elif self.free_versioning:
+            return dict(versions)
+        return {}
+
     # Access control functions.
 
     def _check_account(self, user):
@@ -2621,8 +3509,7 @@ class ModularBackend(object):
         path = self._get_permissions_path(account, container, name)
         if not path:
             raise NotAllowedError("User does not have access to the object")
-        if (not self.permissions.access_check(path, self.READ, user) and not
-                self.permissions.access_check(path, self.WRITE, user)):
+        if not self.permissions.access_check_many([path], user):
             raise NotAllowedError("User does not have read access "
                                   "to the object")
 
@@ -2672,9 +3559,11 @@ class ModularBackend(object):
                                is provided
         """
         if check_permissions:
+            # Objects owned by the user are selected by the database,
+            # instead of listing every path of the account.
             allowed_paths = self.permissions.access_list_paths(
-                user, include_owned=user is not None, include_containers=False)
-            if not allowed_paths:
+                user, include_owned=False, include_containers=False)
+            if not allowed_paths and user is None:
                 return []
         else:
             if user is not None:
@@ -2683,10 +3572,15 @@ class ModularBackend(object):
                                      'permission check should be enforced.')
             allowed_paths = None
         obj_list = self.node.domain_object_list(
-            domain, allowed_paths, CLUSTER_NORMAL)
+            domain, allowed_paths, CLUSTER_NORMAL, account=user)
+        permissions = {}
+        paths = [path for path, _, _ in obj_list]
+        for i in xrange(0, len(paths), DEFAULT_PATHS_PER_QUERY):
+            permissions.update(self.permissions.access_get_bulk(
+                paths[i:i + DEFAULT_PATHS_PER_QUERY]))
         return [(path,
                  self._build_metadata(props, user_defined_meta),
-                 self.permissions.access_get(path)) for
+                 permissions.get(path, {})) for
                 path, props, user_defined_meta in obj_list]
 
     # util functions
@@ -2726,6 +3620,37 @@ class ModularBackend(object):
         else:
             return True
 
+    def _merkle_hash(self, map_, base_hash=None):
+        """Return the Merkle root of map_, reusing the cached tree of
+        base_hash, if any."""
+
+        cache = self.merkle_cache
+        if cache is None:
+            return map_.hash()
+        base = None
+        if base_hash:
+            packed = cache.get(binascii.unhexlify(base_hash))
+            if packed is not None:
+                base = self._unpack_tree(packed)
+        tree = map_.tree(base)
+        root = tree[-1][0]
+        cache.put(root, ''.join(''.join(level) for level in tree))
+        return root
+
+    def _unpack_tree(self, packed):
+        ds = self.digest_size
+        levels = []
+        o = 0
+        n = len(packed) / ds
+        # A tree with s padded leaves has 2 * s - 1 nodes.
+        s = (n + 1) / 2
+        while s >= 1:
+            levels.append([packed[i:i + ds]
+                           for i in xrange(o, o + s * ds, ds)])
+            o += s * ds
+            s = s / 2
+        return levels
+
     def _unhexlify_hash(self, hash):
         try:
             return binascii.unhexlify(hash)
@@ -15,17 +15,25 @@
 
 from pithos.backends.test.common import CommonMixin
 from pithos.backends.test.quota import TestQuotaMixin
-from pithos.backends.test.delete_by_uuid import TestDeleteByUUIDMixin
+from pithos.backends.test.uuid_methods import TestUUIDMixin
 from pithos.backends.test.snapshots import TestSnapshotsMixin
+from pithos.backends.test.blocks import TestBlocksMixin
+from pithos.backends.test.statistics import TestStatisticsMixin
+from pithos.backends.test.listing import TestListingMixin
+from pithos.backends.test.collector import TestCollectorMixin
+from pithos.backends.test.dbwrapper import TestDBWrapperMixin
 
 from sqlalchemy import create_engine
 
 import os
+import shutil
 import time
 
 
-class TestSQLAlchemyBackend(CommonMixin, TestDeleteByUUIDMixin,
-                            TestQuotaMixin, TestSnapshotsMixin):
+class TestSQLAlchemyBackend(CommonMixin, TestUUIDMixin,
+                            TestQuotaMixin, TestSnapshotsMixin,
+                            TestBlocksMixin, TestStatisticsMixin,
+                            TestListingMixin, TestDBWrapperMixin):
     db_module = 'pithos.backends.lib.sqlalchemy'
     db_connection_str = \
         '%(scheme)s://%(user)s:%(pwd)s@%(host)s:%(port)s/%(name)s'
@@ -62,8 +70,9 @@ class TestSQLAlchemyBackend(CommonMixin, TestDeleteByUUIDMixin,
         c.connection.connection.set_isolation_level(1)
 
 
-class TestSQLiteBackend(CommonMixin, TestDeleteByUUIDMixin, TestQuotaMixin,
-                        TestSnapshotsMixin):
+class TestSQLiteBackend(CommonMixin, TestUUIDMixin, TestQuotaMixin,
+                        TestSnapshotsMixin, TestBlocksMixin,
+                        TestStatisticsMixin, TestListingMixin):
     db_module = 'pithos.backends.lib.sqlite'
     db_connection = location = '/tmp/test_pithos_backend.db'
     mapfile_prefix = 'snf_test_pithos_backend_sqlite_%s_' % \
@@ -76,3 +85,25 @@ class TestSQLiteBackend(CommonMixin, TestDeleteByUUIDMixin, TestQuotaMixin,
     @classmethod
     def destroy_db(cls):
         os.remove(cls.location)
+
+
+class TestSQLiteFileStoreBackend(CommonMixin, TestUUIDMixin, TestQuotaMixin,
+                                 TestSnapshotsMixin, TestBlocksMixin,
+                                 TestStatisticsMixin, TestListingMixin,
+                                 TestCollectorMixin):
+    db_module = 'pithos.backends.lib.sqlite'
+    db_connection = location = '/tmp/test_pithos_backend_filestore.db'
+    mapfile_prefix = 'snf_test_pithos_backend_filestore_%s_' % \
+        time.time()
+    block_module = 'pithos.backends.lib.filestore'
+    block_path = '/tmp/test_pithos_backend_filestore'
+    block_params = {'path': block_path, 'fsync': False}
+
+    @classmethod
+    def create_db(cls):
+        pass
+
+    @classmethod
+    def destroy_db(cls):
+        os.remove(cls.location)
+        shutil.rmtree(cls.block_path, ignore_errors=True)
@@ -0,0 +1,230 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pithos.backends.test.util import get_random_data, get_random_name
+
+from pithos.backends.cache import LRUCache
+from pithos.backends.modular import HashList, HashMap
+from pithos.backends.exceptions import ItemNotExists
+
+import binascii
+import hashlib
+
+
+class TestBlocksMixin(object):
+    def test_get_blocks(self):
+        data = [get_random_data(self.block_size) for i in xrange(5)]
+        hashes = [self.b.put_block(d) for d in data]
+
+        # Repeated hashes are returned once per occurrence, in order.
+        hashes = hashes + hashes[:2]
+        data = data + data[:2]
+        for window in (None, 1, 2, 64):
+            blocks = list(self.b.get_blocks(hashes, window=window))
+            self.assertEqual(blocks, data)
+            self.assertEqual(blocks,
+                             [self.b.get_block(h) for h in hashes])
+
+    def test_get_blocks_missing(self):
+        data = get_random_data(self.block_size)
+        h = self.b.put_block(data)
+        missing = '0' * len(h)
+
+        blocks = self.b.get_blocks([h, missing])
+        self.assertEqual(blocks.next(), data)
+        self.assertRaises(ItemNotExists, blocks.next)
+
+    def test_put_block_memoryview(self):
+        data = get_random_data(self.block_size)
+        buf = bytearray(data + get_random_data(8))
+        h = self.b.put_block(memoryview(buf)[:self.block_size])
+        self.assertEqual(h, self.b.put_block(data))
+        self.assertEqual(self.b.get_block(h), data)
+
+        patch = memoryview(buf)[self.block_size:]
+        updated = self.b.update_block(h, patch, offset=4)
+        self.assertEqual(self.b.get_block(updated),
+                         data[:4] + str(buf[self.block_size:]) + data[12:])
+
+        # Padded blocks hash as their data.
+        short = get_random_data(self.block_size / 2)
+        padded = bytearray(short) + bytearray(self.block_size / 2)
+        self.assertEqual(self.b.put_block(padded), self.b.put_block(short))
+
+    def test_block_cache(self):
+        cache = self.b.block_cache = LRUCache(3 * self.block_size)
+        data = [get_random_data(self.block_size) for i in xrange(4)]
+        hashes = [self.b.put_block(d) for d in data]
+
+        self.assertEqual(self.b.get_block(hashes[0]), data[0])
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(self.b.get_block(hashes[0]), data[0])
+        self.assertEqual(cache.hits, 1)
+
+        blocks = list(self.b.get_blocks(hashes[:3] + hashes[:1]))
+        self.assertEqual(blocks, data[:3] + data[:1])
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(len(cache), 3)
+
+        # The least recently used block is evicted to stay in budget.
+        self.assertEqual(self.b.get_block(hashes[0]), data[0])
+        self.assertEqual(self.b.get_block(hashes[3]), data[3])
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.used, 3 * self.block_size)
+        self.assertTrue(hashes[1] not in cache)
+        self.assertTrue(hashes[0] in cache)
+
+        missing = '0' * len(hashes[0])
+        self.assertRaises(ItemNotExists, self.b.get_block, missing)
+        self.assertRaises(ItemNotExists, list,
+                          self.b.get_blocks([hashes[0], missing]))
+        self.assertTrue(missing not in cache)
+
+    def test_map_cache(self):
+        cache = self.b.map_cache = LRUCache(1024)
+        container = get_random_name()
+        obj = get_random_name()
+        t = self.account, self.account, container, obj
+        self.b.put_container(*t[:-1])
+
+        data = [get_random_data(self.block_size) for i in xrange(3)]
+        hashmap = [self.b.put_block(d) for d in data]
+        self.b.update_object_hashmap(*t, size=3 * self.block_size,
+                                     type='application/octet-stream',
+                                     hashmap=hashmap, checksum='',
+                                     domain='pithos')
+
+        self.assertEqual(self.b.get_object_hashmap(*t)[2], hashmap)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(cache.used, 3 * len(hashmap[0]) / 2)
+        self.assertEqual(self.b.get_object_hashmap(*t)[2], hashmap)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_hashlist(self):
+        hashes = [self.b.put_block(get_random_data(8)) for i in xrange(4)]
+        hl = HashList.from_hexlist(self.b.digest_size, hashes)
+
+        self.assertEqual(len(hl), 4)
+        self.assertEqual(list(hl), hashes)
+        self.assertEqual(hl, hashes)
+        self.assertEqual(hl[-1], hashes[-1])
+        self.assertEqual(hl[1:3], hashes[1:3])
+        self.assertTrue(isinstance(hl[1:3], HashList))
+        self.assertEqual(hl[::2], hashes[::2])
+        self.assertEqual([] + hl, hashes)
+        self.assertRaises(IndexError, hl.__getitem__, 4)
+
+        hl[0] = hashes[3]
+        hl.append(hashes[0])
+        self.assertEqual(hl, hashes[3:] + hashes[1:] + hashes[:1])
+        self.assertEqual(hl.digest(0), hl.digests()[0])
+        self.assertNotEqual(hl, hashes)
+
+    def test_object_hashmap_is_hashlist(self):
+        container = get_random_name()
+        obj = get_random_name()
+        t = self.account, self.account, container, obj
+        self.b.put_container(*t[:-1])
+
+        data = [get_random_data(self.block_size) for i in xrange(2)]
+        hashmap = [self.b.put_block(d) for d in data]
+        self.b.update_object_hashmap(*t, size=2 * self.block_size,
+                                     type='application/octet-stream',
+                                     hashmap=hashmap, checksum='',
+                                     domain='pithos')
+        _, size, hl = self.b.get_object_hashmap(*t)
+        self.assertTrue(isinstance(hl, HashList))
+        self.assertEqual(hl, hashmap)
+        self.assertEqual(list(self.b.get_blocks(hl)), data)
+
+        # Updating with the returned hashmap keeps the object unchanged.
+        hl.append(hl[0])
+        self.b.update_object_hashmap(*t, size=3 * self.block_size,
+                                     type='application/octet-stream',
+                                     hashmap=hl, checksum='',
+                                     domain='pithos')
+        self.assertEqual(self.b.get_object_hashmap(*t)[2],
+                         hashmap + hashmap[:1])
+
+    def _hashmap(self, digests):
+        map_ = HashMap(self.block_size, self.hash_algorithm)
+        map_.extend(digests)
+        return map_
+
+    def test_merkle_tree(self):
+        digest = lambda d: hashlib.new(self.hash_algorithm, d).digest()
+        leaves = [digest(str(i)) for i in xrange(11)]
+        for n in xrange(len(leaves) + 1):
+            map_ = self._hashmap(leaves[:n])
+            self.assertEqual(map_.tree()[-1][0], map_.hash())
+
+        base = self._hashmap(leaves).tree()
+        for changed in ([0], [10], [3, 4], leaves[:5] + [digest('x')],
+                        leaves[:3], leaves + leaves[:7]):
+            if isinstance(changed[0], int):
+                digests = list(leaves)
+                for i in changed:
+                    digests[i] = digest('changed')
+            else:
+                digests = changed
+            map_ = self._hashmap(digests)
+            self.assertEqual(map_.tree(base)[-1][0], map_.hash())
+
+    def test_merkle_cache(self):
+        cache = self.b.merkle_cache = LRUCache(1024 * 1024)
+        container = get_random_name()
+        obj = get_random_name()
+        t = self.account, self.account, container, obj
+        self.b.put_container(*t[:-1])
+
+        data = [get_random_data(self.block_size) for i in xrange(5)]
+        hashmap = [self.b.put_block(d) for d in data]
+        for i in xrange(3):
+            hashmap[i] = self.b.put_block(get_random_data(self.block_size))
+            _, etag = self.b.update_object_hashmap(
+                *t, size=len(hashmap) * self.block_size,
+                type='application/octet-stream', hashmap=hashmap,
+                checksum='', domain='pithos')
+            map_ = self._hashmap([binascii.unhexlify(h) for h in hashmap])
+            self.assertEqual(etag, binascii.hexlify(map_.hash()))
+        self.assertEqual(cache.hits, 2)
+
+    def test_put_blocks(self):
+        data = [get_random_data(self.block_size) for i in xrange(9)]
+        data += data[:3] + [get_random_data(10)]
+        expected = [self.b.put_block(d) for d in data[:2]]
+        expected = (sum(len(d) for d in data),
+                    expected + [binascii.hexlify(self.b.store.block_hash(d))
+                                for d in data[2:]])
+
+        for workers in (0, 1, 3):
+            self.b.upload_workers = workers
+            self.assertEqual(self.b.put_blocks(iter(data)), expected)
+            self.assertEqual(list(self.b.get_blocks(expected[1][:-1])),
+                             data[:-1])
+
+    def test_update_block(self):
+        data = get_random_data(self.block_size)
+        h = self.b.put_block(data)
+        self.assertEqual(self.b.put_block(bytearray(data)), h)
+
+        patch = get_random_data(10)
+        for offset in (0, 5, self.block_size - 4):
+            expected = data[:offset] + patch + data[offset + len(patch):]
+            expected = expected[:self.block_size]
+            for p in (patch, bytearray(patch)):
+                updated = self.b.update_block(h, p, offset=offset)
+                self.assertEqual(self.b.get_block(updated), expected)
@@ -0,0 +1,69 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pithos.backends.test.util import get_random_data, get_random_name
+
+from pithos.backends.collector import BloomFilter, GarbageCollector
+from pithos.backends.exceptions import ItemNotExists
+
+from time import time
+
+
+class TestCollectorMixin(object):
+    def test_bloom_filter(self):
+        keys = [get_random_name() for i in xrange(1000)]
+        bloom = BloomFilter(len(keys), error_rate=0.01)
+        for k in keys:
+            bloom.add(k)
+        self.assertTrue(all(k in bloom for k in keys))
+        others = [get_random_name() for i in xrange(1000)]
+        self.assertTrue(sum(k in bloom for k in others) < 50)
+
+    def test_collect_garbage(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        self.upload_object(account, account, container, 'kept')
+        self.upload_object(account, account, container, 'purged')
+        kept = self.b.get_object_hashmap(account, account, container,
+                                         'kept')[2]
+        purged = self.b.get_object_hashmap(account, account, container,
+                                           'purged')[2]
+        orphan = self.b.put_block(get_random_data(self.block_size))
+        self.b.delete_object(account, account, container, 'purged',
+                             until=time())
+
+        maps, blocks = GarbageCollector(self.b, min_age=0,
+                                        dry_run=True).collect()
+        self.assertTrue(maps[0] >= 1 and blocks[0] >= 2)
+        self.assertEqual((maps[1], blocks[1]), (0, 0))
+        self.assertTrue(self.b.get_block(orphan))
+
+        maps, blocks = GarbageCollector(self.b, min_age=0,
+                                        batch_size=1).collect()
+        self.assertEqual(maps[0], maps[1])
+        self.assertEqual(blocks[0], blocks[1])
+        for h in (orphan, purged[0]):
+            self.assertRaises(ItemNotExists, self.b.get_block, h)
+        self.assertTrue(self.b.get_block(kept[0]))
+        self.assertEqual(self.b.get_object_hashmap(account, account,
+                                                   container, 'kept')[2],
+                         kept)
+
+        # Recently modified files are spared.
+        orphan = self.b.put_block(get_random_data(self.block_size))
+        maps, blocks = GarbageCollector(self.b).collect()
+        self.assertEqual(blocks, (0, 0))
+        self.assertTrue(self.b.get_block(orphan))
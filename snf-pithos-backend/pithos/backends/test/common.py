@@ -29,6 +29,8 @@ class CommonMixin(unittest.TestCase):
     hash_algorithm = 'sha256'
     account = 'user'
     free_versioning = True
+    block_module = None
+    block_params = None
 
     @classmethod
     def setUpClass(cls):
@@ -39,12 +41,17 @@ class CommonMixin(unittest.TestCase):
         cls.destroy_db()
 
     def setUp(self):
+        kwargs = {}
+        if self.block_params is not None:
+            kwargs['block_params'] = self.block_params
         self.b = connect_backend(db_connection=self.db_connection,
                                  db_module=self.db_module,
+                                 block_module=self.block_module,
                                  block_size=self.block_size,
                                  hash_algorithm=self.hash_algorithm,
                                  free_versioning=self.free_versioning,
-                                 mapfile_prefix=self.mapfile_prefix)
+                                 mapfile_prefix=self.mapfile_prefix,
+                                 **kwargs)
         self.b.astakosclient = MagicMock()
         self.b.astakosclient.issue_one_commission.return_value = 42
         self.b.commission_serials = MagicMock()
@@ -0,0 +1,68 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import MagicMock
+
+from pithos.backends.lib.sqlalchemy.dbwrapper import DBWrapper
+from pithos.backends.lib.sqlalchemy.dbworker import DBWorker
+
+from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import bindparam, select
+
+
+class TestDBWrapperMixin(object):
+    def test_pooled_engine(self):
+        first = DBWrapper(self.db_connection, pool_size=2)
+        second = DBWrapper(self.db_connection, pool_size=2)
+        self.assertIs(first.engine, second.engine)
+        pool = first.engine.pool
+        idle = pool.checkedin()
+        first.close()
+        self.assertEqual(pool.checkedin(), idle + 1)
+        second.close()
+        self.assertEqual(pool.checkedin(), idle + 2)
+
+    def test_unpooled_engine(self):
+        wrapper = DBWrapper(self.db_connection)
+        self.assertTrue(isinstance(wrapper.engine.pool, NullPool))
+        wrapper.close()
+
+    def test_execute_prepared(self):
+        wrapper = DBWrapper('sqlite://')
+        metadata = MetaData()
+        t = Table('t', metadata, Column('id', Integer, primary_key=True),
+                  Column('name', String(16)))
+        metadata.create_all(wrapper.conn)
+        wrapper.conn.execute(t.insert(), [{'id': 1, 'name': 'a'},
+                                          {'id': 2, 'name': 'b'}])
+
+        worker = DBWorker(wrapper=wrapper)
+        build = MagicMock(side_effect=lambda: select(
+            [t.c.name], t.c.id == bindparam('id')))
+        for i, name in ((1, 'a'), (2, 'b'), (1, 'a')):
+            r = worker.execute_prepared('name', build, id=i)
+            self.assertEqual(r.fetchall(), [(name,)])
+            r.close()
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(len(wrapper.compiled_cache), 1)
+
+        r = worker.execute_prepared('count', lambda: select(
+            [t.c.id], t.c.id > bindparam('id')), id=0)
+        self.assertEqual(len(r.fetchall()), 2)
+        r.close()
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(len(wrapper.compiled_cache), 2)
+        wrapper.close()
@@ -0,0 +1,261 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from multiprocessing.pool import ThreadPool
+
+from pithos.backends.cache import LRUCache
+from pithos.backends.exceptions import NotAllowedError
+from pithos.backends.modular import HashmapSequence
+from pithos.backends.test.util import get_random_name
+
+
+class TestListingMixin(object):
+    names = ['a', 'b/', 'b/1', 'b/2', 'b/3/x', 'b0', 'c/1', 'c/2', 'c/3',
+             'd', 'e/f/g']
+
+    def _create_objects(self):
+        container = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        for name in self.names:
+            self.upload_object(self.account, self.account, container, name)
+        return container
+
+    def _iter(self, container, page_size, **kwargs):
+        path = '/'.join((self.account, container))
+        node = self.b.node.node_lookup(path)
+        return [x[:1] if x[1] is None else x[0]
+                for x in self.b._iter_object_properties(
+                    node, path, page_size=page_size, **kwargs)]
+
+    def test_list_objects_delimiter(self):
+        container = self._create_objects()
+        expected = ['a', 'b/', ('b/',), 'b0', ('c/',), 'd', ('e/',)]
+        for page_size in (1, 2, 3, 1000):
+            self.assertEqual(self._iter(container, page_size, delimiter='/'),
+                             expected)
+        self.assertEqual(self._iter(container, 2, prefix='b/',
+                                    delimiter='/'),
+                         ['b/', 'b/1', 'b/2', ('b/3/',)])
+
+        # Prefixes count towards the limit.
+        objects = self.b.list_objects(self.account, self.account, container,
+                                      delimiter='/', limit=3)
+        self.assertEqual([x[0] for x in objects], ['a', 'b/', 'b/'])
+        objects = self.b.list_objects(self.account, self.account, container,
+                                      delimiter='/', marker='b0')
+        self.assertEqual([x[0] for x in objects], ['c/', 'd', 'e/'])
+
+    def test_iter_objects(self):
+        container = self._create_objects()
+        for page_size in (1, 4, 1000):
+            self.assertEqual(self._iter(container, page_size), self.names)
+
+        objects = self.b.iter_objects(self.account, self.account, container,
+                                      limit=None)
+        self.assertEqual([x[0] for x in objects], self.names)
+        objects = self.b.iter_object_meta(self.account, self.account,
+                                          container, delimiter='/', limit=2)
+        self.assertEqual([x.get('name', x.get('subdir')) for x in objects],
+                         ['a', 'b/'])
+
+    def test_list_object_public_bulk(self):
+        container = self._create_objects()
+        self.b.update_object_public(self.account, self.account, container,
+                                    'd', True)
+        public = self.b.list_object_public_bulk(
+            self.account, self.account, container, ['a', 'b/1', 'd'])
+        path = '/'.join((self.account, container, 'd'))
+        self.assertEqual(public.keys(), [path])
+        self.assertEqual(public[path], self.b.get_object_public(
+            self.account, self.account, container, 'd'))
+        self.assertEqual(self.b.list_object_public_bulk(
+            self.account, self.account, container, []), {})
+
+    def test_get_domain_objects_shared(self):
+        container = get_random_name()
+        other = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        for name in ('b', 'a', 'c'):
+            self.upload_object(self.account, self.account, container, name)
+            self.b.update_object_meta(self.account, self.account, container,
+                                      name, 'test-domain', {'k': name})
+        self.b.update_object_permissions(self.account, self.account,
+                                         container, 'c', {'read': [other]})
+
+        objects = self.b.get_domain_objects('test-domain', user=self.account)
+        prefix = '/'.join((self.account, container, ''))
+        self.assertEqual([x[0] for x in objects],
+                         [prefix + x for x in ('a', 'b', 'c')])
+        self.assertEqual([x[1]['k'] for x in objects], ['a', 'b', 'c'])
+        self.assertEqual(objects[2][2], {'read': [other]})
+        self.assertEqual(objects[0][2], {})
+
+        objects = self.b.get_domain_objects('test-domain', user=other)
+        self.assertEqual([(x[0], x[2]) for x in objects],
+                         [(prefix + 'c', {'read': [other]})])
+
+    def test_object_permissions_bulk(self):
+        container = self._create_objects()
+        other = get_random_name()
+        group = '%s:group' % self.account
+        self.b.update_account_groups(self.account, self.account,
+                                     {'group': [other]})
+        self.b.update_object_permissions(self.account, self.account,
+                                         container, 'a', {'read': [group]})
+        self.b.update_object_permissions(self.account, self.account,
+                                         container, 'd', {'write': [other]})
+        self.b.update_object_permissions(self.account, self.account,
+                                         container, 'b0',
+                                         {'read': [get_random_name()]})
+
+        prefix = '/'.join((self.account, container, ''))
+        access = self.b.permissions.access_check_many(
+            [prefix + x for x in ('a', 'b0', 'd')], other)
+        self.assertEqual(access, {prefix + 'a': set([self.b.READ]),
+                                  prefix + 'd': set([self.b.WRITE])})
+
+        permissions = self.b.get_object_permissions_bulk(
+            other, self.account, container, ['a', 'd'])
+        self.assertEqual(permissions['a'],
+                         ('read', prefix + 'a', {'read': [group]}))
+        self.assertEqual(permissions['d'],
+                         ('write', prefix + 'd', {'write': [other]}))
+        self.assertRaises(NotAllowedError, self.b.get_object_permissions_bulk,
+                          other, self.account, container, ['a', 'b0'])
+
+        names = ['a', 'b/1', 'b0', 'c/1', 'd']
+        self.assertEqual(self.b.list_object_permissions_bulk(
+            self.account, self.account, container, names), ['a', 'b0', 'd'])
+        self.assertEqual(self.b.list_object_permissions_bulk(
+            other, self.account, container, names), ['a', 'd'])
+        self.assertEqual(self.b.list_object_permissions_bulk(
+            other, self.account, container, []), [])
+
+        # Group changes apply to the principals already computed.
+        self.b.update_account_groups(self.account, self.account, {})
+        self.assertEqual(self.b.permissions.access_check_many(
+            [prefix + 'a'], other), {})
+
+    def test_object_version_tag(self):
+        container = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        self.upload_object(self.account, self.account, container, 'a')
+        tag = self.b.get_object_version_tag(self.account, self.account,
+                                            container, 'a')
+        self.assertEqual(tag, self.b.get_object_version_tag(
+            self.account, self.account, container, 'a'))
+
+        self.b.update_object_meta(self.account, self.account, container,
+                                  'a', 'test-domain', {'k': 'v'})
+        meta_tag = self.b.get_object_version_tag(self.account, self.account,
+                                                 container, 'a')
+        self.assertNotEqual(meta_tag, tag)
+
+        version = self.b.get_object_meta(
+            self.account, self.account, container, 'a',
+            include_user_defined=False)['version']
+        self.b.update_object_checksum(self.account, self.account, container,
+                                      'a', version, 'abc')
+        self.assertNotEqual(meta_tag, self.b.get_object_version_tag(
+            self.account, self.account, container, 'a'))
+        self.assertRaises(NotAllowedError, self.b.get_object_version_tag,
+                          get_random_name(), self.account, container, 'a')
+
+        # Permission changes drop the cached metadata.
+        self.b.meta_cache = LRUCache(10, sizeof=lambda x: 1)
+        self.b.meta_cache.put('key', 'meta')
+        self.b.get_object_meta(self.account, self.account, container, 'a',
+                               include_user_defined=False)
+        self.assertEqual(len(self.b.meta_cache), 1)
+        self.b.update_object_permissions(self.account, self.account,
+                                         container, 'a',
+                                         {'read': [get_random_name()]})
+        self.assertEqual(len(self.b.meta_cache), 0)
+        self.b.meta_cache.put('key', 'meta')
+        self.b.update_object_public(self.account, self.account, container,
+                                    'a', True)
+        self.assertEqual(len(self.b.meta_cache), 0)
+
+    def test_get_manifest_hashmaps(self):
+        container = self._create_objects()
+        names = [x for x in self.names if x.startswith('b/')]
+        expected = [self.b.get_object_hashmap(self.account, self.account,
+                                              container, x)[1:]
+                    for x in names]
+        for workers in (0, 2):
+            self.b.upload_workers = workers
+            sizes, hashmaps = self.b.get_manifest_hashmaps(
+                self.account, self.account, container, 'b/')
+            self.assertEqual(len(hashmaps), len(names))
+            self.assertEqual(list(zip(sizes, hashmaps)), expected)
+            self.assertEqual(hashmaps[-1], expected[-1][1])
+        self.b.upload_workers = 0
+
+        # Listed once while the objects under the prefix are unchanged,
+        # but read through the calling backend every time.
+        self.b.manifest_cache = LRUCache(100, sizeof=lambda x: len(x[1]))
+        sizes, hashmaps = self.b.get_manifest_hashmaps(
+            self.account, self.account, container, 'b/')
+        read = self.b._get_object_hashmap
+        with patch.object(self.b, '_list_objects_no_limit') as listing:
+            with patch.object(self.b, '_get_object_hashmap',
+                              side_effect=read) as reader:
+                cached = self.b.get_manifest_hashmaps(
+                    self.account, self.account, container, 'b/')
+        self.assertFalse(listing.called)
+        self.assertTrue(reader.called)
+        self.assertIsNot(cached[1], hashmaps)
+        self.assertEqual(list(zip(*cached)), expected)
+        self.b.delete_object(self.account, self.account, container, 'b/2')
+        sizes, hashmaps = self.b.get_manifest_hashmaps(
+            self.account, self.account, container, 'b/')
+        self.assertEqual(len(hashmaps), len(names) - 1)
+        self.upload_object(self.account, self.account, container, 'b/4')
+        sizes, hashmaps = self.b.get_manifest_hashmaps(
+            self.account, self.account, container, 'b/')
+        self.assertEqual(len(hashmaps), len(names))
+        self.assertRaises(NotAllowedError, self.b.get_manifest_hashmaps,
+                          get_random_name(), self.account, container, 'b/')
+
+        # A segment that cannot be read fails the call and is not cached.
+        self.b.manifest_cache.clear()
+        with patch.object(self.b, '_get_map', side_effect=IOError):
+            self.assertRaises(IOError, self.b.get_manifest_hashmaps,
+                              self.account, self.account, container, 'b/')
+        self.assertEqual(len(self.b.manifest_cache), 0)
+        sizes, hashmaps = self.b.get_manifest_hashmaps(
+            self.account, self.account, container, 'b/')
+        self.assertEqual(len(self.b.manifest_cache), 1)
+
+    def test_hashmap_sequence_failures(self):
+        failures = set(['a', 'c'])
+
+        def read(version):
+            if version in failures:
+                failures.remove(version)
+                raise IOError(version)
+            return [version]
+
+        for pool in (None, ThreadPool(2)):
+            failures.update(['a', 'c'])
+            hashmaps = HashmapSequence(read, ['a', 'b', 'c'], pool, 2)
+            self.assertRaises(IOError, hashmaps.__getitem__, 0)
+            self.assertEqual(hashmaps[1], ['b'])
+            self.assertRaises(IOError, hashmaps.__getitem__, 2)
+            # Failed reads are retried rather than raised again.
+            self.assertEqual(list(hashmaps), [['a'], ['b'], ['c']])
+            if pool is not None:
+                pool.close()
@@ -13,11 +13,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from mock import call
+from mock import call, patch
 from functools import wraps, partial
+from itertools import count
+from threading import Event
+from time import time
+
+import errno
+import os
 
 import uuid as uuidlib
 
+from pithos.backends.commissions import CommissionResolver
+from pithos.backends.leases import QuotaLeases
 from pithos.backends.random_word import get_random_word
 
 
@@ -785,3 +793,165 @@ class TestQuotaMixin(object):
                 holder=account,
                 provisions={(project, 'pithos.diskspace'): -len(data)},
                 name='/'.join([account, container, folder, '']))]
+
+    def test_quota_leases(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        _, container_node = self.b._lookup_container(account, container)
+        project = self.b._get_project(container_node)
+        client = self.b.astakosclient
+        issue = client.issue_one_commission
+        serials = count(1)
+        issue.side_effect = lambda **kwargs: serials.next()
+        client.resolve_commissions.side_effect = \
+            lambda accept_serials, reject_serials: {
+                'accepted': accept_serials, 'rejected': reject_serials,
+                'failed': []}
+        # Journal the leases for real.
+        journal = self.b.commission_serials = \
+            self.b.db_module.QuotaholderSerial(wrapper=self.b.wrapper)
+        self.b.quota_leases = QuotaLeases(100, ttl=60)
+        exit_hooks = []
+
+        def upload(obj, length):
+            self.upload_object(account, account, container, obj,
+                               data=get_random_data(length), length=length)
+
+        def commission(obj, size):
+            return call(holder=account,
+                        provisions={(project, 'pithos.diskspace'): size},
+                        name='/'.join([account, container, obj]))
+
+        def release(size):
+            return call(holder=account,
+                        provisions={(project, 'pithos.diskspace'): -size},
+                        name='')
+
+        def leases():
+            return [x[3] for x in journal.list_leases()]
+
+        with patch('pithos.backends.leases.atexit.register',
+                   exit_hooks.append):
+            # The first upload reserves a lease along with its own size,
+            # which later uploads spend until it is exhausted.
+            upload('a', 60)
+            upload('b', 30)
+            upload('c', 80)
+            self.assertEqual(issue.call_args_list,
+                             [commission('a', 160), commission('c', 110)])
+            self.assertEqual(leases(), [100])
+
+            # Space spent by failed requests returns to the lease.
+            self.b.pre_exec()
+            upload('d', 40)
+            self.b.post_exec(False)
+            upload('d', 40)
+            self.assertEqual(len(issue.call_args_list), 2)
+            self.assertEqual(leases(), [60])
+
+            # Without headroom for a new lease, only the change is reserved
+            # and no lease is asked for until the refusal expires.
+            with patch('pithos.backends.modular.QuotaLimit', ValueError):
+                issue.side_effect = [ValueError, 3, 4]
+                upload('e', 70)
+                upload('f', 5)
+            self.assertEqual(issue.call_args_list[2:],
+                             [commission('e', 110), commission('e', 10),
+                              commission('f', 5)])
+            self.assertEqual(leases(), [])
+
+            # A lease left by a worker that crashed on this host is given
+            # back once another worker starts.
+            issue.side_effect = lambda **kwargs: serials.next()
+            pid = os.getpid()
+            with patch('pithos.backends.leases.os.getpid', lambda: pid + 1):
+                self.b.quota_leases = QuotaLeases(100, ttl=60)
+                upload('g', 10)
+            self.assertEqual(leases(), [100])
+            issue.reset_mock()
+            self.b.quota_leases = QuotaLeases(100, ttl=60)
+            with patch('pithos.backends.leases.os.kill',
+                       side_effect=OSError(errno.ESRCH, '')):
+                upload('h', 10)
+            self.assertEqual(issue.call_args_list,
+                             [commission('h', 110), release(100)])
+            self.assertEqual(leases(), [100])
+
+            # Leases of other hosts are given back a ttl after they expire.
+            self.b.pre_exec()
+            journal.insert_lease(account, project, 50, time(), 'other:1')
+            self.b.post_exec()
+            upload('i', 20)
+            self.assertEqual(sorted(leases()), [50, 80])
+            issue.reset_mock()
+            with patch('pithos.backends.leases.time', lambda: time() + 120):
+                upload('j', 1)
+            self.assertEqual(issue.call_args_list,
+                             [commission('j', 21), release(50)])
+            self.assertEqual(leases(), [100])
+
+            # The worker gives back its own leases when it exits.
+            issue.reset_mock()
+            for hook in exit_hooks:
+                hook()
+            self.assertEqual(issue.call_args_list, [release(100)])
+            self.assertEqual(leases(), [])
+
+    def test_commission_resolver(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        client = self.b.astakosclient
+        serials = count(1)
+        client.issue_one_commission.side_effect = \
+            lambda **kwargs: serials.next()
+        failures = []
+        resolved = Event()
+
+        def resolve_commissions(accept_serials, reject_serials):
+            if failures:
+                raise failures.pop()
+            resolved.set()
+            return {'accepted': accept_serials, 'rejected': reject_serials,
+                    'failed': []}
+        client.resolve_commissions.side_effect = resolve_commissions
+
+        # Serials are collected for a minute, unless stopped earlier.
+        resolver = self.b.commission_resolver = CommissionResolver(60)
+        self.addCleanup(resolver.stop)
+        for obj in ('a', 'b', 'c'):
+            self.upload_object(account, account, container, obj)
+        self.b.pre_exec()
+        self.upload_object(account, account, container, 'd')
+        self.b.post_exec(False)
+        self.assertFalse(client.resolve_commissions.called)
+        self.assertEqual(
+            self.b.commission_serials.insert_many.call_args_list,
+            [call([1]), call([2]), call([3])])
+
+        # A single call resolves the commissions of all the requests.
+        self.assertTrue(resolver.stop())
+        client.resolve_commissions.assert_called_once_with(
+            accept_serials=[1, 2, 3], reject_serials=[4])
+        self.assertFalse(self.b.commission_serials.delete_many.called)
+        self.b.get_container_meta(account, account, container,
+                                  include_user_defined=False)
+        self.b.commission_serials.delete_many.assert_called_once_with(
+            [1, 2, 3])
+
+        # Serials are kept for a later attempt if the quotaholder fails.
+        resolver = self.b.commission_resolver = CommissionResolver(0.01)
+        self.addCleanup(resolver.stop)
+        client.resolve_commissions.reset_mock()
+        failures.append(ValueError())
+        resolved.clear()
+        with patch('pithos.backends.commissions.RETRY_DELAY', 0.01):
+            self.upload_object(account, account, container, 'e')
+            self.assertTrue(resolved.wait(10))
+            resolver.stop()
+        self.assertEqual(client.resolve_commissions.call_args_list,
+                         [call(accept_serials=[5], reject_serials=[])] * 2)
+        self.b.get_container_meta(account, account, container,
+                                  include_user_defined=False)
+        self.b.commission_serials.delete_many.assert_called_with([5])
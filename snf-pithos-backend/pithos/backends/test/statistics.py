@@ -0,0 +1,219 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from threading import Thread
+from time import sleep
+
+from pithos.backends.modular import CLUSTER_DELETED
+from pithos.backends.test.util import get_random_name
+from pithos.backends.util import connect_backend
+
+
+class TestStatisticsMixin(object):
+    def _container_stats(self, container):
+        meta = self.b.get_container_meta(self.account, self.account,
+                                         container, include_user_defined=False)
+        return meta['count'], meta['bytes']
+
+    def test_deferred_statistics(self):
+        container = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+
+        self.b.node.deferred_statistics = True
+        objects = [get_random_name() for i in xrange(3)]
+        sizes = [len(self.upload_object(self.account, self.account,
+                                        container, obj))
+                 for obj in objects]
+        self.b.delete_object(self.account, self.account, container,
+                             objects[0])
+        stats = self._container_stats(container)
+        self.assertEqual(stats, (2, sum(sizes[1:])))
+
+        # Folding the deltas leaves the statistics unchanged.
+        while self.b.node.statistics_fold(limit=2):
+            pass
+        self.assertEqual(self._container_stats(container), stats)
+        self.assertEqual(self.b.node.statistics_fold(), 0)
+
+        # Immediate updates apply on top of the folded values.
+        self.b.node.deferred_statistics = False
+        data = self.upload_object(self.account, self.account, container,
+                                  objects[0])
+        self.assertEqual(self._container_stats(container),
+                         (3, sum(sizes[1:]) + len(data)))
+
+    def test_overlapping_statistics_folds(self):
+        container = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        self.b.node.deferred_statistics = True
+        sizes = [len(self.upload_object(self.account, self.account,
+                                        container, get_random_name()))
+                 for i in xrange(3)]
+        self.b.node.deferred_statistics = False
+
+        kwargs = {}
+        if self.block_params is not None:
+            kwargs['block_params'] = self.block_params
+        other = connect_backend(db_connection=self.db_connection,
+                                db_module=self.db_module,
+                                block_module=self.block_module,
+                                block_size=self.block_size,
+                                hash_algorithm=self.hash_algorithm,
+                                mapfile_prefix=self.mapfile_prefix,
+                                **kwargs)
+        folded = []
+
+        def fold():
+            other.pre_exec()
+            folded.append(other.node.statistics_fold())
+            other.post_exec()
+
+        # The second fold waits for the first and counts each delta once.
+        self.b.pre_exec()
+        folded.append(self.b.node.statistics_fold())
+        t = Thread(target=fold)
+        t.start()
+        sleep(0.2)
+        self.b.post_exec()
+        t.join()
+        other.close()
+        self.assertEqual(folded[1], 0)
+        self.assertEqual(self._container_stats(container), (3, sum(sizes)))
+
+    def test_node_get_ancestors(self):
+        container = get_random_name()
+        obj = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        self.upload_object(self.account, self.account, container, obj)
+
+        lookup = self.b.node.node_lookup
+        account_node = lookup(self.account)
+        container_node = lookup('/'.join((self.account, container)))
+        obj_node = lookup('/'.join((self.account, container, obj)))
+        self.assertEqual(self.b.node.node_get_ancestors(obj_node),
+                         [container_node, account_node, 0])
+        self.assertEqual(self.b.node.node_get_ancestors(obj_node, depth=1),
+                         [container_node])
+        self.assertEqual(self.b.node.node_get_ancestors(obj_node, depth=0),
+                         [])
+        self.assertEqual(self.b.node.node_get_ancestors(container_node),
+                         [account_node, 0])
+        self.assertEqual(self.b.node.node_get_ancestors(0), [])
+
+    @patch('pithos.backends.modular.DEFAULT_BULK_BATCH_SIZE', 2)
+    def test_copy_move_dir_in_batches(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        self.create_folder(account, account, container, 'a')
+        names = ['a/%d' % i for i in xrange(5)]
+        sizes = [len(self.upload_object(account, account, container, name))
+                 for name in names]
+        self.b.update_object_meta(account, account, container, names[0],
+                                  'pithos', {'k': 'v'})
+        self.b.update_object_permissions(account, account, container,
+                                         names[1], {'read': ['*']})
+
+        self.b.copy_object(account, account, container, 'a', account,
+                           container, 'b', 'application/directory',
+                           domain='pithos', delimiter='/')
+        self.assertEqual(self._container_stats(container),
+                         (12, 2 * sum(sizes)))
+        meta = self.b.get_object_meta(account, account, container, 'b/0',
+                                      'pithos')
+        self.assertEqual(meta['k'], 'v')
+        self.assertNotEqual(meta['uuid'], self.b.get_object_meta(
+            account, account, container, 'a/0', 'pithos')['uuid'])
+        self.assertEqual(self.b.get_object_hashmap(
+            account, account, container, 'b/4'), self.b.get_object_hashmap(
+            account, account, container, 'a/4'))
+
+        uuid = meta['uuid']
+        other = get_random_name()
+        self.b.put_container(account, account, other)
+        self.b.move_object(account, account, container, 'b', account, other,
+                           'c', 'application/directory', domain='pithos',
+                           delimiter='/')
+        self.assertEqual(self._container_stats(container), (6, sum(sizes)))
+        self.assertEqual(self._container_stats(other), (6, sum(sizes)))
+        objects = self.b.list_objects(account, account, other)
+        self.assertEqual([x[0] for x in objects],
+                         ['c'] + [x.replace('a/', 'c/') for x in names])
+        self.assertEqual(self.b.get_object_meta(
+            account, account, other, 'c/0', 'pithos')['uuid'], uuid)
+        self.assertEqual(self.b.get_object_permissions(
+            account, account, container, names[1])[2], {'read': ['*']})
+        self.assertObjectNotExist(account, container, 'b/0')
+
+    @patch('pithos.backends.modular.DEFAULT_BULK_BATCH_SIZE', 2)
+    def test_delete_dir_in_batches(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        self.create_folder(account, account, container, 'a')
+        names = ['a/%d' % i for i in xrange(5)]
+        for name in names:
+            self.upload_object(account, account, container, name)
+        data = self.upload_object(account, account, container, 'b')
+        self.b.update_object_permissions(account, account, container,
+                                         names[1], {'read': ['*']})
+
+        self.b.delete_object(account, account, container, 'a',
+                             delimiter='/')
+        self.assertEqual(self._container_stats(container), (1, len(data)))
+        self.assertEqual([x[0] for x in self.b.list_objects(
+            account, account, container)], ['b'])
+        self.assertEqual(self.b.node.node_count_children(
+            self.b.node.node_lookup('/'.join((account, container)))), 7)
+        for name in names:
+            self.assertObjectNotExist(account, container, name)
+
+        self.b.delete_container(account, account, container, delimiter='/')
+        self.assertEqual(self._container_stats(container), (0, 0))
+
+    @patch('pithos.backends.modular.DEFAULT_BULK_BATCH_SIZE', 2)
+    def test_delete_in_batches_like_single(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        self.create_folder(account, account, container, 'a')
+        for name in ('a/0', 'b'):
+            self.upload_object(account, account, container, name)
+        prefix = '/'.join((account, container, ''))
+        nodes = dict((name, self.b.node.node_lookup(prefix + name))
+                     for name in ('a/0', 'b'))
+        sources = dict((name, self.b.node.version_lookup(node))
+                       for name, node in nodes.iteritems())
+
+        # The batch deletes a/0; b is deleted on its own.
+        self.b.delete_object(account, account, container, 'a',
+                             delimiter='/')
+        self.b.delete_object(account, account, container, 'b')
+
+        b = self.b
+        deleted = {}
+        for name, node in nodes.iteritems():
+            src = sources[name]
+            props = b.node.version_lookup(node, cluster=CLUSTER_DELETED)
+            self.assertEqual(props[b.SOURCE], src[b.SERIAL])
+            self.assertEqual(props[b.UUID], src[b.UUID])
+            self.assertEqual(props[b.MAPFILE], src[b.MAPFILE])
+            deleted[name] = [props[k] for k in (
+                b.HASH, b.SIZE, b.TYPE, b.MUSER, b.CHECKSUM, b.CLUSTER,
+                b.AVAILABLE, b.MAP_CHECK_TIMESTAMP, b.IS_SNAPSHOT)]
+        self.assertEqual(deleted['a/0'], deleted['b'])
+        self.assertNotEqual(sources['a/0'][b.MAPFILE], None)
+        self.b.delete_container(account, account, container)